@@ -16,10 +16,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from circhemy.cli import cli
+import sys
+
+from circhemy.cli import daemon
 
 
 def main():
+
+    # conversions and queries go to a running query daemon first, before
+    # the CLI and the database code are imported
+    status = daemon.forward(sys.argv[1:])
+
+    if status is not None:
+        exit(status)
+
+    from circhemy.cli import cli
+
     cli.main()
 
 
@@ -19,11 +19,459 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import os
 import sys
+import threading
 import circhemy.common.util as common
+from circhemy.cli import daemon
+from circhemy.common import annotate, compression, writers
 
 util = common.Util
 
+# conversion function of this process, set up by init_convert_worker
+convert_function = None
+
+# per-thread database connections of query --threads
+query_thread_state = threading.local()
+
+# conversion engines live as long as the process, a daemon answers every
+# request from the same mapped index files and loaded columns
+# input field -> LookupIndex
+lookup_indexes = dict()
+
+# "numpy" -> NumpyEngine
+convert_engines = dict()
+
+
+def get_lookup_index(input_field):
+
+    # missing index files are looked up again on the next call
+    if input_field not in lookup_indexes:
+        lookup_index = util.open_lookup_index(util, input_field)
+
+        if not lookup_index:
+            return None
+
+        lookup_indexes[input_field] = lookup_index
+
+    return lookup_indexes[input_field]
+
+
+def clear_convert_engines():
+
+    # called once the database file changed
+    for lookup_index in lookup_indexes.values():
+        lookup_index.close()
+
+    lookup_indexes.clear()
+    convert_engines.clear()
+
+
+def setup_convert(args):
+
+    # opens the database and the conversion engine selected via the CLI,
+    # returns a function converting one list of input IDs
+
+    util.query_profile_log = args.profile_log
+
+    # setup db, get cursor
+    util.ensure_database(util)
+
+    util.set_query_budget(util, args.query_timeout, args.query_max_steps)
+
+    if args.from_genome and not util.has_liftover_table(util):
+        print("The installed database does not provide the "
+              "cross-genome-build mapping table")
+        exit(-1)
+
+    exact_conversion = not (args.tolerance or args.from_genome or
+                            args.to_genome)
+
+    lookup_index = None
+
+    if args.engine in ["auto", "mmap"] and exact_conversion:
+        lookup_index = get_lookup_index(args.input_field)
+
+        if not lookup_index and args.engine == "mmap":
+            print("No lookup index file for " + args.input_field +
+                  " installed")
+            exit(-1)
+
+    numpy_engine = None
+
+    if args.engine == "numpy":
+        try:
+            from circhemy.common.numpy_engine import NumpyEngine
+        except ImportError:
+            print("The numpy engine requires numpy, "
+                  "install via: pip install circhemy[numpy]")
+            exit(-1)
+
+        # columns are loaded once and reused for all batches
+        if "numpy" not in convert_engines:
+            convert_engines["numpy"] = NumpyEngine(util)
+
+        numpy_engine = convert_engines["numpy"]
+
+    def convert(query_data):
+
+        if lookup_index:
+            return util.run_lookup_index_query(util,
+                                               args.output_fields,
+                                               query_data,
+                                               args.input_field,
+                                               lookup_index)
+
+        elif numpy_engine:
+            return numpy_engine.run_simple_select_query(
+                args.output_fields,
+                query_data,
+                args.input_field)
+
+        return util.run_simple_select_query(util,
+                                            args.output_fields,
+                                            query_data,
+                                            args.input_field,
+                                            tolerance=args.tolerance,
+                                            from_genome=args.from_genome,
+                                            to_genome=args.to_genome)
+
+    return convert
+
+
+def init_convert_worker(args):
+
+    # every worker process holds its own read-only database connection
+    global convert_function
+    convert_function = setup_convert(args)
+
+
+def get_output_fields(args):
+
+    # tolerance-aware coordinate queries report the offsets as well
+    if args.tolerance and args.input_field == "Coordinates":
+        return args.output_fields + util.coordinate_offset_columns
+
+    return args.output_fields
+
+
+def get_output_writer(path, args, fields=None):
+
+    try:
+        return writers.get_writer(args.output_format,
+                                  path,
+                                  fields or get_output_fields(args),
+                                  separator=args.separator_char,
+                                  empty_char=args.empty_char)
+    except FileNotFoundError:
+        print("Output file" + path + " could not be created")
+        exit(-1)
+
+
+def get_output_path(path, args):
+
+    # input file stem with the extension of the output format, text formats
+    # keep the compression of the input file, parquet compresses internally
+    name = os.path.basename(path)
+
+    extension = compression.get_compression(name)
+
+    if extension:
+        name = name[:-len(extension)]
+
+    name = os.path.splitext(name)[0] + "." + args.output_format
+
+    if extension and args.output_format != "parquet":
+        name += extension
+
+    return os.path.join(args.output_dir, name)
+
+
+def convert_file(path, args):
+
+    # converts one input file and writes it to the output directory,
+    # without output directory the output is returned for merging
+
+    # compressed input files are decompressed on the fly
+    with compression.open_input(path) as f:
+        query_data = [line.rstrip() for line in f if line.strip()]
+
+    output = convert_function(query_data)
+
+    if not args.output_dir:
+        return output
+
+    writer = get_output_writer(get_output_path(path, args), args)
+
+    try:
+        writer.write_rows(output)
+    finally:
+        writer.close()
+
+    return []
+
+
+def convert_files(input_files, args):
+
+    # yields the output of all input files in input order
+
+    if args.jobs == 1:
+        for path in input_files:
+            yield convert_file(path, args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # forked workers must not inherit the SQLite connection of this process
+    util.db_connection.close()
+    util.db_connection = ""
+
+    with ProcessPoolExecutor(max_workers=args.jobs or None,
+                             initializer=init_convert_worker,
+                             initargs=(args,)) as executor:
+        yield from executor.map(convert_file, input_files,
+                                [args] * len(input_files))
+
+
+def add_query_constraint_arguments(parser):
+
+    # constraint flags of circhemy query, shared with the flag syntax of
+    # --spec-file lines
+
+    group = parser.add_argument_group("database queries")
+
+    group.add_argument("-c",
+                       dest="circbase_query",
+                       help="specify circbase-related query. "
+                            "Use -c keyword for exact search or "
+                            "-c *keyword for partial matches."
+                       )
+
+    group.add_argument("-a",
+                       dest="circatlas_query",
+                       help="specify circatlas-related query. "
+                            "Use -a keyword for exact search or "
+                            "-a *keyword for partial matches."
+                       )
+
+    group.add_argument("-d",
+                       dest="deepbase2_query",
+                       help="specify deepbase2-related query. "
+                            "Use -d keyword for exact search or "
+                            "-d *keyword for partial matches."
+                       )
+
+    group.add_argument("-e",
+                       dest="circpedia2_query",
+                       help="specify circpedia2-related query. "
+                            "Use -e keyword for exact search or "
+                            "-e *keyword for partial matches."
+                       )
+
+    group.add_argument("-b",
+                       dest="circbank_query",
+                       help="specify circbank-related query. "
+                            "Use -b keyword for exact search or "
+                            "-b *keyword for partial matches."
+                       )
+
+    group.add_argument("-m",
+                       dest="arraystar_query",
+                       help="specify arraystar-related query. "
+                            "Use -m keyword for exact search or "
+                            "-m *keyword for partial matches."
+                       )
+
+    group.add_argument("-r",
+                       dest="circrnadb_query",
+                       help="specify circrnadb-related query. "
+                            "Use -r keyword for exact search or "
+                            "-r *keyword for partial matches."
+                       )
+
+    group = parser.add_argument_group("species & genome build queries")
+
+    group.add_argument("-s",
+                       dest="species_query",
+                       help="specify species name",
+                       choices=util.database_species_list
+                       )
+
+    group.add_argument("-g",
+                       dest="genome_query",
+                       help="specify genome build",
+                       choices=util.database_genome_list
+                       )
+
+    group = parser.add_argument_group("genomic location & gene queries")
+
+    group.add_argument("-C",
+                       dest="chr_query",
+                       help="specify chromosome-related query. "
+                            "Use -h keyword for exact search or "
+                            "-h *keyword for partial matches."
+                       )
+
+    group.add_argument("-t",
+                       dest="start_query",
+                       help="specify start-related query. "
+                            "Use -t keyword for exact search or "
+                            "-t *keyword for partial matches."
+                       )
+
+    group.add_argument("-T",
+                       dest="stop_query",
+                       help="specify stop-related query. "
+                            "Use -T keyword for exact search or "
+                            "-T *keyword for partial matches."
+                       )
+
+    group.add_argument("-G",
+                       dest="gene_query",
+                       help="specify gene-related query. "
+                            "Use -G keyword for exact search or "
+                            "-G *keyword for partial matches."
+                       )
+
+
+def get_query_constraints(args):
+
+    # database field -> constraint, fields without constraint are None
+    return dict(circBase=args.circbase_query,
+                CircAtlas2=args.circatlas_query,
+                deepBase2=args.deepbase2_query,
+                Circpedia2=args.circpedia2_query,
+                circBank=args.circbank_query,
+                Arraystar=args.arraystar_query,
+                circRNADb=args.circrnadb_query,
+                Species=args.species_query,
+                Genome=args.genome_query,
+                Chr=args.chr_query,
+                Start=args.start_query,
+                Stop=args.stop_query,
+                Gene=args.gene_query
+                )
+
+
+def read_query_specs(stream):
+
+    # one query per line, either as query flags or as JSON object of field
+    # names and keywords; empty lines and # comments are skipped
+    # returns one dictionary of field names and keywords per query
+
+    import json
+    import shlex
+
+    parser = argparse.ArgumentParser(prog=util.program_name + " query",
+                                     add_help=False)
+    add_query_constraint_arguments(parser)
+
+    query_fields = list(get_query_constraints(parser.parse_args([])))
+
+    specs = []
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+
+        if 'Exit' == line:
+            break
+
+        if not line or line.startswith("#"):
+            continue
+
+        error = None
+
+        if line.startswith("{"):
+            try:
+                spec = json.loads(line)
+            except ValueError:
+                spec = None
+
+            if not isinstance(spec, dict) or \
+                    not set(spec).issubset(query_fields) or \
+                    not all(isinstance(keyword, (str, int))
+                            for keyword in spec.values()):
+                error = "JSON queries map the fields " + \
+                        ", ".join(query_fields) + " to keywords"
+
+            elif spec.get("Species", util.database_species_list[0]) not in \
+                    util.database_species_list or \
+                    spec.get("Genome", util.database_genome_list[0]) not in \
+                    util.database_genome_list:
+                error = "unknown species or genome build"
+
+        else:
+            # argparse reports the details of invalid flags
+            try:
+                spec = get_query_constraints(
+                    parser.parse_args(shlex.split(line)))
+            except (SystemExit, ValueError):
+                spec = {}
+                error = "invalid query flags"
+
+        # a fixed field order lets all queries on the same fields share
+        # one SQL statement
+        constraints = {field: spec[field] for field in query_fields
+                       if not error and spec.get(field) not in [None, ""]}
+
+        if not error and not constraints:
+            error = "no query constraint given"
+
+        if error:
+            print("Query spec in line " + str(line_number) + ": " + error)
+            exit(-1)
+
+        specs.append(constraints)
+
+    return specs
+
+
+def get_query_thread_util():
+
+    # every query thread works on its own database connection, held by a
+    # per-thread subclass of Util; connections close with their thread
+
+    if not hasattr(query_thread_state, "util"):
+        query_thread_state.util = type("Util", (util,),
+                                       {"db_connection": "",
+                                        "db_cursor": ""})
+
+    return query_thread_state.util
+
+
+def run_query_spec(query_util, spec_number, constraints, output_fields):
+
+    keyword_sql, parameters = query_util.get_keyword_sql(query_util,
+                                                         constraints)
+
+    return [[spec_number] + list(line) for line in
+            query_util.run_keyword_select_query(query_util,
+                                                output_fields,
+                                                keyword_sql,
+                                                parameters)]
+
+
+def run_query_specs(specs, output_fields, threads):
+
+    # yields the output of all specs in spec order, each row starts with
+    # the 1-based spec number
+
+    if threads == 1:
+        for spec_number, constraints in enumerate(specs, start=1):
+            yield run_query_spec(util, spec_number, constraints,
+                                 output_fields)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as \
+            executor:
+        yield from executor.map(
+            lambda spec_number, constraints: run_query_spec(
+                get_query_thread_util(), spec_number, constraints,
+                output_fields),
+            range(1, len(specs) + 1), specs)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -42,8 +490,15 @@ def main():
     
         Available commands:
     
-           convert: convert circRNA IDs
-           query:   query local circRNA database
+           convert:  convert circRNA IDs
+           query:    query local circRNA database
+           annotate: add circRNA IDs as columns to circRNA detection tables
+           export:   export complete mapping tables
+           download: download the circRNA database
+           update:   update the local circRNA database
+           index:    build missing indexes of the local circRNA database
+           daemon:   keep the database open for fast convert and query calls
+           bench:    measure convert and query performance
         """)
     parser.add_argument("command", help="Command to run")
 
@@ -69,18 +524,70 @@ def main():
         group.add_argument("-q",
                            dest="query_data",
                            nargs="+",
-                           help="file with IDs to read. One ID per line; "
+                           help="files with IDs to read. One ID per line; "
+                                ".gz, .bz2, .xz and .zst files are "
+                                "decompressed on the fly; "
                                 "Use -q STDIN for STDIN direct input",
                            required=True
                            )
 
+        group.add_argument("--jobs",
+                           dest="jobs",
+                           help="number of input files converted in "
+                                "parallel, each job uses its own database "
+                                "connection; 0 uses all CPU cores; "
+                                "default: 1",
+                           type=int,
+                           default=1
+                           )
+
         group.add_argument("-i",
                            dest="input_field",
-                           help="type of input circular RNA ID, e.g. circBase",
-                           choices=util.db_columns,
+                           help="type of input circular RNA ID, e.g. circBase; "
+                                "use Coordinates for chr:start|stop or "
+                                "tab-separated chr, start and stop input",
+                           choices=["Coordinates"] + util.db_columns,
                            required=True
                            )
 
+        group.add_argument("--tolerance",
+                           dest="tolerance",
+                           help="match coordinates within +/- N bp on both "
+                                "ends and report the offsets of the nearest "
+                                "circRNA; only used with -i Coordinates; "
+                                "default: 0 (exact match)",
+                           type=int,
+                           default=0
+                           )
+
+        group.add_argument("--from",
+                           dest="from_genome",
+                           help="genome build of the input coordinates; "
+                                "together with --to maps coordinates to the "
+                                "other genome build; only used with "
+                                "-i Coordinates",
+                           choices=list(util.database_liftover_pairs)
+                           )
+
+        group.add_argument("--to",
+                           dest="to_genome",
+                           help="genome build to map the input "
+                                "coordinates to, e.g. --from hg19 --to hg38",
+                           choices=list(util.database_liftover_pairs)
+                           )
+
+        group.add_argument("--engine",
+                           dest="engine",
+                           help="conversion engine; mmap uses the prebuilt "
+                                "lookup index files, numpy loads the required "
+                                "columns into memory and is faster for "
+                                "very large inputs; auto uses mmap if index "
+                                "files are installed and sqlite otherwise; "
+                                "default: auto",
+                           choices=["auto", "sqlite", "mmap", "numpy"],
+                           default="auto"
+                           )
+
         group.add_argument("-o",
                            dest="output_fields",
                            help="desired output fields; "
@@ -90,18 +597,55 @@ def main():
                            required=True
                            )
 
+        group.add_argument("--stream",
+                           dest="stream",
+                           help="read -q STDIN in batches and write the "
+                                "results of each batch immediately; memory "
+                                "use stays bounded for unbounded inputs, "
+                                "results are ordered per batch",
+                           action="store_true"
+                           )
+
+        group.add_argument("--batch-size",
+                           dest="batch_size",
+                           help="number of input lines per batch in "
+                                "--stream mode; default: " +
+                                str(util.stream_batch_size),
+                           type=int,
+                           default=util.stream_batch_size
+                           )
+
         group = parser.add_argument_group("output parameters")
 
         group.add_argument("-O",
                            dest="output_file",
-                           help="output file location; default: STDOUT",
+                           help="output file location; .gz, .bz2, .xz and "
+                                ".zst files are compressed; default: STDOUT",
                            default="STDOUT"
                            )
 
+        group.add_argument("--format",
+                           dest="output_format",
+                           help="output format; csv adds a header line, "
+                                "jsonl writes one JSON object per line, "
+                                "parquet requires pyarrow; default: tsv",
+                           choices=writers.output_formats,
+                           default="tsv"
+                           )
+
+        group.add_argument("--output-dir",
+                           dest="output_dir",
+                           help="write one output file per input file to this "
+                                "directory instead of one merged output; "
+                                "output files are named after the input "
+                                "files with the extension of --format"
+                           )
+
         group.add_argument("-S",
                            dest="separator_char",
-                           help="specify the separator character for output; "
-                                "default: tab (\\t)",
+                           help="specify the separator character for tsv and "
+                                "csv output; default: tab (\\t) for tsv, "
+                                "comma for csv",
                            default="\t"
                            )
 
@@ -113,6 +657,34 @@ def main():
                            default="NA"
                            )
 
+        group = parser.add_argument_group("query budget")
+
+        group.add_argument("--timeout",
+                           dest="query_timeout",
+                           help="abort queries running longer than this many "
+                                "seconds; default: 0 (no limit)",
+                           type=float,
+                           default=util.query_time_limit
+                           )
+
+        group.add_argument("--max-steps",
+                           dest="query_max_steps",
+                           help="abort queries exceeding this number of "
+                                "SQLite VM steps; default: 0 (no limit)",
+                           type=int,
+                           default=util.query_step_limit
+                           )
+
+        group.add_argument("--profile",
+                           dest="profile_log",
+                           help="log timing and query plans of all SQL "
+                                "statements to a rotating JSONL file; "
+                                "default: circhemy_profile.jsonl",
+                           nargs="?",
+                           const="circhemy_profile.jsonl",
+                           default=util.query_profile_log
+                           )
+
         args = parser.parse_args(sys.argv[2:])
 
         # done with CLI parsing
@@ -121,8 +693,77 @@ def main():
         util.check_output_field_names(util, args.output_fields)
         util.check_input_field_name(util, args.input_field)
 
+        if args.tolerance < 0:
+            print("Coordinate tolerance has to be a positive number")
+            exit(-1)
+
+        if args.tolerance and args.input_field != "Coordinates":
+            print("Coordinate tolerance requires -i Coordinates")
+            exit(-1)
+
+        if args.from_genome or args.to_genome:
+            if args.input_field != "Coordinates":
+                print("Genome build mapping requires -i Coordinates")
+                exit(-1)
+
+            if util.database_liftover_pairs.get(args.from_genome) != \
+                    args.to_genome:
+                print("Unsupported genome build mapping, supported are: " +
+                      ", ".join([from_genome + " -> " + to_genome for
+                                 from_genome, to_genome in
+                                 util.database_liftover_pairs.items()]))
+                exit(-1)
+
+            if args.tolerance:
+                print("--tolerance can not be combined with --from/--to")
+                exit(-1)
+
+        exact_conversion = not (args.tolerance or args.from_genome or
+                                args.to_genome)
+
+        if args.engine in ["numpy", "mmap"] and not exact_conversion:
+            print("The " + args.engine +
+                  " engine only supports exact conversions")
+            exit(-1)
+
+        if args.stream and args.query_data != ["STDIN"]:
+            print("--stream requires -q STDIN")
+            exit(-1)
+
+        if args.batch_size < 1:
+            print("Batch size has to be a positive number")
+            exit(-1)
+
+        if args.jobs < 0:
+            print("Number of jobs has to be a positive number")
+            exit(-1)
+
+        # -q values naming files are read as input files, one ID per line
+        input_files = []
+
+        if args.query_data != ["STDIN"] and \
+                any(map(os.path.isfile, args.query_data)):
+            input_files = args.query_data
+
+            # IDs can not be told apart from missing files, so -q takes
+            # either IDs or input files
+            for path in input_files:
+                if not os.path.isfile(path):
+                    print("-q takes either IDs or input files, " + path +
+                          " is not a file")
+                    exit(-1)
+
+        if args.output_dir and not input_files:
+            print("--output-dir requires input files via -q")
+            exit(-1)
+
+        if args.output_dir and args.output_file != "STDOUT":
+            print("-O can not be combined with --output-dir")
+            exit(-1)
+
         # running in STDIN mode, convert data for use
-        if args.query_data == ["STDIN"]:
+        # in streaming mode STDIN is read batch by batch during conversion
+        if args.query_data == ["STDIN"] and not args.stream:
 
             # tmp list to move STDIN to list
             stdin = []
@@ -135,136 +776,92 @@ def main():
 
             # done with STDIN preprocessing
 
-        # setup db, get cursor
-        util.setup_database(util, util.database_location)
-
-        output = util.run_simple_select_query(util,
-                                              args.output_fields,
-                                              args.query_data,
-                                              args.input_field)
-
-        # process output
+        if input_files and args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
 
-        sql_output = util.process_sql_output(output,
-                                             seperator=args.separator_char,
-                                             empty_char=args.empty_char)
+            output_paths = [os.path.realpath(get_output_path(path, args))
+                            for path in input_files]
 
-        # default output to console via STDOUT
-        if args.output_file == "STDOUT":
-            print(sql_output, end='')
-        # user specified file output, try to write file
-        else:
-            try:
-                with open(args.output_file, 'w') as f:
-                    f.write(sql_output)
-            except FileNotFoundError:
-                print("Output file" + args.output_file + " could not be created")
+            # never overwrite inputs or the output of another input file
+            if len(set(output_paths)) != len(output_paths) or \
+                    set(output_paths) & set(map(os.path.realpath,
+                                                input_files)):
+                print("Input files need distinct names apart from their "
+                      "extensions and have to be outside of the output "
+                      "directory")
                 exit(-1)
 
-        # done with main program
+        # setup db, get cursor, also validates the engine for all workers
+        init_convert_worker(args)
 
-        # close db connection
-        util.db_connection.close()
+        # default output to console via STDOUT, with --output-dir every
+        # input file gets its own output file
+        writer = None
 
-    elif args.command == "query":
+        if not args.output_dir:
+            writer = get_output_writer(args.output_file, args)
 
-        parser = argparse.ArgumentParser(
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-            fromfile_prefix_chars="@",
-        )
-        group = parser.add_argument_group("database queries")
-
-        group.add_argument("-c",
-                           dest="circbase_query",
-                           help="specify circbase-related query. "
-                                "Use -c keyword for exact search or "
-                                "-c *keyword for partial matches."
-                           )
+        try:
+            if input_files:
+                # merged output keeps the order of the input files
+                for output in convert_files(input_files, args):
+                    if writer:
+                        writer.write_rows(output)
 
-        group.add_argument("-a",
-                           dest="circatlas_query",
-                           help="specify circatlas-related query. "
-                                "Use -a keyword for exact search or "
-                                "-a *keyword for partial matches."
-                           )
-
-        group.add_argument("-d",
-                           dest="deepbase2_query",
-                           help="specify deepbase2-related query. "
-                                "Use -d keyword for exact search or "
-                                "-d *keyword for partial matches."
-                           )
-
-        group.add_argument("-e",
-                           dest="circpedia2_query",
-                           help="specify circpedia2-related query. "
-                                "Use -e keyword for exact search or "
-                                "-e *keyword for partial matches."
-                           )
-
-        group.add_argument("-b",
-                           dest="circbank_query",
-                           help="specify circbank-related query. "
-                                "Use -b keyword for exact search or "
-                                "-b *keyword for partial matches."
-                           )
-
-        group.add_argument("-m",
-                           dest="arraystar_query",
-                           help="specify arraystar-related query. "
-                                "Use -m keyword for exact search or "
-                                "-m *keyword for partial matches."
-                           )
-
-        group.add_argument("-r",
-                           dest="circrnadb_query",
-                           help="specify circrnadb-related query. "
-                                "Use -r keyword for exact search or "
-                                "-r *keyword for partial matches."
-                           )
+            else:
+                if args.stream:
+                    batches = util.read_query_batches(util, sys.stdin,
+                                                      args.batch_size)
+                else:
+                    batches = [args.query_data]
 
-        group = parser.add_argument_group("species & genome build queries")
+                # results of each batch are written immediately
+                for batch in batches:
+                    writer.write_rows(convert_function(batch))
 
-        group.add_argument("-s",
-                           dest="species_query",
-                           help="specify species name",
-                           choices=util.database_species_list
-                           )
+        except common.QueryTooExpensiveError as error:
+            print(str(error), file=sys.stderr)
+            exit(-1)
 
-        group.add_argument("-g",
-                           dest="genome_query",
-                           help="specify genome build",
-                           choices=util.database_genome_list
-                           )
+        finally:
+            # compressed output is only complete once the writer is closed
+            if writer:
+                writer.close()
 
-        group = parser.add_argument_group("genomic location & gene queries")
+        # done with main program
 
-        group.add_argument("-C",
-                           dest="chr_query",
-                           help="specify chromosome-related query. "
-                                "Use -h keyword for exact search or "
-                                "-h *keyword for partial matches."
-                           )
+        # close db connection
+        util.close_database(util)
 
-        group.add_argument("-t",
-                           dest="start_query",
-                           help="specify start-related query. "
-                                "Use -t keyword for exact search or "
-                                "-t *keyword for partial matches."
-                           )
+    elif args.command == "query":
 
-        group.add_argument("-T",
-                           dest="stop_query",
-                           help="specify stop-related query. "
-                                "Use -T keyword for exact search or "
-                                "-T *keyword for partial matches."
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            fromfile_prefix_chars="@",
+        )
+        add_query_constraint_arguments(parser)
+
+        group = parser.add_argument_group("batch queries")
+
+        group.add_argument("--spec-file",
+                           dest="spec_file",
+                           help="file with one query per line, either as "
+                                "query flags, e.g. -G *atf6 -g hg38, or as "
+                                "JSON object, e.g. {\"Gene\": \"*atf6\", "
+                                "\"Genome\": \"hg38\"}; all queries run in "
+                                "this process and the output starts with "
+                                "the 1-based query number; "
+                                "Use --spec-file STDIN for STDIN direct input"
                            )
 
-        group.add_argument("-G",
-                           dest="gene_query",
-                           help="specify gene-related query. "
-                                "Use -G keyword for exact search or "
-                                "-G *keyword for partial matches."
+        group.add_argument("--threads",
+                           dest="threads",
+                           help="number of --spec-file queries run in "
+                                "parallel, each thread uses its own database "
+                                "connection; 0 uses all CPU cores; "
+                                "default: 1",
+                           type=int,
+                           default=1
                            )
 
         group = parser.add_argument_group("output parameters")
@@ -280,14 +877,25 @@ def main():
 
         group.add_argument("-O",
                            dest="output_file",
-                           help="output file location; default: STDOUT",
+                           help="output file location; .gz, .bz2, .xz and "
+                                ".zst files are compressed; default: STDOUT",
                            default="STDOUT"
                            )
 
+        group.add_argument("--format",
+                           dest="output_format",
+                           help="output format; csv adds a header line, "
+                                "jsonl writes one JSON object per line, "
+                                "parquet requires pyarrow; default: tsv",
+                           choices=writers.output_formats,
+                           default="tsv"
+                           )
+
         group.add_argument("-S",
                            dest="separator_char",
-                           help="specify the separator character for output; "
-                                "default: tab (\\t)",
+                           help="specify the separator character for tsv and "
+                                "csv output; default: tab (\\t) for tsv, "
+                                "comma for csv",
                            default="\t"
                            )
 
@@ -299,6 +907,34 @@ def main():
                            default="NA"
                            )
 
+        group = parser.add_argument_group("query budget")
+
+        group.add_argument("--timeout",
+                           dest="query_timeout",
+                           help="abort queries running longer than this many "
+                                "seconds; default: 0 (no limit)",
+                           type=float,
+                           default=util.query_time_limit
+                           )
+
+        group.add_argument("--max-steps",
+                           dest="query_max_steps",
+                           help="abort queries exceeding this number of "
+                                "SQLite VM steps; default: 0 (no limit)",
+                           type=int,
+                           default=util.query_step_limit
+                           )
+
+        group.add_argument("--profile",
+                           dest="profile_log",
+                           help="log timing and query plans of all SQL "
+                                "statements to a rotating JSONL file; "
+                                "default: circhemy_profile.jsonl",
+                           nargs="?",
+                           const="circhemy_profile.jsonl",
+                           default=util.query_profile_log
+                           )
+
         args = parser.parse_args(sys.argv[2:])
 
         # done with CLI parsing
@@ -321,80 +957,580 @@ def main():
         #
         #     # done with STDIN preprocessing
 
-        # setup db, get cursor
-        util.setup_database(util, util.database_location)
-
-        input_dict = dict(circNase=args.circbase_query,
-                          CircAtlas2=args.circatlas_query,
-                          deepBase2=args.deepbase2_query,
-                          Circpedia2=args.circpedia2_query,
-                          circBank=args.circbank_query,
-                          Arraystar=args.arraystar_query,
-                          circRNADb=args.circrnadb_query,
-                          Species=args.species_query,
-                          Genome=args.genome_query,
-                          Chr=args.chr_query,
-                          Start=args.start_query,
-                          Stop=args.stop_query,
-                          Gene=args.gene_query
-                          )
+        if args.spec_file:
+            if any(get_query_constraints(args).values()):
+                print("--spec-file can not be combined with query flags")
+                exit(-1)
 
-        # print(input_dict)
+            if args.spec_file != "STDIN" and \
+                    not os.path.isfile(args.spec_file):
+                print("Input file " + args.spec_file + " not found")
+                exit(-1)
 
-        sql_query = " "
+        elif not any(get_query_constraints(args).values()):
+            print("At least one query flag or --spec-file is required")
+            exit(-1)
 
-        additional_output_fields = list()
+        if args.threads < 0:
+            print("Number of threads has to be a positive number")
+            exit(-1)
 
-        for query_item in input_dict:
-            if input_dict[query_item]:
+        util.query_profile_log = args.profile_log
 
-                additional_output_fields.append(query_item)
+        # setup db, get cursor
+        util.ensure_database(util)
 
-                if str(input_dict[query_item]).startswith("*"):
+        util.set_query_budget(util, args.query_timeout, args.query_max_steps)
 
-                    tmp = str(input_dict[query_item]).replace("*", "", 1)
-                    sql_query += query_item + " LIKE \"%" \
-                                 + tmp + "%\" AND "
+        writer = None
 
+        try:
+            if args.spec_file:
+                if args.spec_file == "STDIN":
+                    specs = read_query_specs(sys.stdin)
                 else:
+                    with compression.open_input(args.spec_file) as f:
+                        specs = read_query_specs(f)
 
-                    sql_query += query_item + " == \"" \
-                                 + input_dict[query_item] + "\" AND "
+                # all specs share the output columns, constraint fields of
+                # any spec are added in the order of the query flags
+                additional_output_fields = [
+                    field for field in get_query_constraints(args)
+                    if any(field in constraints for constraints in specs)]
 
-        # remove last AND from query
-        sql_query = sql_query[:-4]
+                writer = get_output_writer(args.output_file, args,
+                                           ["Spec"] + args.output_fields +
+                                           additional_output_fields)
 
-        output = util.run_keyword_select_query(util,
+                for output in run_query_specs(specs,
                                               args.output_fields +
-                                               additional_output_fields,
-                                              sql_query)
+                                              additional_output_fields,
+                                              args.threads):
+                    writer.write_rows(output)
+
+            else:
+                constraints = {field: keyword for field, keyword in
+                               get_query_constraints(args).items()
+                               if keyword}
 
-        # process output
+                additional_output_fields = list(constraints)
 
-        sql_output = util.process_sql_output(output,
-                                             seperator=args.separator_char,
-                                             empty_char=args.empty_char)
+                keyword_sql, parameters = util.get_keyword_sql(util,
+                                                               constraints)
+
+                output = util.run_keyword_select_query(
+                    util,
+                    args.output_fields + additional_output_fields,
+                    keyword_sql,
+                    parameters)
+
+                # process output, default output to console via STDOUT
+                writer = get_output_writer(args.output_file, args,
+                                           args.output_fields +
+                                           additional_output_fields)
+                writer.write_rows(output)
+
+        except common.QueryTooExpensiveError as error:
+            print(str(error), file=sys.stderr)
+            exit(-1)
+
+        finally:
+            if writer:
+                writer.close()
+
+        # done with main program
+
+        # close db connection
+        util.close_database(util)
+
+    elif args.command == "annotate":
+
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            fromfile_prefix_chars="@",
+        )
+        group = parser.add_argument_group("input parameters")
+
+        group.add_argument("-i",
+                           dest="input_table",
+                           help="tab-separated table to annotate, e.g. "
+                                "CIRCexplorer, DCC or CIRIquant output; "
+                                ".gz, .bz2, .xz and .zst files are "
+                                "decompressed on the fly; "
+                                "Use -i STDIN for STDIN direct input",
+                           required=True
+                           )
+
+        group.add_argument("--chr-col",
+                           dest="chr_column",
+                           help="1-based column holding the chromosome",
+                           type=int
+                           )
+
+        group.add_argument("--start-col",
+                           dest="start_column",
+                           help="1-based column holding the start position",
+                           type=int
+                           )
+
+        group.add_argument("--stop-col",
+                           dest="stop_column",
+                           help="1-based column holding the stop position",
+                           type=int
+                           )
+
+        group.add_argument("--id-col",
+                           dest="id_column",
+                           help="1-based column holding circRNA IDs, "
+                                "instead of coordinates; requires --id-field",
+                           type=int
+                           )
+
+        group.add_argument("--id-field",
+                           dest="input_field",
+                           help="type of the circular RNA IDs in --id-col, "
+                                "e.g. circBase",
+                           choices=util.db_columns
+                           )
+
+        group.add_argument("--header",
+                           dest="header",
+                           help="the first line of the table is a header "
+                                "line, the output field names are appended "
+                                "to it",
+                           action="store_true"
+                           )
+
+        group.add_argument("--engine",
+                           dest="engine",
+                           help="conversion engine, see circhemy convert; "
+                                "default: auto",
+                           choices=["auto", "sqlite", "mmap", "numpy"],
+                           default="auto"
+                           )
+
+        group.add_argument("-o",
+                           dest="output_fields",
+                           help="fields appended to every row; "
+                                "for multiple fields use space-separated "
+                                "list of field names",
+                           nargs="+",
+                           required=True
+                           )
+
+        group.add_argument("--batch-size",
+                           dest="batch_size",
+                           help="number of table rows resolved per batch; "
+                                "default: " + str(util.stream_batch_size),
+                           type=int,
+                           default=util.stream_batch_size
+                           )
+
+        group = parser.add_argument_group("output parameters")
+
+        group.add_argument("-O",
+                           dest="output_file",
+                           help="output file location; .gz, .bz2, .xz and "
+                                ".zst files are compressed; default: STDOUT",
+                           default="STDOUT"
+                           )
+
+        group.add_argument("-S",
+                           dest="separator_char",
+                           help="specify the column separator of input and "
+                                "output table; default: tab (\\t)",
+                           default="\t"
+                           )
+
+        group.add_argument("-E",
+                           dest="empty_char",
+                           help="specify the placeholder for rows without "
+                                "database match; default: NA",
+                           default="NA"
+                           )
+
+        group = parser.add_argument_group("query budget")
+
+        group.add_argument("--timeout",
+                           dest="query_timeout",
+                           help="abort queries running longer than this many "
+                                "seconds; default: 0 (no limit)",
+                           type=float,
+                           default=util.query_time_limit
+                           )
+
+        group.add_argument("--max-steps",
+                           dest="query_max_steps",
+                           help="abort queries exceeding this number of "
+                                "SQLite VM steps; default: 0 (no limit)",
+                           type=int,
+                           default=util.query_step_limit
+                           )
+
+        group.add_argument("--profile",
+                           dest="profile_log",
+                           help="log timing and query plans of all SQL "
+                                "statements to a rotating JSONL file; "
+                                "default: circhemy_profile.jsonl",
+                           nargs="?",
+                           const="circhemy_profile.jsonl",
+                           default=util.query_profile_log
+                           )
+
+        args = parser.parse_args(sys.argv[2:])
+
+        # done with CLI parsing
+
+        util.check_output_field_names(util, args.output_fields)
+
+        coordinate_columns = [args.chr_column, args.start_column,
+                              args.stop_column]
+
+        if args.id_column:
+            if any(coordinate_columns) or not args.input_field:
+                print("--id-col requires --id-field and can not be "
+                      "combined with coordinate columns")
+                exit(-1)
+
+            key_columns = [args.id_column]
 
-        # default output to console via STDOUT
-        if args.output_file == "STDOUT":
-            print(sql_output, end='')
-        # user specified file output, try to write file
         else:
-            try:
-                with open(args.output_file, 'w') as f:
-                    f.write(sql_output)
-            except FileNotFoundError:
-                print("Output file" + args.output_file + " could not be created")
+            if not all(coordinate_columns):
+                print("Either --chr-col, --start-col and --stop-col or "
+                      "--id-col and --id-field are required")
                 exit(-1)
 
-        # done with main program
+            key_columns = coordinate_columns
+            args.input_field = "Coordinates"
+
+        if min(key_columns) < 1:
+            print("Column numbers start at 1")
+            exit(-1)
+
+        if args.batch_size < 1:
+            print("Batch size has to be a positive number")
+            exit(-1)
+
+        if args.input_table != "STDIN" and \
+                not os.path.isfile(args.input_table):
+            print("Input file " + args.input_table + " not found")
+            exit(-1)
+
+        output_fields = args.output_fields
+
+        # every result row starts with the fields its key is rebuilt from
+        args.output_fields = annotate.get_key_fields(args.input_field) + \
+            output_fields
+        args.tolerance = 0
+        args.from_genome = None
+        args.to_genome = None
+
+        convert = setup_convert(args)
+
+        if args.input_table == "STDIN":
+            table = sys.stdin
+        else:
+            table = compression.open_input(args.input_table)
+
+        try:
+            output = writers.open_output(args.output_file)
+        except FileNotFoundError:
+            print("Output file" + args.output_file + " could not be created")
+            exit(-1)
+
+        try:
+            annotate.annotate_table(table, output, convert,
+                                    [column - 1 for column in key_columns],
+                                    output_fields,
+                                    separator=args.separator_char,
+                                    empty_char=args.empty_char,
+                                    batch_size=args.batch_size,
+                                    header=args.header)
+        except common.QueryTooExpensiveError as error:
+            print(str(error), file=sys.stderr)
+            exit(-1)
+
+        finally:
+            if table is not sys.stdin:
+                table.close()
+
+            if output is not sys.stdout:
+                output.close()
+
+        # close db connection
+        util.close_database(util)
+
+    elif args.command == "export":
+
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            fromfile_prefix_chars="@",
+        )
+        group = parser.add_argument_group("export parameters")
+
+        group.add_argument("-f",
+                           dest="output_fields",
+                           help="exported fields, e.g. circBase CircAtlas2 "
+                                "CSNv1; for multiple fields use "
+                                "space-separated list of field names",
+                           nargs="+",
+                           required=True
+                           )
+
+        group.add_argument("--species",
+                           dest="species",
+                           help="only export circRNAs of this species",
+                           choices=util.database_species_list
+                           )
+
+        group.add_argument("--genome",
+                           dest="genome",
+                           help="only export circRNAs of this genome build",
+                           choices=util.database_genome_list
+                           )
+
+        group.add_argument("--chr",
+                           dest="chromosome",
+                           help="only export circRNAs on this chromosome"
+                           )
+
+        group.add_argument("--complete",
+                           dest="complete",
+                           help="only export rows with a value for every "
+                                "exported field",
+                           action="store_true"
+                           )
+
+        group = parser.add_argument_group("output parameters")
+
+        group.add_argument("-O",
+                           dest="output_file",
+                           help="output file location; .gz, .bz2, .xz and "
+                                ".zst files are compressed; default: STDOUT",
+                           default="STDOUT"
+                           )
+
+        group.add_argument("--format",
+                           dest="output_format",
+                           help="output format; csv adds a header line, "
+                                "jsonl writes one JSON object per line, "
+                                "parquet requires pyarrow; default: tsv",
+                           choices=writers.output_formats,
+                           default="tsv"
+                           )
+
+        group.add_argument("--row-group-size",
+                           dest="row_group_size",
+                           help="number of rows per Parquet row group; "
+                                "default: " + str(util.parquet_row_group_size),
+                           type=int,
+                           default=util.parquet_row_group_size
+                           )
+
+        group.add_argument("-S",
+                           dest="separator_char",
+                           help="specify the separator character for tsv and "
+                                "csv output; default: tab (\\t) for tsv, "
+                                "comma for csv",
+                           default="\t"
+                           )
+
+        group.add_argument("-E",
+                           dest="empty_char",
+                           help="specify the placeholder for "
+                                "empty database fields; "
+                                "default: NA",
+                           default="NA"
+                           )
+
+        args = parser.parse_args(sys.argv[2:])
+
+        # done with CLI parsing
+
+        util.check_output_field_names(util, args.output_fields)
+
+        if args.row_group_size < 1:
+            print("Row group size has to be a positive number")
+            exit(-1)
+
+        util.parquet_row_group_size = args.row_group_size
+
+        constraints = {field: keyword for field, keyword in
+                       [("Species", args.species),
+                        ("Genome", args.genome),
+                        ("Chr", args.chromosome)] if keyword}
+
+        writer = get_output_writer(args.output_file, args,
+                                   args.output_fields)
+
+        # batches are written as soon as they are read, the export never
+        # holds more than one batch in memory
+        try:
+            for batch in util.run_export_query(util, args.output_fields,
+                                               constraints, args.complete):
+                writer.write_rows(batch)
+
+        except common.QueryTooExpensiveError as error:
+            print(str(error), file=sys.stderr)
+            exit(-1)
+
+        finally:
+            writer.close()
 
         # close db connection
-        util.db_connection.close()
+        util.close_database(util)
 
     elif args.command == "download":
         util.setup_database(util, util.database_location, from_cli=True)
 
+    elif args.command == "update":
+
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            fromfile_prefix_chars="@",
+        )
+        group = parser.add_argument_group("update parameters")
+
+        group.add_argument("--source",
+                           dest="source",
+                           help="URL or local directory holding the update "
+                                "manifest and delta files; default: " +
+                                util.database_delta_url,
+                           default=util.database_delta_url
+                           )
+
+        args = parser.parse_args(sys.argv[2:])
+
+        util.update_database(util, util.database_location, args.source)
+
+    elif args.command == "index":
+
+        report = util.build_database_indexes(util, util.database_location)
+
+        if not report:
+            print("All indexes of the database are up to date.")
+
+        for name, structure_type, build_time, size in report:
+            print("Built " + structure_type + " " + name + " in " +
+                  str(round(build_time, 2)) + " s, " +
+                  str(round(size / 1024 / 1024, 1)) + " MB")
+
+        if report:
+            print("Total: " +
+                  str(round(sum([line[2] for line in report]), 2)) + " s, " +
+                  str(round(sum([line[3] for line in report]) /
+                            1024 / 1024, 1)) + " MB")
+
+    elif args.command == "daemon":
+
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            fromfile_prefix_chars="@",
+        )
+        group = parser.add_argument_group("daemon parameters")
+
+        group.add_argument("--socket",
+                           dest="socket_path",
+                           help="Unix domain socket to listen on; "
+                                "convert and query calls are forwarded to "
+                                "the daemon if they find it on the same "
+                                "socket; default: " + daemon.get_socket_path(),
+                           default=daemon.get_socket_path()
+                           )
+
+        args = parser.parse_args(sys.argv[2:])
+
+        daemon.serve(args.socket_path)
+
+    elif args.command == "bench":
+
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            fromfile_prefix_chars="@",
+        )
+        group = parser.add_argument_group("benchmark parameters")
+
+        group.add_argument("-n",
+                           "--ids",
+                           dest="ids_per_field",
+                           help="Number of random IDs converted per input "
+                                "field; LIKE queries and profile lookups use "
+                                "a tenth of this; default: 1000",
+                           type=int,
+                           default=1000
+                           )
+
+        group.add_argument("--batch-size",
+                           dest="batch_size",
+                           help="Number of IDs per convert call; "
+                                "default: 100",
+                           type=int,
+                           default=100
+                           )
+
+        group.add_argument("--seed",
+                           dest="seed",
+                           help="Seed for drawing the random IDs, the same "
+                                "seed runs the same workload on the same "
+                                "database release; default: circhemy",
+                           default="circhemy"
+                           )
+
+        group.add_argument("--engine",
+                           dest="engine",
+                           help="conversion engine of the convert workload, "
+                                "see circhemy convert; default: auto",
+                           choices=["auto", "sqlite", "mmap", "numpy"],
+                           default="auto"
+                           )
+
+        group.add_argument("-O",
+                           "--output",
+                           dest="output_file",
+                           help="Output file for the JSON report; "
+                                "default: STDOUT",
+                           default="STDOUT"
+                           )
+
+        args = parser.parse_args(sys.argv[2:])
+
+        if args.ids_per_field < 1 or args.batch_size < 1:
+            print("--ids and --batch-size must be at least 1")
+            exit(-1)
+
+        from circhemy.common import bench
+
+        def get_convert_function(input_field):
+
+            # same engine setup as circhemy convert without extra options
+            return setup_convert(argparse.Namespace(
+                input_field=input_field,
+                output_fields=bench.convert_output_fields,
+                engine=args.engine,
+                tolerance=0,
+                from_genome=None,
+                to_genome=None,
+                profile_log=util.query_profile_log,
+                query_timeout=util.query_time_limit,
+                query_max_steps=util.query_step_limit))
+
+        report = bench.run_benchmark(util,
+                                     ids_per_field=args.ids_per_field,
+                                     batch_size=args.batch_size,
+                                     seed=args.seed,
+                                     engine=args.engine,
+                                     get_convert_function=get_convert_function)
+
+        import json
+
+        output = writers.open_output(args.output_file)
+        output.write(json.dumps(report, indent=2) + "\n")
+
+        if output is not sys.stdout:
+            output.close()
+
+        util.close_database(util)
+
     else:
         print("Unknown command:", args.command)
         exit(-1)
@@ -0,0 +1,340 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# persistent query daemon listening on a Unix domain socket
+#
+# request:  {"argv": [...], "cwd": <working directory>, "stdin": <bytes>}
+#           followed by the STDIN bytes
+# response: output chunks as soon as the command writes them,
+#           {"stdout": <bytes>} or {"stderr": <bytes>} followed by the bytes,
+#           ended by the trailer {"status": <exit status>,
+#           "stdout": <total bytes>, "stderr": <total bytes>}
+#
+# the client side only needs the standard library, so forwarded calls
+# skip importing the CLI and opening the database
+
+import io
+import json
+import os
+import socket
+import stat
+import sys
+
+# commands that are forwarded to a running daemon
+daemon_commands = ["convert", "query"]
+
+
+def get_socket_path():
+
+    if os.environ.get("CIRCHEMY_SOCKET"):
+        return os.environ['CIRCHEMY_SOCKET']
+
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], "circhemy.sock")
+
+    return os.path.join("/tmp", "circhemy-" + str(os.getuid()) + ".sock")
+
+
+def read_exactly(stream, size):
+
+    data = stream.read(size)
+
+    if len(data) != size:
+        raise ConnectionError("connection closed by circhemy daemon")
+
+    return data
+
+
+def forward(argv):
+
+    # runs the command in a running daemon and returns its exit status,
+    # returns None if the command has to run in-process
+
+    if not argv or argv[0] not in daemon_commands or \
+            os.environ.get("CIRCHEMY_NO_DAEMON") or \
+            not hasattr(socket, "AF_UNIX"):
+        return None
+
+    # profiling is set up with the database connection, the daemon keeps
+    # its own connection, so profiled calls run in-process
+    if "--profile" in argv or os.environ.get("CIRCHEMY_PROFILE"):
+        return None
+
+    # worker processes of --jobs would fork the daemon and its connection
+    if any(arg == "--jobs" or arg.startswith("--jobs=") for arg in argv):
+        return None
+
+    # streaming and interactive input need the local STDIN
+    stdin = b""
+
+    if "STDIN" in argv:
+        if "--stream" in argv or sys.stdin.isatty():
+            return None
+
+    socket_path = get_socket_path()
+
+    # the fallback path lives in a world-writable directory, only talk to
+    # sockets created by a daemon of the same user
+    try:
+        socket_stat = os.lstat(socket_path)
+    except OSError:
+        return None
+
+    if not stat.S_ISSOCK(socket_stat.st_mode) or \
+            socket_stat.st_uid != os.getuid():
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+
+    if "STDIN" in argv:
+        stdin = sys.stdin.buffer.read()
+
+    with connection, connection.makefile("rwb") as stream:
+        try:
+            stream.write((json.dumps({"argv": argv,
+                                      "cwd": os.getcwd(),
+                                      "stdin": len(stdin)}) +
+                          "\n").encode())
+            stream.write(stdin)
+            stream.flush()
+
+            # output is passed on chunk by chunk, the trailer holds the
+            # exit status and the total size of both streams
+            outputs = {"stdout": sys.stdout.buffer,
+                       "stderr": sys.stderr.buffer}
+            received = {"stdout": 0, "stderr": 0}
+
+            while True:
+                frame = json.loads(stream.readline())
+
+                if "status" in frame:
+                    break
+
+                name = "stdout" if "stdout" in frame else "stderr"
+
+                outputs[name].write(read_exactly(stream, frame[name]))
+                outputs[name].flush()
+                received[name] += frame[name]
+
+            if received['stdout'] != frame['stdout'] or \
+                    received['stderr'] != frame['stderr']:
+                raise ConnectionError("incomplete output")
+
+        except (OSError, ValueError) as error:
+            print("circhemy daemon failed: " + str(error), file=sys.stderr)
+            return -1
+
+    return frame['status']
+
+
+class FrameWriter(io.RawIOBase):
+
+    # sends everything written to one output stream of a request as chunks
+    # to the client
+
+    def __init__(self, output, name):
+        self.output = output
+        self.name = name
+        self.size = 0
+        self.broken = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+
+        # once the client is gone the rest of the output is dropped
+        if self.broken:
+            return len(data)
+
+        try:
+            self.output.write((json.dumps({self.name: len(data)}) +
+                               "\n").encode() + bytes(data))
+            self.output.flush()
+        except OSError:
+            self.broken = True
+            raise
+
+        self.size += len(data)
+
+        return len(data)
+
+
+def run_request(argv, cwd, stdin, output):
+
+    # runs one CLI call in this process with redirected STDIN, STDOUT and
+    # STDERR, streams its output to the client and returns its exit status
+    # and the size of both output streams
+
+    import traceback
+    from circhemy.cli import cli
+
+    stdout_writer = FrameWriter(output, "stdout")
+    stderr_writer = FrameWriter(output, "stderr")
+
+    stdout = io.TextIOWrapper(io.BufferedWriter(stdout_writer),
+                              encoding="utf-8")
+    stderr = io.TextIOWrapper(io.BufferedWriter(stderr_writer),
+                              encoding="utf-8", line_buffering=True)
+
+    saved = sys.argv, sys.stdin, sys.stdout, sys.stderr, os.getcwd()
+
+    sys.argv = [cli.util.program_name] + argv
+    sys.stdin = io.TextIOWrapper(io.BytesIO(stdin), encoding="utf-8")
+    sys.stdout = stdout
+    sys.stderr = stderr
+
+    status = 0
+
+    try:
+        os.chdir(cwd)
+
+        # see forward(), clients of older versions may still send them
+        if any(arg == "--jobs" or arg.startswith("--jobs=")
+               for arg in argv):
+            print("--jobs is not supported by the circhemy daemon",
+                  file=sys.stderr)
+            exit(-1)
+
+        cli.main()
+    except SystemExit as error:
+        if isinstance(error.code, int):
+            status = error.code
+        elif error.code is not None:
+            print(error.code, file=sys.stderr)
+            status = 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.argv, sys.stdin, sys.stdout, sys.stderr, cwd = saved
+        os.chdir(cwd)
+
+    # the client is gone if flushing the rest fails
+    try:
+        stdout.flush()
+        stderr.flush()
+    except OSError:
+        pass
+
+    return status, stdout_writer.size, stderr_writer.size
+
+
+def serve(socket_path=None):
+
+    import signal
+    import socketserver
+    import circhemy.common.util as common
+    from circhemy.cli import cli
+
+    util = common.Util
+
+    if not socket_path:
+        socket_path = get_socket_path()
+
+    # a second daemon on the same socket is not needed
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            probe.connect(socket_path)
+            print("circhemy daemon already running on " + socket_path)
+            exit(-1)
+        except OSError:
+            # stale socket of a daemon that did not shut down cleanly
+            os.remove(socket_path)
+        finally:
+            probe.close()
+
+    # requests run in this process, never forward them again
+    os.environ['CIRCHEMY_NO_DAEMON'] = "1"
+
+    util.keep_database_open = True
+    util.ensure_database(util)
+
+    # the database file in use, circhemy update installs a new file
+    database_file = [os.path.realpath(util.database_location)]
+
+    # CLI options change these settings, every request starts from the
+    # settings of the daemon
+    settings = (util.query_time_limit, util.query_step_limit,
+                util.query_profile_log)
+
+    class DaemonRequestHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+            stdin = read_exactly(self.rfile, request['stdin'])
+
+            # reopen the database after an update swapped the file
+            if os.path.realpath(util.database_location) != database_file[0]:
+                if util.db_connection:
+                    util.db_connection.close()
+                    util.db_connection = ""
+
+                util.database_stats_cache = None
+                util.membership_sets.clear()
+                cli.clear_convert_engines()
+                database_file[0] = os.path.realpath(util.database_location)
+
+            util.query_time_limit, util.query_step_limit, \
+                util.query_profile_log = settings
+
+            status, stdout_size, stderr_size = run_request(
+                request['argv'], request['cwd'], stdin, self.wfile)
+
+            # nothing left to do if the client is gone
+            try:
+                self.wfile.write((json.dumps({"status": status,
+                                              "stdout": stdout_size,
+                                              "stderr": stderr_size}) +
+                                  "\n").encode())
+            except OSError:
+                pass
+
+    # only the owner may talk to the daemon
+    umask = os.umask(0o177)
+
+    try:
+        server = socketserver.UnixStreamServer(socket_path,
+                                               DaemonRequestHandler)
+    finally:
+        os.umask(umask)
+
+    print("circhemy daemon listening on " + socket_path)
+    sys.stdout.flush()
+
+    # shut down cleanly on SIGTERM as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # requests are handled one at a time on the single warm connection
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        util.keep_database_open = False
+        util.close_database(util)
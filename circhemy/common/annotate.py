@@ -0,0 +1,134 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# streaming annotation of circRNA detection tables
+# the table is read in batches, the IDs or coordinates of each batch are
+# resolved with one conversion call and the requested fields are appended
+# to every row in the original row order
+# rows matching several circRNAs get the distinct values joined by commas
+
+
+def get_key_fields(input_field):
+
+    # database fields the input key is rebuilt from
+    if input_field == "Coordinates":
+        return ["Chr", "Start", "Stop"]
+
+    return [input_field]
+
+
+def get_row_key(row, key_columns):
+
+    # chr:start|stop for three key columns, the ID otherwise
+    try:
+        values = [row[column].strip() for column in key_columns]
+    except IndexError:
+        return None
+
+    if not all(values):
+        return None
+
+    if len(values) == 3:
+        return values[0] + ":" + values[1] + "|" + values[2]
+
+    return values[0]
+
+
+def get_database_key(line, key_count):
+
+    if key_count == 3:
+        return str(line[0]) + ":" + str(line[1]) + "|" + str(line[2])
+
+    return str(line[0])
+
+
+def annotate_batch(lines, convert, key_columns, output_fields, separator,
+                   empty_char):
+
+    rows = [None if line.startswith("#") else
+            line.rstrip("\r\n").split(separator) for line in lines]
+
+    keys = [get_row_key(row, key_columns) if row is not None else None
+            for row in rows]
+
+    annotation = {}
+
+    query_data = list(dict.fromkeys(key for key in keys if key))
+
+    if query_data:
+        for line in convert(query_data):
+            values = annotation.setdefault(
+                get_database_key(line, len(key_columns)),
+                [{} for field in output_fields])
+
+            # dictionaries keep the distinct values in database order
+            for value, field_values in zip(line[len(key_columns):], values):
+                if value is not None:
+                    field_values[str(value)] = None
+
+    output = []
+
+    for line, row, key in zip(lines, rows, keys):
+
+        # comment lines are passed through unchanged
+        if row is None:
+            output.append(line)
+            continue
+
+        values = annotation.get(key, [{} for field in output_fields])
+
+        output.append(separator.join(
+            row + [",".join(field_values) or empty_char
+                   for field_values in values]) + "\n")
+
+    return output
+
+
+def annotate_table(stream, output, convert, key_columns, output_fields,
+                   separator="\t", empty_char="NA", batch_size=10000,
+                   header=False):
+
+    # key_columns are 0-based column indices, convert resolves a list of
+    # keys to rows of the key fields followed by the output fields
+
+    batch = []
+
+    for line in stream:
+
+        # comment lines before the header stay unchanged
+        if header and not line.startswith("#"):
+            output.writelines(batch)
+            batch = []
+
+            output.write(line.rstrip("\r\n") + separator +
+                         separator.join(output_fields) + "\n")
+            header = False
+            continue
+
+        batch.append(line)
+
+        if len(batch) == batch_size:
+            output.writelines(annotate_batch(batch, convert, key_columns,
+                                             output_fields, separator,
+                                             empty_char))
+            batch = []
+
+    if batch:
+        output.writelines(annotate_batch(batch, convert, key_columns,
+                                         output_fields, separator,
+                                         empty_char))
@@ -0,0 +1,244 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# fixed benchmark workload for circhemy bench
+# input IDs are drawn with a fixed seed, so the same database release and
+# settings always run the same queries
+# increase workload_version whenever the workload changes, results of
+# different versions are not comparable
+
+import platform
+import random
+import sqlite3
+import sys
+import time
+
+from circhemy.common.lookup_index import get_key_column
+
+workload_version = 3
+
+# source fields of the convert workload
+convert_fields = ["CSNv1",
+                  "Gene",
+                  "ENSEMBL",
+                  "Entrez",
+                  "circBase",
+                  "CircAtlas2",
+                  "circRNADb",
+                  "circBank",
+                  "deepBase2",
+                  "Circpedia2",
+                  "riboCIRC",
+                  "exoRBase2",
+                  "Arraystar"]
+
+convert_output_fields = ["CSNv1", "circBase", "CircAtlas2", "Gene"]
+
+# LIKE queries and profile lookups run once per this many input IDs
+query_ratio = 10
+
+
+def get_percentile(sorted_values, percentile):
+
+    # nearest-rank percentile
+    if not sorted_values:
+        return 0
+
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+
+    return sorted_values[int(rank) - 1]
+
+
+def get_statistics(timings, items):
+
+    timings = sorted(timings)
+    total = sum(timings)
+
+    return {"calls": len(timings),
+            "items": items,
+            "total_s": round(total, 4),
+            "throughput_per_s": round(items / total, 1) if total else 0,
+            "latency_ms": {
+                "mean": round(total / len(timings) * 1000, 3)
+                if timings else 0,
+                "p50": round(get_percentile(timings, 50) * 1000, 3),
+                "p90": round(get_percentile(timings, 90) * 1000, 3),
+                "p99": round(get_percentile(timings, 99) * 1000, 3),
+                "max": round(timings[-1] * 1000, 3) if timings else 0}}
+
+
+def get_sample(util, column, size, seed):
+
+    # draws rows at seeded random rowids in SQL, the keys of the whole table
+    # are never loaded, so the peak memory use is the one of the workload
+    # rowids may have gaps, the next row with a key is used
+    table = util.database_table_name
+
+    first_row, last_row = util.db_cursor.execute(
+        "SELECT MIN(rowid), MAX(rowid) FROM " + table).fetchall()[0]
+
+    sql = "SELECT " + get_key_column(column) + " FROM " + table + \
+          " WHERE rowid >= ? AND " + get_key_column(column) + \
+          " IS NOT NULL ORDER BY rowid LIMIT 1"
+
+    # columns without any keys would be scanned on every draw
+    if first_row is None or not util.db_cursor.execute(
+            sql, (first_row,)).fetchall():
+        return []
+
+    generator = random.Random(seed + column)
+
+    sample = dict()
+
+    # repeated keys are drawn again, columns with few distinct keys give
+    # smaller samples
+    for draw in range(size * 10):
+        if len(sample) == size:
+            break
+
+        line = util.db_cursor.execute(
+            sql, (generator.randint(first_row, last_row),)).fetchall()
+
+        if line:
+            sample[str(line[0][0])] = True
+
+    return list(sample)
+
+
+def run_timed(function, batches):
+
+    timings = []
+
+    for batch in batches:
+        start = time.perf_counter()
+        function(batch)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def get_peak_rss_mb():
+
+    import resource
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes everywhere else
+    if sys.platform == "darwin":
+        return round(peak_rss / 1024 / 1024, 1)
+
+    return round(peak_rss / 1024, 1)
+
+
+def get_sqlite_settings(util):
+
+    # configured page cache and database size, the sqlite3 module gives no
+    # access to cache hit and miss counters
+    pragmas = {}
+
+    for pragma in ["page_size", "page_count", "cache_size", "mmap_size",
+                   "freelist_count"]:
+        pragmas[pragma] = util.db_cursor.execute(
+            "PRAGMA " + pragma).fetchall()[0][0]
+
+    # negative cache sizes are given in KiB instead of pages
+    cache_size = pragmas['cache_size']
+
+    pragmas['cache_size_mb'] = round(
+        (-cache_size * 1024 if cache_size < 0 else
+         cache_size * pragmas['page_size']) / 1024 / 1024, 1)
+
+    pragmas['database_size_mb'] = round(
+        pragmas['page_size'] * pragmas['page_count'] / 1024 / 1024, 1)
+
+    return pragmas
+
+
+def run_benchmark(util, ids_per_field=1000, batch_size=100, seed="circhemy",
+                  engine="sqlite", get_convert_function=None):
+
+    # get_convert_function(input_field) returns the conversion function of
+    # the selected engine as used by circhemy convert, without it the
+    # conversions are run by SQLite
+
+    util.ensure_database(util)
+
+    workloads = {}
+
+    def batched(values):
+        return [values[start:start + batch_size] for start in
+                range(0, len(values), batch_size)]
+
+    start = time.perf_counter()
+
+    # ID conversions per source field
+    for field in convert_fields + ["Coordinates"]:
+        sample = get_sample(util, field, ids_per_field, seed)
+
+        if get_convert_function:
+            convert = get_convert_function(field)
+        else:
+            def convert(batch):
+                return util.run_simple_select_query(
+                    util, convert_output_fields, batch, field)
+
+        timings = run_timed(convert, batched(sample))
+
+        workloads["convert:" + field] = get_statistics(timings, len(sample))
+
+    # partial matches as used by circhemy query -G *keyword
+    genes = get_sample(util, "Gene", ids_per_field // query_ratio, seed)
+
+    def run_like_query(gene):
+        keyword_sql, parameters = util.get_keyword_sql(util,
+                                                       {"Gene": "*" + gene})
+        util.run_keyword_select_query(util, ["CSNv1", "Gene"], keyword_sql,
+                                      parameters)
+
+    timings = run_timed(run_like_query, genes)
+
+    workloads["query:like"] = get_statistics(timings, len(genes))
+
+    # circRNA profile pages of the web application
+    profile_ids = get_sample(util, "circBase", ids_per_field // query_ratio,
+                             seed)
+
+    def run_profile_lookup(circrna_id):
+        for line in util.run_circrna_query(util, circrna_id):
+            util.get_circrna_history_by_id(util, line[0])
+
+    timings = run_timed(run_profile_lookup, profile_ids)
+
+    workloads["profile"] = get_statistics(timings, len(profile_ids))
+
+    return {"workload_version": workload_version,
+            "circhemy_version": util.software_version,
+            "database_version": util.get_local_database_version(
+                util, util.db_connection),
+            "settings": {"ids_per_field": ids_per_field,
+                         "batch_size": batch_size,
+                         "seed": seed,
+                         "engine": engine},
+            "system": {"host": platform.node(),
+                       "machine": platform.machine(),
+                       "python": platform.python_version(),
+                       "sqlite": sqlite3.sqlite_version},
+            "total_s": round(time.perf_counter() - start, 3),
+            "workloads": workloads,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "sqlite_settings": get_sqlite_settings(util)}
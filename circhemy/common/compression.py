@@ -0,0 +1,151 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# transparent (de)compression of CLI input and output files
+# the compression is picked by file extension: .gz, .bz2, .xz and .zst
+# .zst requires zstandard, install via: pip install circhemy[zstd]
+
+import io
+import os
+import queue
+import threading
+
+compressed_extensions = [".gz", ".bz2", ".xz", ".zst"]
+
+# number of written blocks buffered for the compression thread
+compression_queue_size = 64
+
+compression_level = 6
+
+
+def get_compression(path):
+
+    extension = os.path.splitext(path)[1].lower()
+
+    return extension if extension in compressed_extensions else None
+
+
+def open_compressed(path, mode):
+
+    # binary file object (de)compressing on the fly, mode is rb or wb
+    extension = get_compression(path)
+
+    if extension == ".gz":
+        import gzip
+        return gzip.open(path, mode, compresslevel=compression_level)
+
+    elif extension == ".bz2":
+        import bz2
+        return bz2.open(path, mode)
+
+    elif extension == ".xz":
+        import lzma
+        return lzma.open(path, mode)
+
+    try:
+        import zstandard
+    except ImportError:
+        print(".zst files require zstandard, "
+              "install via: pip install circhemy[zstd]")
+        exit(-1)
+
+    if mode == "rb":
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+
+    return zstandard.ZstdCompressor(level=compression_level).stream_writer(
+        open(path, "wb"))
+
+
+class ThreadedWriter(io.RawIOBase):
+
+    # hands all written data to a helper thread that compresses and writes
+    # it, so compression overlaps with the query work of the main thread
+    # the thread is no daemon, queued data is never dropped at exit; the
+    # writer has to be closed on every path, also after errors
+
+    def __init__(self, output):
+        self.output = output
+        self.queue = queue.Queue(maxsize=compression_queue_size)
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+
+        # report errors of the helper thread in the writing thread
+        if self.error:
+            raise self.error
+
+        self.queue.put(bytes(data))
+
+        return len(data)
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+
+            if data is None:
+                break
+
+            if not self.error:
+                try:
+                    self.output.write(data)
+                except OSError as error:
+                    self.error = error
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+        self.output.close()
+
+        super().close()
+
+        if self.error:
+            raise self.error
+
+
+def open_input(path):
+
+    # text stream of an input file, compressed files are decompressed
+    # while reading
+    if not get_compression(path):
+        return open(path)
+
+    return io.TextIOWrapper(open_compressed(path, "rb"), encoding="utf-8")
+
+
+def open_output(path, binary=False):
+
+    # output file, compressed files are compressed in a helper thread
+    if not get_compression(path):
+        return open(path, "wb" if binary else "w",
+                    newline=None if binary else "")
+
+    output = io.BufferedWriter(ThreadedWriter(open_compressed(path, "wb")))
+
+    if binary:
+        return output
+
+    return io.TextIOWrapper(output, encoding="utf-8", newline="")
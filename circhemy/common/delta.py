@@ -0,0 +1,169 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# release-to-release delta patches for the circhemy database
+#
+# a delta is a gzipped JSON lines file:
+#   first line: {"from": <version>, "to": <version>, "date": <epoch>,
+#                "columns": [...], "checksum": <content checksum after update>}
+#   following:  {"action": 1|2|3, "CircRNA_ID": <id>, "row": [...]}
+# action codes follow Util.db_action_codes (Added, Changed, Deleted),
+# deleted rows carry no row values
+#
+# the update source (directory or URL) holds a manifest, latest.json:
+#   {"version": <latest version>,
+#    "deltas": {<from version>: {"file": <delta file>, "md5": <md5>}}}
+
+import gzip
+import hashlib
+import json
+import re
+
+
+def get_database_checksum(connection, table, columns):
+
+    # content checksum over all rows in CircRNA_ID order, independent of
+    # the page layout of the database file
+    hash_md5 = hashlib.md5()
+
+    for line in connection.execute("SELECT CircRNA_ID, " +
+                                   ",".join(columns) + " FROM " + table +
+                                   " ORDER BY CircRNA_ID"):
+        hash_md5.update(("\t".join(["" if value is None else str(value)
+                                    for value in line]) + "\n").encode())
+
+    return hash_md5.hexdigest()
+
+
+def write_delta(path, old_connection, new_connection, table, columns,
+                from_version, to_version, date):
+
+    # compares both databases by CircRNA_ID and writes all changes
+    sql = "SELECT CircRNA_ID, " + ",".join(columns) + " FROM " + table + \
+          " ORDER BY CircRNA_ID"
+
+    old_rows = old_connection.execute(sql)
+    new_rows = new_connection.execute(sql)
+
+    changes = {1: 0, 2: 0, 3: 0}
+
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"from": from_version,
+                            "to": to_version,
+                            "date": date,
+                            "columns": columns,
+                            "checksum": get_database_checksum(new_connection,
+                                                              table,
+                                                              columns)}) + "\n")
+
+        old_line = next(old_rows, None)
+        new_line = next(new_rows, None)
+
+        # merge join over both ordered row streams
+        while old_line or new_line:
+            if new_line and (not old_line or new_line[0] < old_line[0]):
+                action, line = 1, new_line
+                new_line = next(new_rows, None)
+            elif old_line and (not new_line or old_line[0] < new_line[0]):
+                action, line = 3, old_line
+                old_line = next(old_rows, None)
+            else:
+                action, line = 2, new_line
+                changed = old_line != new_line
+                old_line = next(old_rows, None)
+                new_line = next(new_rows, None)
+
+                if not changed:
+                    continue
+
+            entry = {"action": action, "CircRNA_ID": line[0]}
+
+            if action != 3:
+                entry['row'] = list(line[1:])
+
+            f.write(json.dumps(entry) + "\n")
+            changes[action] += 1
+
+    return changes
+
+
+def apply_delta(connection, delta_file, table, from_version, known_columns):
+
+    # applies all changes inside the caller's transaction and returns the
+    # delta header and the number of changes per action
+    # column names and the release name end up in SQL statements and the
+    # cache path, only known columns and plain release names are accepted
+
+    header = json.loads(delta_file.readline())
+
+    if header['from'] != from_version:
+        raise ValueError("Delta updates version " + header['from'] +
+                         ", local database is version " + from_version)
+
+    if not re.fullmatch(r"[0-9A-Za-z][0-9A-Za-z._-]*", str(header['to'])):
+        raise ValueError("Invalid release name " + str(header['to']))
+
+    columns = header['columns']
+
+    unknown = [str(column) for column in columns
+               if column not in known_columns]
+
+    if unknown or not columns:
+        raise ValueError("Delta contains unknown columns: " +
+                         ", ".join(unknown))
+
+    connection.execute("INSERT INTO " + table + "_db_info (Version, Date) "
+                       "VALUES (?, ?)", (header['to'], header['date']))
+
+    db_id = connection.execute("SELECT last_insert_rowid()").fetchall()[0][0]
+
+    insert_sql = "INSERT INTO " + table + " (CircRNA_ID, " + \
+                 ",".join(columns) + ") VALUES (" + \
+                 ",".join(["?"] * (len(columns) + 1)) + ")"
+
+    update_sql = "UPDATE " + table + " SET " + \
+                 ",".join([column + " = ?" for column in columns]) + \
+                 " WHERE CircRNA_ID = ?"
+
+    delete_sql = "DELETE FROM " + table + " WHERE CircRNA_ID = ?"
+
+    log_sql = "INSERT OR REPLACE INTO " + table + "_log " \
+              "(CircRNA_ID, Action, DB_ID) VALUES (?, ?, ?)"
+
+    changes = {1: 0, 2: 0, 3: 0}
+
+    for line in delta_file:
+        entry = json.loads(line)
+
+        if entry['action'] == 1:
+            connection.execute(insert_sql,
+                               [entry['CircRNA_ID']] + entry['row'])
+        elif entry['action'] == 2:
+            connection.execute(update_sql,
+                               entry['row'] + [entry['CircRNA_ID']])
+        elif entry['action'] == 3:
+            connection.execute(delete_sql, (entry['CircRNA_ID'],))
+        else:
+            raise ValueError("Unknown delta action " + str(entry['action']))
+
+        connection.execute(log_sql, (entry['CircRNA_ID'], entry['action'],
+                                     db_id))
+
+        changes[entry['action']] += 1
+
+    return header, changes
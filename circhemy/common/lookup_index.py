@@ -0,0 +1,147 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# memory-mapped lookup index files, one per ID column
+#
+# file layout (little endian):
+#   header:  magic (8 bytes), database version (16 bytes, NUL padded),
+#            database checksum (32 bytes, hex), key width (uint32),
+#            number of records (uint64)
+#   records: key (key width bytes, UTF-8, NUL padded), CircRNA_ID (int64)
+#
+# records are sorted by key bytes and CircRNA_ID, so lookups are a plain
+# binary search over the mapped file without any parsing
+# the checksum is the one of the content-addressed database file the index
+# was built from, index files are only used with exactly this file
+
+import mmap
+import os
+import struct
+
+index_magic = b"CIRCIDX2"
+
+index_header = struct.Struct("<8s16s32sIQ")
+
+index_row_id = struct.Struct("<q")
+
+
+def get_key_column(column):
+
+    # Coordinates are a meta column built from Chr, Start and Stop
+    if column == "Coordinates":
+        return "Chr || ':' || Start || '|' || Stop"
+
+    return column
+
+
+def get_key_sql(table, column):
+
+    return "SELECT CircRNA_ID, " + get_key_column(column) + " FROM " + \
+           table + " WHERE " + get_key_column(column) + " IS NOT NULL"
+
+
+def build_lookup_index(connection, table, column, path, database_version,
+                       database_checksum):
+
+    records = [(str(line[1]).encode("utf-8"), line[0]) for line in
+               connection.execute(get_key_sql(table, column))]
+
+    records.sort()
+
+    key_width = max([len(key) for key, row_id in records], default=1)
+
+    # write to a temporary file first, readers never see partial files
+    with open(path + ".tmp", "wb") as f:
+        f.write(index_header.pack(index_magic,
+                                  database_version.encode("ascii"),
+                                  database_checksum.encode("ascii"),
+                                  key_width,
+                                  len(records)))
+
+        for key, row_id in records:
+            f.write(key.ljust(key_width, b"\0"))
+            f.write(index_row_id.pack(row_id))
+
+    os.replace(path + ".tmp", path)
+
+    return len(records)
+
+
+class LookupIndex(object):
+
+    def __init__(self, path):
+
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic = self.data[:len(index_magic)]
+
+        if magic != index_magic:
+            self.data.close()
+            raise ValueError(path + " is not a circhemy lookup index of "
+                                    "this version")
+
+        magic, version, checksum, self.key_width, self.count = \
+            index_header.unpack_from(self.data, 0)
+
+        self.database_version = version.rstrip(b"\0").decode("ascii")
+        self.database_checksum = checksum.rstrip(b"\0").decode("ascii")
+
+        self.record_width = self.key_width + index_row_id.size
+
+    def get_key(self, position):
+        offset = index_header.size + position * self.record_width
+        return self.data[offset:offset + self.key_width]
+
+    def get_row_id(self, position):
+        offset = index_header.size + position * self.record_width + \
+                 self.key_width
+        return index_row_id.unpack_from(self.data, offset)[0]
+
+    def find(self, key):
+
+        key = key.encode("utf-8")
+
+        # keys longer than the widest indexed key can not match
+        if len(key) > self.key_width:
+            return []
+
+        key = key.ljust(self.key_width, b"\0")
+
+        # binary search for the first record >= key
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.get_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        row_ids = []
+
+        while low < self.count and self.get_key(low) == key:
+            row_ids.append(self.get_row_id(low))
+            low += 1
+
+        return row_ids
+
+    def close(self):
+        self.data.close()
@@ -0,0 +1,135 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# optional vectorized conversion engine for very large batch conversions
+# requires numpy, install via: pip install circhemy[numpy]
+
+import numpy as np
+
+
+class NumpyEngine(object):
+
+    # loads the required columns once from SQLite and resolves whole input
+    # batches with np.searchsorted over sorted key arrays
+    # output is identical to Util.run_simple_select_query: every matching
+    # row is returned once, ordered by CircRNA_ID
+
+    def __init__(self, util):
+        self.util = util
+
+        # input column -> (sorted keys, CircRNA_IDs in key order)
+        self.key_arrays = dict()
+
+        # output column -> values in CircRNA_ID order
+        self.column_arrays = dict()
+
+        self.row_ids = None
+
+    def load_key_column(self, input_field):
+
+        if input_field not in self.key_arrays:
+
+            if input_field == "Coordinates":
+                sql = "SELECT CircRNA_ID, Chr || ':' || Start || '|' || Stop " \
+                      "FROM " + self.util.database_table_name
+            else:
+                sql = "SELECT CircRNA_ID, " + input_field + " FROM " + \
+                      self.util.database_table_name + " WHERE " + \
+                      input_field + " IS NOT NULL"
+
+            sql_output = self.util.db_cursor.execute(sql).fetchall()
+
+            row_ids = np.fromiter((line[0] for line in sql_output),
+                                  dtype=np.int64, count=len(sql_output))
+
+            # keys are compared as strings, like the input
+            keys = np.array([str(line[1]) for line in sql_output], dtype=str)
+
+            permutation = np.argsort(keys, kind="stable")
+
+            self.key_arrays[input_field] = (keys[permutation],
+                                            row_ids[permutation])
+
+        return self.key_arrays[input_field]
+
+    def load_row_ids(self):
+
+        if self.row_ids is None:
+            sql_output = self.util.db_cursor.execute(
+                "SELECT CircRNA_ID FROM " + self.util.database_table_name +
+                " ORDER BY CircRNA_ID").fetchall()
+
+            self.row_ids = np.fromiter((line[0] for line in sql_output),
+                                       dtype=np.int64, count=len(sql_output))
+
+        return self.row_ids
+
+    def load_output_column(self, output_field):
+
+        if output_field not in self.column_arrays:
+            sql_output = self.util.db_cursor.execute(
+                "SELECT " + output_field + " FROM " +
+                self.util.database_table_name +
+                " ORDER BY CircRNA_ID").fetchall()
+
+            # object arrays keep the original Python values incl. None
+            column = np.empty(len(sql_output), dtype=object)
+            column[:] = [line[0] for line in sql_output]
+
+            self.column_arrays[output_field] = column
+
+        return self.column_arrays[output_field]
+
+    def find_row_positions(self, query_data, input_field):
+
+        if input_field == "Coordinates":
+            query_data = self.util.prepare_coordinates(self.util, query_data)
+
+        sorted_keys, sorted_row_ids = self.load_key_column(input_field)
+
+        if not query_data or not len(sorted_keys):
+            return np.empty(0, dtype=np.int64)
+
+        queries = np.unique(np.array(query_data, dtype=str))
+
+        left = np.searchsorted(sorted_keys, queries, side="left")
+        right = np.searchsorted(sorted_keys, queries, side="right")
+
+        counts = right - left
+        total = int(counts.sum())
+
+        # expand all [left, right) ranges into one index array
+        range_starts = np.repeat(left, counts)
+        range_offsets = np.arange(total) - np.repeat(np.cumsum(counts) -
+                                                     counts, counts)
+
+        matched_row_ids = np.unique(sorted_row_ids[range_starts +
+                                                   range_offsets])
+
+        # positions of the matched rows in the output column arrays
+        return np.searchsorted(self.load_row_ids(), matched_row_ids)
+
+    def run_simple_select_query(self, output_field_list, query_data,
+                                input_field):
+
+        positions = self.find_row_positions(query_data, input_field)
+
+        columns = [self.load_output_column(field)[positions].tolist()
+                   for field in output_field_list]
+
+        return list(zip(*columns))
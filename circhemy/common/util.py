@@ -12,11 +12,99 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import contextlib
+import json
 import os
+import re
 import sqlite3
+import sys
+import time
 import circhemy
 
 
+class QueryTooExpensiveError(Exception):
+
+    # raised when a query exceeds its time or VM step budget
+    # carries a JSON-compatible description for CLI, web and REST output
+
+    def __init__(self, reason, limit, elapsed, steps):
+        self.reason = reason
+        self.limit = limit
+        self.elapsed = elapsed
+        self.steps = steps
+
+        if reason == "time":
+            message = "query too expensive: time budget of " + \
+                      str(limit) + "s exceeded"
+        else:
+            message = "query too expensive: budget of " + \
+                      str(limit) + " SQLite VM steps exceeded"
+
+        super().__init__(message)
+
+    def __reduce__(self):
+        # keeps the error picklable for conversion worker processes
+        return self.__class__, (self.reason, self.limit, self.elapsed,
+                                self.steps)
+
+    def as_dict(self):
+        return {"error": "query too expensive",
+                "reason": self.reason,
+                "limit": self.limit,
+                "elapsed": round(self.elapsed, 3),
+                "steps": self.steps,
+                "detail": str(self)}
+
+
+def get_config_value(name):
+
+    # value of name in the [circhemy] section of /etc/circhemy/circhemy.cfg
+    # or $XDG_CONFIG_HOME/circhemy/circhemy.cfg, empty if not configured
+
+    config_files = [os.path.join(os.sep, "etc", "circhemy", "circhemy.cfg"),
+                    os.environ.get("CIRCHEMY_CONFIG",
+                                   os.path.join(
+                                       os.environ.get("XDG_CONFIG_HOME") or
+                                       os.path.expanduser("~/.config"),
+                                       "circhemy", "circhemy.cfg"))]
+
+    if not any(map(os.path.isfile, config_files)):
+        return ""
+
+    import configparser
+
+    # later files override earlier ones, users override the system
+    config = configparser.ConfigParser()
+    config.read(config_files)
+
+    return config.get("circhemy", name, fallback="")
+
+
+def get_database_location(database_version):
+
+    # one shared, versioned copy of the database for all installations
+    # the cache directory is taken from CIRCHEMY_CACHE_DIR, cache_dir of
+    # the config file, see get_config_value(), or defaults to
+    # $XDG_CACHE_HOME/circhemy
+    # databases installed inside the package by older releases are used
+    # as long as no cache directory is configured
+
+    package_location = circhemy.__path__[0] + "/data/circhemy.sqlite3"
+
+    cache_dir = os.environ.get("CIRCHEMY_CACHE_DIR", "") or \
+        get_config_value("cache_dir")
+
+    if not cache_dir:
+        if os.path.isfile(package_location):
+            return package_location
+
+        cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                                 os.path.expanduser("~/.cache"), "circhemy")
+
+    return os.path.join(os.path.expanduser(cache_dir), database_version,
+                        "circhemy.sqlite3")
+
+
 class Util(object):
 
     # global settings
@@ -35,14 +123,58 @@ class Util(object):
     news_url = "https://redmine.jakobilab.org/projects/circhemy/" \
                "news.atom?key=c616b9fb231445ac4ca65d94db1d3207382798e9"
 
-    database_location = circhemy.__path__[0]+"/data/circhemy.sqlite3"
+    database_location = get_database_location(database_version)
+
+    database_url = os.environ.get(
+        "CIRCHEMY_DATABASE_URL",
+        "https://links.jakobilab.org/circhemy.sqlite3.gz")
+
+    database_md5 = os.environ.get(
+        "CIRCHEMY_DATABASE_MD5_URL",
+        "https://links.jakobilab.org/circhemy.sqlite3.gz.md5")
 
-    database_url = "https://links.jakobilab.org/circhemy.sqlite3.gz"
+    # number of input lines converted at once in streaming mode
+    stream_batch_size = 10000
 
-    database_md5 = "https://links.jakobilab.org/circhemy.sqlite3.gz.md5"
+    # number of rows per row group in parquet output
+    parquet_row_group_size = 100000
+
+    # size of the chunks streamed from the database server
+    download_chunk_size = 1024 * 1024
+
+    # manifest and delta patches for incremental database updates
+    database_delta_url = "https://links.jakobilab.org/circhemy_delta/"
 
     database_table_name = "circhemy"
 
+    # prebuilt memory-mapped lookup index files for fast convert startup
+    lookup_index_url = "https://links.jakobilab.org/circhemy_index.tar.gz"
+
+    lookup_index_columns = ["Coordinates",
+                            "CSNv1",
+                            "Gene",
+                            "ENSEMBL",
+                            "Entrez",
+                            "circBase",
+                            "CircAtlas2",
+                            "circRNADb",
+                            "circBank",
+                            "deepBase2",
+                            "Circpedia2",
+                            "riboCIRC",
+                            "exoRBase2",
+                            "Arraystar"]
+
+    # number of matched rows fetched from SQLite per query
+    lookup_batch_size = 5000
+
+    # secondary indexes of the circRNA table, built by circhemy index for
+    # databases shipped without them; index name -> indexed columns
+    database_indexes = dict(
+        [("circhemy_coordinates", ["Chr", "Start", "Stop"])] +
+        [("circhemy_" + column, [column]) for column in
+         lookup_index_columns if column != "Coordinates"])
+
     database_species_list = ["homo_sapiens",
                              "mus_musculus",
                              "rattus_norvegicus"]
@@ -54,6 +186,17 @@ class Util(object):
                             "rn5",
                             "rn6"]
 
+    # genome builds of the same species that can be mapped onto each other
+    database_liftover_pairs = {"hg19": "hg38",
+                               "hg38": "hg19",
+                               "mm9": "mm10",
+                               "mm10": "mm9",
+                               "rn5": "rn6",
+                               "rn6": "rn5"}
+
+    # build-independent IDs used to link circRNAs across genome builds
+    database_liftover_columns = ["CircAtlas2", "circBase"]
+
     select_db_columns = [
         "CSNv1",
         "Gene",
@@ -117,6 +260,15 @@ class Util(object):
         "Pubmed"
     ]
 
+    # columns holding integers, used for typed output formats
+    db_integer_columns = ["CircRNA_ID",
+                          "Entrez",
+                          "Start",
+                          "Stop",
+                          "Pubmed",
+                          "Start_offset",
+                          "Stop_offset"]
+
     db_columns = ["Species"] + select_db_columns + ["Chr",
                                                     "Start",
                                                     "Stop",
@@ -162,8 +314,216 @@ class Util(object):
     db_connection = ""
     db_cursor = ""
 
+    # (chart, dbsize, chart2) from database_stats, computed once
+    database_stats_cache = None
+
+    def ensure_database(self):
+
+        # the database is opened on first use, importing circhemy or
+        # running --help / --version never touches it
+        if not self.db_connection:
+            self.setup_database(self, self.database_location)
+
+    # set by the query daemon, which keeps its warm connection and caches
+    # between requests
+    keep_database_open = False
+
+    def close_database(self):
+
+        if self.db_connection and not self.keep_database_open:
+            self.db_connection.close()
+            self.db_connection = ""
+
+    # per-query budgets enforced via the SQLite progress handler
+    # 0 disables the respective limit
+    query_time_limit = float(os.environ.get("CIRCHEMY_QUERY_TIMEOUT", 0))
+
+    query_step_limit = int(os.environ.get("CIRCHEMY_QUERY_MAX_STEPS", 0))
+
+    # number of SQLite VM instructions between two budget checks
+    query_progress_interval = 10000
+
+    def set_query_budget(self, time_limit=0, step_limit=0):
+        self.query_time_limit = float(time_limit)
+        self.query_step_limit = int(step_limit)
+
+    # opt-in statement profiling, enabled via CIRCHEMY_PROFILE=<log file>
+    # or the --profile CLI flag
+    query_profile_log = os.environ.get("CIRCHEMY_PROFILE", "")
+
+    # statements slower than this (ms) get their query plan logged
+    query_profile_threshold = float(
+        os.environ.get("CIRCHEMY_PROFILE_THRESHOLD", 100))
+
+    query_profile_max_bytes = 10 * 1024 * 1024
+
+    query_profile_backup_count = 5
+
+    query_profile_logger = None
+
+    def enable_query_profiling(self, log_file=None, threshold=None):
+
+        if not log_file or log_file == "1":
+            log_file = "circhemy_profile.jsonl"
+
+        if threshold is not None:
+            self.query_profile_threshold = float(threshold)
+
+        # only needed for profiling, keeps startup of the CLI fast
+        import logging
+        from logging.handlers import RotatingFileHandler
+
+        logger = logging.getLogger("circhemy.profile")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        handler = RotatingFileHandler(log_file,
+                                      maxBytes=self.query_profile_max_bytes,
+                                      backupCount=
+                                      self.query_profile_backup_count)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+        self.query_profile_log = log_file
+        self.query_profile_logger = logger
+
+    @staticmethod
+    def get_query_shape(sql):
+
+        # collapse string literals, IN lists and repeated VALUES tuples so
+        # that statements only differing in their values end up with the
+        # same shape
+        shape = re.sub(r"\"[^\"]*\"|'[^']*'", "?", sql)
+        shape = re.sub(r"\?(\s*,\s*\?)+", "?, ...", shape)
+        shape = re.sub(r"(\(\?(?:, \.\.\.)?\))(\s*,\s*\1)+", r"\1, ...",
+                       shape)
+        shape = re.sub(r"\s+", " ", shape)
+
+        return shape.strip()
+
+    def log_query_profile(self, sql, parameters, rows, elapsed, error=None):
+
+        entry = {"time": round(time.time(), 3),
+                 "shape": self.get_query_shape(sql),
+                 "parameters": len(parameters),
+                 "rows": rows,
+                 "elapsed_ms": round(elapsed * 1000, 3)}
+
+        if error:
+            entry['error'] = error
+
+        if entry['elapsed_ms'] >= self.query_profile_threshold:
+            plan = self.db_cursor.execute("EXPLAIN QUERY PLAN " + sql,
+                                          parameters).fetchall()
+            entry['plan'] = [step[-1] for step in plan]
+
+        self.query_profile_logger.info(json.dumps(entry))
+
+    def run_sql_query(self, sql, parameters=()):
+
+        self.ensure_database(self)
+
+        if not self.query_profile_logger:
+            return self.run_budgeted_sql_query(self, sql, parameters)
+
+        start = time.perf_counter()
+
+        try:
+            sql_output = self.run_budgeted_sql_query(self, sql, parameters)
+        except QueryTooExpensiveError as error:
+            self.log_query_profile(self, sql, parameters, 0,
+                                   time.perf_counter() - start,
+                                   error=str(error))
+            raise
+
+        self.log_query_profile(self, sql, parameters, len(sql_output),
+                               time.perf_counter() - start)
+
+        return sql_output
+
+    def run_budgeted_sql_query(self, sql, parameters=()):
+
+        budget = self.get_query_budget(self)
+
+        return self.run_budgeted_query_step(
+            self, budget,
+            lambda: self.db_cursor.execute(sql, parameters).fetchall())
+
+    def get_query_budget(self):
+
+        # budget state of one statement, shared by all of its steps
+        interval = self.query_progress_interval
+
+        if self.query_step_limit:
+            interval = min(interval, self.query_step_limit)
+
+        return {"time_limit": self.query_time_limit,
+                "step_limit": self.query_step_limit,
+                "interval": interval,
+                "start": 0.0,
+                "elapsed": 0.0,
+                "steps": 0,
+                "reason": None}
+
+    def run_budgeted_query_step(self, budget, function):
+
+        # runs one step of a statement, e.g. execute or fetchmany of a
+        # streamed query, only the time spent in SQLite counts against the
+        # time limit, not the time the caller needs for the rows
+
+        def progress_handler():
+            budget['steps'] += budget['interval']
+
+            if budget['step_limit'] and \
+                    budget['steps'] > budget['step_limit']:
+                budget['reason'] = "steps"
+            elif budget['time_limit'] and \
+                    budget['elapsed'] + time.perf_counter() - \
+                    budget['start'] > budget['time_limit']:
+                budget['reason'] = "time"
+
+            # non-zero return value aborts the running statement
+            return 1 if budget['reason'] else 0
+
+        budget['start'] = time.perf_counter()
+
+        # no budget set, run query directly
+        if not budget['time_limit'] and not budget['step_limit']:
+            try:
+                return function()
+            finally:
+                budget['elapsed'] += time.perf_counter() - budget['start']
+
+        self.db_connection.set_progress_handler(progress_handler,
+                                                budget['interval'])
+
+        try:
+            return function()
+        except sqlite3.OperationalError:
+            if budget['reason']:
+                raise QueryTooExpensiveError(
+                    budget['reason'],
+                    budget['time_limit'] if budget['reason'] == "time"
+                    else budget['step_limit'],
+                    budget['elapsed'] + time.perf_counter() -
+                    budget['start'],
+                    budget['steps'])
+            raise
+        finally:
+            budget['elapsed'] += time.perf_counter() - budget['start']
+            self.db_connection.set_progress_handler(None, 0)
+
+    # per-column sets of all IDs in the database, see get_membership_set()
+    membership_sets = dict()
+
+    # number of input coordinates resolved per tolerance range join
+    coordinate_batch_size = 500
+
+    # extra output columns reported by tolerance-aware coordinate queries
+    coordinate_offset_columns = ["Start_offset", "Stop_offset"]
+
     def check_input_field_name(self, field):
-        if field not in self.db_columns:
+        if field not in self.db_columns and field != "Coordinates":
             print(field + " is not a valid input field name")
             exit(-1)
         return
@@ -192,35 +552,67 @@ class Util(object):
 
         return fixed_coord_list
 
+    def split_coordinates(self, coord_list):
+
+        # break chr:start|stop strings into (chr, start, stop) tuples
+        split_coord_list = []
+
+        for line in self.prepare_coordinates(self, coord_list):
+            chromosome, positions = line.rsplit(":", 1)
+            start, stop = positions.split("|", 1)
+
+            try:
+                split_coord_list.append((chromosome, int(start), int(stop)))
+            except ValueError:
+                continue
+
+        return split_coord_list
+
+    def get_membership_set(self, input_field):
+
+        # lazily loads all distinct values of a column into a hash set
+        # so that found-counts can be answered without touching SQLite
+
+        if input_field not in self.membership_sets:
+
+            self.ensure_database(self)
+
+            if input_field == "Coordinates":
+                sql = "SELECT DISTINCT Chr || ':' || Start || '|' || Stop " \
+                      "FROM " + self.database_table_name
+            else:
+                sql = "SELECT DISTINCT " + input_field + " FROM " + \
+                      self.database_table_name + " WHERE " + input_field + \
+                      " IS NOT NULL"
+
+            # values are compared as strings, like the input
+            self.membership_sets[input_field] = frozenset(
+                str(line[0]) for line in self.db_cursor.execute(sql))
+
+        return self.membership_sets[input_field]
+
     def check_input_return_found_circ_number(self, query_data, input_field):
 
-        # this is a special case, we treat "Coordinates" as some kind of meta input
-        # we break the input into chr, start and stop for the following query
-        if input_field == "Coordinates":
-            # build SQL string
-            coords = self.prepare_coordinates(self, query_data)
+        if not query_data:
+            return 0, 0
 
-            sql = "SELECT count(distinct(Chr || ':' || " \
-                  "Start || '|' || Stop)) as Coordinates FROM " +\
-                  self.database_table_name + \
-                  " WHERE Chr || ':' || " \
-                  "Start || '|' || Stop in ({seq})".format(
-                    seq=','.join(['?'] * len(coords)))
-            sql_output = self.db_cursor.execute(sql, coords).fetchall()
+        members = self.get_membership_set(self, input_field)
 
+        # this is a special case, we treat "Coordinates" as some kind of meta input
+        # we break the input into chr, start and stop for the lookup
+        if input_field == "Coordinates":
+            found = len(members.intersection(
+                self.prepare_coordinates(self, query_data)))
         else:
-            # build SQL string
-            sql = "SELECT count(distinct("+input_field+")) FROM " +\
-                  self.database_table_name + \
-                  " WHERE " + input_field + " in ({seq})".format(
-                    seq=','.join(['?'] * len(query_data)))
-            sql_output = self.db_cursor.execute(sql, query_data).fetchall()
+            found = len(members.intersection(query_data))
 
         # return ratio (0->1)
-        return sql_output[0][0]/len(query_data), sql_output[0][0]
+        return found/len(query_data), found
 
     def database_stats(self):
 
+        self.ensure_database(self)
+
         sql = "SELECT count() FROM "+self.database_table_name+";"
 
         dbsize = self.db_cursor.execute(sql).fetchall()[0][0]
@@ -270,63 +662,269 @@ class Util(object):
 
         return chart_dict, dbsize, chart2_dict
 
-    def setup_database(self, database, from_cli=False):
+    def get_database_stats(self):
 
-        # check if there is a .bz2 version of the database
-        # if yes, this is the first time circhemy runs
-        # we have to unpack it one time
+        # the statistics only change with a new database release
+        if not self.database_stats_cache:
+            self.database_stats_cache = self.database_stats(self)
 
-        if not os.path.isfile(database):
-            print("This is the first run of circhemy.")
+        return self.database_stats_cache
 
-            print("You should only see this message once.")
+    def print_download_progress(self, downloaded, total):
 
-            # for downloads
-            from urllib import request
+        # progress is only shown on interactive terminals
+        if not sys.stderr.isatty():
+            return
+
+        if total:
+            sys.stderr.write("\rDownloading database: %6.1f%% of %d MB" % (
+                downloaded / total * 100, total / 1024 / 1024))
+        else:
+            sys.stderr.write("\rDownloading database: %d MB" % (
+                downloaded / 1024 / 1024))
+
+        sys.stderr.flush()
+
+    @contextlib.contextmanager
+    def database_lock(self, database):
+
+        # serializes downloads and updates of a shared database between
+        # processes, readers are never blocked
+        try:
+            import fcntl
+        except ImportError:
+            # no advisory file locks on this platform
+            yield
+            return
+
+        with open(database + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get_database_file(self, database, checksum, version=None):
+
+        # database files are named by their content checksum and live in
+        # the directory of their release in the shared cache,
+        # <cache dir>/<release>/circhemy-<checksum>.sqlite3
+        directory = os.path.dirname(database)
+
+        if version and os.path.basename(directory) == self.database_version:
+            directory = os.path.join(os.path.dirname(directory), version)
 
-            # for md5 checksums
-            import hashlib
+        return os.path.join(directory, "circhemy-" + checksum + ".sqlite3")
 
-            db_url = self.database_url
-            md5_url = self.database_md5
+    def link_database_file(self, file_path, link):
 
-            database_gzip = database+".gz"
-            database_remote_md5 = database+".md5"
+        # atomically points the symlink <link> to file_path
+        if os.path.lexists(link + ".link"):
+            os.remove(link + ".link")
 
-            request.urlretrieve(md5_url, database_remote_md5)
-            request.urlretrieve(db_url, database_gzip)
+        os.symlink(os.path.relpath(file_path, os.path.dirname(link)),
+                   link + ".link")
+        os.replace(link + ".link", link)
 
-            # open md5 file to get hash
-            with open(database_remote_md5) as f:
-                line = f.readline()
+    def install_database_file(self, path, database, checksum, version=None):
 
+        # database files are stored read-only under their content checksum,
+        # <database> is a symlink to the current file that is swapped
+        # atomically, running processes keep reading their old file
+        # lookup index files are built into the index directory of the new
+        # file beforehand, the swap publishes both together
+
+        import shutil
+
+        file_path = self.get_database_file(self, database, checksum, version)
+
+        previous = os.path.realpath(database) \
+            if os.path.islink(database) else None
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        os.chmod(path, 0o444)
+        os.replace(path, file_path)
+
+        # circhemy versions expecting the new release find it as well
+        release_link = os.path.join(os.path.dirname(file_path),
+                                    os.path.basename(database))
+
+        if release_link != database and (os.path.islink(release_link) or
+                                         not os.path.lexists(release_link)):
+            self.link_database_file(self, file_path, release_link)
+
+        self.link_database_file(self, file_path, database)
+
+        if previous and previous != os.path.realpath(file_path) and \
+                os.path.isfile(previous):
+            os.remove(previous)
+            shutil.rmtree(self.get_lookup_index_dir(self, previous),
+                          ignore_errors=True)
+
+    def download_database(self, database):
+
+        # streams the gzipped database in chunks; the md5 checksum and the
+        # decompression run incrementally on the same chunks
+        # the compressed data is kept in <database>.gz.part so interrupted
+        # downloads resume via HTTP range requests
+        # returns False if the integrity check fails
+
+        import hashlib
+        import zlib
+        from urllib import error, request
+
+        with request.urlopen(self.database_md5) as f:
             # we only need the md5 checksum
-            remote_md5 = line.strip().split()[0]
+            remote_md5 = f.read().decode().strip().split()[0]
+
+        database_part = database + ".gz.part"
+        database_tmp = database + ".tmp"
+
+        hash_md5 = hashlib.md5()
 
-            # get md5 local hash
-            hash_md5 = hashlib.md5()
-            hash_md5.update(open(database_gzip, 'rb').read())
-            db_md5 = hash_md5.hexdigest()
+        # wbits offset 16 expects a gzip header
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
 
-            print("SQLite3 database and checksum file downloaded,"
-                  " checking integrity.")
+        downloaded = 0
+        corrupt = False
 
-            if db_md5 == remote_md5:
-                print("Integrity check okay, unpacking.")
-                os.system("gzip -d " + database+".gz")
-                print("Database installation finished.")
-                # test and write note
-            else:
-                print("Integrity check failed, "
-                      "please try running the setup again.")
-                print("Should the error persist please open an issue at "
-                      "https://github.com/jakobilab/circhemy/issues/new")
-                exit(-1)
+        with open(database_tmp, "wb") as output:
+
+            # replay the part that was downloaded before an interruption
+            if os.path.isfile(database_part):
+                print("Resuming interrupted download.")
+
+                try:
+                    with open(database_part, "rb") as part:
+                        for chunk in iter(
+                                lambda: part.read(self.download_chunk_size),
+                                b""):
+                            hash_md5.update(chunk)
+                            output.write(decompressor.decompress(chunk))
+                            downloaded += len(chunk)
+                except zlib.error:
+                    # damaged part file, start over
+                    os.remove(database_part)
+                    output.seek(0)
+                    output.truncate(0)
+                    hash_md5 = hashlib.md5()
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    downloaded = 0
+
+            db_request = request.Request(self.database_url)
+
+            if downloaded:
+                db_request.add_header("Range", "bytes=" + str(downloaded) + "-")
+
+            try:
+                response = request.urlopen(db_request)
+            except error.HTTPError as http_error:
+                # range not satisfiable: the part file is already complete
+                if http_error.code != 416:
+                    raise
+                response = None
+
+            if response:
+                with response, open(database_part, "ab") as part:
+
+                    # server ignored the range request, start from scratch
+                    if downloaded and response.status != 206:
+                        part.truncate(0)
+                        output.seek(0)
+                        output.truncate(0)
+                        hash_md5 = hashlib.md5()
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        downloaded = 0
+
+                    total = downloaded + \
+                        int(response.headers.get("Content-Length", 0))
+
+                    for chunk in iter(
+                            lambda: response.read(self.download_chunk_size),
+                            b""):
+                        part.write(chunk)
+                        hash_md5.update(chunk)
+                        downloaded += len(chunk)
+
+                        # keep downloading on corrupt data, the md5 check
+                        # below fails and removes the part file
+                        if not corrupt:
+                            try:
+                                output.write(decompressor.decompress(chunk))
+                            except zlib.error:
+                                corrupt = True
+
+                        self.print_download_progress(self, downloaded, total)
+
+                if sys.stderr.isatty():
+                    sys.stderr.write("\n")
+
+            if not corrupt:
+                output.write(decompressor.flush())
+
+        print("SQLite3 database downloaded, checking integrity.")
+
+        if hash_md5.hexdigest() != remote_md5 or corrupt or \
+                not decompressor.eof:
+            os.remove(database_part)
+            os.remove(database_tmp)
+            return False
+
+        print("Integrity check okay.")
+
+        # readers only ever see the complete database
+        self.install_database_file(self, database_tmp, database, remote_md5)
+        os.remove(database_part)
+
+        return True
+
+    def install_database(self, database):
+
+        print("This is the first run of circhemy.")
+
+        print("You should only see this message once.")
+
+        if self.download_database(self, database):
+            print("Database installation finished.")
+
+            self.download_lookup_index(self)
+        else:
+            print("Integrity check failed, "
+                  "please try running the setup again.")
+            print("Should the error persist please open an issue at "
+                  "https://github.com/jakobilab/circhemy/issues/new")
+            exit(-1)
+
+    def setup_database(self, database, from_cli=False):
+
+        # check if there is a .bz2 version of the database
+        # if yes, this is the first time circhemy runs
+        # we have to unpack it one time
+
+        if not os.path.isfile(database):
+            os.makedirs(os.path.dirname(database), exist_ok=True)
+
+            with self.database_lock(self, database):
+
+                # another process may have installed the database while
+                # we were waiting for the lock
+                if not os.path.isfile(database):
+                    self.install_database(self, database)
 
         if os.path.isfile(database) and from_cli:
             print("Database already downloaded.")
 
-        self.db_connection = sqlite3.connect(database)
+        # the symlink may be swapped by an update at any time, the checksum
+        # has to belong to the file that is actually opened
+        database_file = os.path.realpath(database)
+
+        self.database_file = database_file
+        self.database_checksum = self.get_database_checksum(self,
+                                                            database_file)
+
+        self.db_connection = sqlite3.connect(database_file)
 
         # SQLite optimizations from
         # https://phiresky.github.io/blog/2020/sqlite-performance-tuning/
@@ -344,7 +942,36 @@ class Util(object):
         # getting db cursor
         self.db_cursor = self.db_connection.cursor()
 
+        self.index_manifest = self.get_index_manifest(self,
+                                                      self.db_connection)
+
+        if self.query_profile_log and not self.query_profile_logger:
+            self.enable_query_profiling(self, self.query_profile_log)
+
+
 
+    def read_query_batches(self, stream, batch_size=None):
+
+        # yields lists of at most batch_size input lines as soon as they
+        # are read, works for pipes and FIFOs; stops at a line with Exit
+
+        if not batch_size:
+            batch_size = self.stream_batch_size
+
+        batch = []
+
+        for line in iter(stream.readline, ""):
+            if 'Exit' == line.rstrip():
+                break
+
+            batch.append(line.rstrip())
+
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
 
     @staticmethod
     def process_sql_output(sql_output, seperator="\t", empty_char="NA"):
@@ -358,12 +985,25 @@ class Util(object):
 
         return processed_output
 
-    def run_simple_select_query(self, output_field_list, query_data, input_field):
+    def run_simple_select_query(self, output_field_list, query_data,
+                                input_field, tolerance=0, from_genome=None,
+                                to_genome=None):
 
         # build SQL string from sanitized(!) field names
         sql_output_field_list = ",".join(output_field_list)
 
-        if input_field == "Coordinates":
+        if input_field == "Coordinates" and from_genome and to_genome:
+            sql_output = self.run_liftover_query(self,
+                                                 output_field_list,
+                                                 query_data,
+                                                 from_genome,
+                                                 to_genome)
+        elif input_field == "Coordinates" and tolerance:
+            sql_output = self.run_coordinate_tolerance_query(self,
+                                                             output_field_list,
+                                                             query_data,
+                                                             tolerance)
+        elif input_field == "Coordinates":
             # build SQL string
             coords = self.prepare_coordinates(self, query_data)
 
@@ -371,20 +1011,682 @@ class Util(object):
                   self.database_table_name + \
                   " WHERE Chr || ':' || " \
                   "Start || '|' || Stop in ({seq})".format(
-                    seq=','.join(['?'] * len(coords)))
-            sql_output = self.db_cursor.execute(sql, coords).fetchall()
+                    seq=','.join(['?'] * len(coords))) + \
+                  " ORDER BY CircRNA_ID"
+            sql_output = self.run_sql_query(self, sql, coords)
         else:
             # build SQL string
+            # explicit row order keeps the output stable with or without
+            # secondary indexes and identical to the numpy engine
             sql = "SELECT " + sql_output_field_list +\
                   " FROM " + self.database_table_name + \
                   " WHERE " + input_field + " in ({seq})".format(
-                    seq=','.join(['?'] * len(query_data)))
-            sql_output = self.db_cursor.execute(sql, query_data).fetchall()
+                    seq=','.join(['?'] * len(query_data))) + \
+                  " ORDER BY CircRNA_ID"
+            sql_output = self.run_sql_query(self, sql, query_data)
+
+        return sql_output
+
+    def run_coordinate_tolerance_query(self, output_field_list, query_data,
+                                       tolerance):
+
+        # finds the nearest circRNA(s) per genome build within +/- tolerance
+        # bp on both ends; each batch of input coordinates is resolved with a
+        # single range join that can use the (Chr, Start, Stop) index
+        # output rows carry the Start and Stop offsets (database - input)
+
+        coords = self.split_coordinates(self, query_data)
+
+        sql_output_field_list = ",".join(["Hit." + field
+                                          for field in output_field_list])
+
+        sql_output = []
+
+        for batch_start in range(0, len(coords), self.coordinate_batch_size):
+            batch = coords[batch_start:batch_start +
+                           self.coordinate_batch_size]
+
+            parameters = []
+
+            for index, (chromosome, start, stop) in enumerate(batch):
+                parameters += [batch_start + index, chromosome, start, stop]
+
+            parameters += [tolerance] * 4
+
+            sql = "WITH Input(Idx, Chr, Start, Stop) AS (VALUES " + \
+                  ",".join(["(?, ?, ?, ?)"] * len(batch)) + ") " \
+                  "SELECT " + sql_output_field_list + \
+                  ", Hit.Start - Input.Start AS Start_offset" \
+                  ", Hit.Stop - Input.Stop AS Stop_offset" \
+                  ", RANK() OVER (PARTITION BY Input.Idx, Hit.Genome " \
+                  "ORDER BY abs(Hit.Start - Input.Start) + " \
+                  "abs(Hit.Stop - Input.Stop)) AS Distance_rank, " \
+                  "Input.Idx AS Input_idx " \
+                  "FROM Input INNER JOIN " + self.database_table_name + \
+                  " AS Hit ON Hit.Chr = Input.Chr " \
+                  "AND Hit.Start BETWEEN Input.Start - ? AND Input.Start + ? " \
+                  "AND Hit.Stop BETWEEN Input.Stop - ? AND Input.Stop + ?"
+
+            sql = "SELECT * FROM (" + sql + ") WHERE Distance_rank = 1 " \
+                  "ORDER BY Input_idx"
+
+            # drop the helper columns for rank and input position
+            sql_output += [line[:-2] for line in
+                           self.run_sql_query(self, sql, parameters)]
+
+        return sql_output
+
+    def has_liftover_table(self):
+
+        if self.database_table_name + "_liftover" in self.index_manifest:
+            return True
+
+        sql_output = self.db_cursor.execute(
+            "SELECT count() FROM sqlite_master WHERE type = 'table' "
+            "AND name = ?", (self.database_table_name + "_liftover",)
+        ).fetchall()
+
+        return sql_output[0][0] > 0
+
+    def build_liftover_table(self, connection):
+
+        # materializes the cross-build mapping: every circRNA is linked to
+        # the circRNAs of the other build of the same species that share
+        # one of the build-independent IDs
+        # connection has to be writeable and in autocommit mode
+
+        table = self.database_table_name
+
+        genome_pairs = [from_genome + ">" + to_genome for from_genome, to_genome
+                        in self.database_liftover_pairs.items()]
+
+        select_sql = []
+
+        for column in self.database_liftover_columns:
+            select_sql.append(
+                "SELECT Source.Genome, Source.Chr, Source.Start, "
+                "Source.Stop, Target.Genome, Target.CircRNA_ID "
+                "FROM " + table + " AS Source INNER JOIN " + table +
+                " AS Target ON Source." + column + " = Target." + column +
+                " AND Source.Species = Target.Species "
+                "WHERE Source." + column + " IS NOT NULL "
+                "AND Source.Genome || '>' || Target.Genome IN (" +
+                ",".join(["?"] * len(genome_pairs)) + ")")
+
+        # older databases were shipped without the mapping table
+        connection.execute("CREATE TABLE IF NOT EXISTS " + table +
+                           "_liftover (From_Genome TEXT NOT NULL, "
+                           "Chr TEXT NOT NULL, "
+                           "Start INTEGER NOT NULL, "
+                           "Stop INTEGER NOT NULL, "
+                           "To_Genome TEXT NOT NULL, "
+                           "CircRNA_ID INTEGER NOT NULL)")
+
+        connection.execute("CREATE INDEX IF NOT EXISTS " + table +
+                           "_liftover_coordinates ON " + table +
+                           "_liftover (From_Genome, To_Genome, Chr, Start, "
+                           "Stop)")
+
+        connection.execute("BEGIN TRANSACTION")
+        connection.execute("DELETE FROM " + table + "_liftover")
+        connection.execute("INSERT INTO " + table + "_liftover " +
+                           " UNION ".join(select_sql),
+                           genome_pairs * len(select_sql))
+        connection.execute("COMMIT TRANSACTION")
+
+        sql_output = connection.execute("SELECT count() FROM " + table +
+                                        "_liftover").fetchall()
+
+        return sql_output[0][0]
+
+    def run_liftover_query(self, output_field_list, query_data, from_genome,
+                           to_genome):
+
+        # maps coordinates from one genome build to the matching circRNAs
+        # of the other build with a single indexed join per batch
+
+        coords = self.split_coordinates(self, query_data)
+
+        sql_output_field_list = ",".join(["Hit." + field
+                                          for field in output_field_list])
+
+        sql_output = []
+
+        for batch_start in range(0, len(coords), self.coordinate_batch_size):
+            batch = coords[batch_start:batch_start +
+                           self.coordinate_batch_size]
+
+            parameters = []
+
+            for index, (chromosome, start, stop) in enumerate(batch):
+                parameters += [batch_start + index, chromosome, start, stop]
+
+            parameters += [from_genome, to_genome]
+
+            sql = "WITH Input(Idx, Chr, Start, Stop) AS (VALUES " + \
+                  ",".join(["(?, ?, ?, ?)"] * len(batch)) + ") " \
+                  "SELECT DISTINCT " + sql_output_field_list + \
+                  ", Input.Idx FROM Input INNER JOIN " + \
+                  self.database_table_name + "_liftover AS Map " \
+                  "ON Map.From_Genome = ? AND Map.To_Genome = ? " \
+                  "AND Map.Chr = Input.Chr AND Map.Start = Input.Start " \
+                  "AND Map.Stop = Input.Stop " \
+                  "INNER JOIN " + self.database_table_name + " AS Hit " \
+                  "ON Hit.CircRNA_ID = Map.CircRNA_ID " \
+                  "ORDER BY Input.Idx, Hit.CircRNA_ID"
+
+            # drop the helper column for the input position
+            sql_output += [line[:-1] for line in
+                           self.run_sql_query(self, sql, parameters)]
+
+        return sql_output
+
+    # content-addressed database file that is open and its checksum
+    database_file = ""
+    database_checksum = ""
+
+    def get_database_checksum(self, database):
+
+        # checksum of a content-addressed database file, empty for database
+        # files installed by older circhemy versions
+        match = re.fullmatch(r"circhemy-([0-9a-f]{32})\.sqlite3",
+                             os.path.basename(os.path.realpath(database)))
+
+        return match.group(1) if match else ""
+
+    def get_lookup_index_dir(self, database):
+
+        # every database file has its own directory of lookup index files
+        return os.path.splitext(os.path.realpath(database))[0] + ".index"
+
+    def read_lookup_index(self, path, checksum):
+
+        # returns the index file if it was built from the database file
+        # with this checksum, None otherwise
+        from circhemy.common.lookup_index import LookupIndex
+
+        if not checksum or not os.path.isfile(path):
+            return None
+
+        try:
+            index = LookupIndex(path)
+        except ValueError:
+            # empty files or index files of older circhemy versions
+            return None
+
+        if index.database_checksum != checksum:
+            index.close()
+            return None
+
+        return index
+
+    def open_lookup_index(self, input_field):
+
+        # returns None if there is no usable index file for this column
+        self.ensure_database(self)
+
+        # never use index files built from different database content, even
+        # of the same release
+        return self.read_lookup_index(
+            self, os.path.join(self.get_lookup_index_dir(self,
+                                                         self.database_file),
+                               input_field + ".idx"),
+            self.database_checksum)
+
+    def get_local_database_version(self, connection):
+
+        sql_output = connection.execute(
+            "SELECT Version FROM " + self.database_table_name + "_db_info "
+            "ORDER BY Date DESC, DB_ID DESC LIMIT 1").fetchall()
+
+        return sql_output[0][0] if sql_output else ""
+
+    def build_lookup_index_files(self, connection, columns, index_dir,
+                                 checksum):
+
+        # builds lookup index files of a database file into its own index
+        # directory, the files are stamped with the checksum of that file
+        from circhemy.common.lookup_index import build_lookup_index
+
+        version = self.get_local_database_version(self, connection)
+
+        os.makedirs(index_dir, exist_ok=True)
+
+        for column in columns:
+            build_lookup_index(connection,
+                               self.database_table_name,
+                               column,
+                               os.path.join(index_dir, column + ".idx"),
+                               version,
+                               checksum)
+
+    def rebuild_lookup_index(self, connection, database, file_path,
+                             checksum):
+
+        # builds the lookup index files installed for <database> for the
+        # updated database file before it is published
+        index_dir = self.get_lookup_index_dir(self, database)
+
+        if not os.path.isdir(index_dir):
+            return
+
+        columns = [file_name[:-len(".idx")]
+                   for file_name in sorted(os.listdir(index_dir))
+                   if file_name.endswith(".idx") and
+                   file_name[:-len(".idx")] in self.lookup_index_columns]
+
+        if columns:
+            self.build_lookup_index_files(
+                self, connection, columns,
+                self.get_lookup_index_dir(self, file_path), checksum)
+
+    # structures of the database known to be built, read from the index
+    # manifest when the database is opened; name -> type
+    index_manifest = {}
+
+    def get_index_manifest(self, connection):
+
+        table = self.database_table_name + "_index_manifest"
+
+        if not connection.execute("SELECT count() FROM sqlite_master "
+                                  "WHERE type = 'table' AND name = ?",
+                                  (table,)).fetchall()[0][0]:
+            return {}
+
+        return dict(connection.execute("SELECT Name, Type FROM " +
+                                       table).fetchall())
+
+    def get_database_size(self, connection):
+
+        # size of the used pages of the database in bytes, free pages are
+        # reused before the file grows
+        page_size = connection.execute("PRAGMA page_size").fetchall()[0][0]
+        page_count = connection.execute("PRAGMA page_count").fetchall()[0][0]
+        free_pages = connection.execute(
+            "PRAGMA freelist_count").fetchall()[0][0]
+
+        return page_size * (page_count - free_pages)
+
+    def build_database_indexes(self, database):
+
+        # builds all indexes, derived tables, statistics and lookup index
+        # files of this package version that are missing for the installed
+        # database and records them in the index manifest
+        # the database file is read-only, the structures are built in a copy
+        # that is swapped in like a database update
+
+        import hashlib
+        import shutil
+
+        if not os.path.isfile(database):
+            print("No local database installed, please run "
+                  "circhemy download first.")
+            exit(-1)
+
+        table = self.database_table_name
+
+        with self.database_lock(self, database):
+
+            connection = sqlite3.connect(database)
+
+            existing = set([line[0] for line in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type IN "
+                "('table', 'index')").fetchall()])
+
+            manifest = self.get_index_manifest(self, connection)
+
+            connection.close()
+
+            # (name, type) of all structures, in build order
+            structures = [(name, "index") for name in self.database_indexes]
+            structures.append((table + "_liftover", "table"))
+            structures.append(("sqlite_stat1", "statistics"))
+
+            missing = [(name, structure_type) for name, structure_type
+                       in structures if name not in existing]
+
+            index_dir = self.get_lookup_index_dir(self, database)
+
+            checksum = self.get_database_checksum(self, database)
+
+            # index files of other database content count as missing
+            missing_files = []
+
+            for column in self.lookup_index_columns:
+                index = self.read_lookup_index(
+                    self, os.path.join(index_dir, column + ".idx"), checksum)
+
+                if index:
+                    index.close()
+                else:
+                    missing_files.append(column)
+
+            report = []
+
+            # existing structures are recorded without build time and size
+            unrecorded = [(name, structure_type) for name, structure_type
+                          in structures if name in existing and
+                          name not in manifest]
+
+            # database files of older versions are not content-addressed
+            # yet, they are migrated by the same copy and swap
+            swap = missing or unrecorded or not checksum
+
+            if swap:
+                update_path = database + ".index"
+
+                shutil.copyfile(database, update_path)
+
+                connection = sqlite3.connect(update_path,
+                                             isolation_level=None)
+
+                try:
+                    connection.execute("CREATE TABLE IF NOT EXISTS " + table +
+                                       "_index_manifest ("
+                                       "Name TEXT PRIMARY KEY, "
+                                       "Type TEXT NOT NULL, "
+                                       "Software_version TEXT NOT NULL, "
+                                       "Date INTEGER NOT NULL, "
+                                       "Build_time REAL, "
+                                       "Size INTEGER)")
+
+                    for name, structure_type in missing:
+                        start = time.perf_counter()
+                        size = self.get_database_size(self, connection)
+
+                        if structure_type == "index":
+                            connection.execute(
+                                "CREATE INDEX " + name + " ON " + table +
+                                " (" + ", ".join(
+                                    self.database_indexes[name]) + ")")
+
+                        elif structure_type == "table":
+                            self.build_liftover_table(self, connection)
+
+                        else:
+                            connection.execute("ANALYZE")
+
+                        report.append((name, structure_type,
+                                       time.perf_counter() - start,
+                                       self.get_database_size(
+                                           self, connection) - size))
+
+                    connection.execute("BEGIN TRANSACTION")
+
+                    for name, structure_type in unrecorded:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO " + table +
+                            "_index_manifest VALUES (?, ?, ?, ?, NULL, NULL)",
+                            (name, structure_type, self.software_version,
+                             int(time.time())))
+
+                    for name, structure_type, build_time, size in report:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO " + table +
+                            "_index_manifest VALUES (?, ?, ?, ?, ?, ?)",
+                            (name, structure_type, self.software_version,
+                             int(time.time()), build_time, size))
+
+                    connection.execute("COMMIT TRANSACTION")
+
+                except sqlite3.Error as error:
+                    connection.close()
+                    os.remove(update_path)
+                    print("Building the database indexes failed: " +
+                          str(error))
+                    exit(-1)
+
+                # content-addressed like every installed file, by the md5
+                # checksum of the finished file, the connection only reads
+                # from here on
+                hash_md5 = hashlib.md5()
+
+                with open(update_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        hash_md5.update(chunk)
+
+                checksum = hash_md5.hexdigest()
+
+                # all index files of the new file are built before the swap
+                index_dir = self.get_lookup_index_dir(
+                    self, self.get_database_file(self, database, checksum))
+                missing_files = list(self.lookup_index_columns)
+
+            else:
+                connection = sqlite3.connect(database)
+
+            for column in missing_files:
+                start = time.perf_counter()
+
+                self.build_lookup_index_files(self, connection, [column],
+                                              index_dir, checksum)
+
+                report.append((column + ".idx", "lookup index",
+                               time.perf_counter() - start,
+                               os.path.getsize(os.path.join(
+                                   index_dir, column + ".idx"))))
+
+            connection.close()
+
+            if swap:
+                self.install_database_file(self, update_path, database,
+                                           checksum)
+
+        return report
+
+    def open_update_source(self, source, name):
+
+        # update sources can be a URL or a local directory
+        if source.startswith("http://") or source.startswith("https://"):
+            from urllib import request
+            return request.urlopen(source.rstrip("/") + "/" + name)
+
+        return open(os.path.join(source, name), "rb")
+
+    def update_database(self, database, source=None):
+
+        # applies the chain of delta patches from the local release to the
+        # latest release, one release at a time
+
+        if not source:
+            source = self.database_delta_url
+
+        if not os.path.isfile(database):
+            print("No local database installed, please run "
+                  "circhemy download first.")
+            exit(-1)
+
+        with self.open_update_source(self, source, "latest.json") as f:
+            manifest = json.load(f)
+
+        # one update at a time, concurrent runs wait and find the
+        # database up to date
+        with self.database_lock(self, database):
+            while True:
+                connection = sqlite3.connect(database)
+                local_version = self.get_local_database_version(self,
+                                                                connection)
+                connection.close()
+
+                if manifest['version'] == local_version:
+                    print("Database version " + local_version +
+                          " is up to date.")
+                    return
+
+                if local_version not in manifest['deltas']:
+                    print("No delta update from database version " +
+                          local_version + " available, please remove " +
+                          database + " and run circhemy download.")
+                    exit(-1)
+
+                self.apply_database_delta(self, database, source,
+                                          manifest['deltas'][local_version],
+                                          local_version)
+
+    def apply_database_delta(self, database, source, delta_entry,
+                             local_version):
+
+        # applies one delta patch to a copy of the database, verifies the
+        # resulting content checksum and swaps the copy in atomically
+
+        import gzip
+        import hashlib
+        import shutil
+        from circhemy.common import delta
+
+        delta_path = database + ".delta.gz"
+        update_path = database + ".update"
+
+        # download the delta and check its md5 checksum on the fly
+        hash_md5 = hashlib.md5()
+
+        with self.open_update_source(self, source, delta_entry['file']) \
+                as remote, open(delta_path, "wb") as local:
+            for chunk in iter(lambda: remote.read(1024 * 1024), b""):
+                hash_md5.update(chunk)
+                local.write(chunk)
+
+        if hash_md5.hexdigest() != delta_entry['md5']:
+            os.remove(delta_path)
+            print("Integrity check of the delta update failed, "
+                  "please try running the update again.")
+            exit(-1)
+
+        shutil.copyfile(database, update_path)
+
+        connection = sqlite3.connect(update_path, isolation_level=None)
+
+        try:
+            connection.execute("BEGIN TRANSACTION")
+
+            with gzip.open(delta_path, "rt") as f:
+                header, changes = delta.apply_delta(connection, f,
+                                                    self.database_table_name,
+                                                    local_version,
+                                                    self.all_db_columns)
+
+            print("Updating database version " + local_version + " to " +
+                  header['to'] + ".")
+
+            checksum = delta.get_database_checksum(connection,
+                                                   self.database_table_name,
+                                                   header['columns'])
+
+            if checksum != header['checksum']:
+                raise ValueError("checksum of the updated database "
+                                 "does not match the release")
+
+            connection.execute("COMMIT TRANSACTION")
+
+        except (ValueError, KeyError, sqlite3.Error) as error:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK TRANSACTION")
+            connection.close()
+            os.remove(update_path)
+            os.remove(delta_path)
+            print("Database update failed: " + str(error))
+            exit(-1)
+
+        print(self.db_action_codes[1] + ": " + str(changes[1]) + ", " +
+              self.db_action_codes[2] + ": " + str(changes[2]) + ", " +
+              self.db_action_codes[3] + ": " + str(changes[3]))
+
+        # secondary indexes were maintained row by row during the update,
+        # derived tables and statistics are refreshed here
+        self.build_liftover_table(self, connection)
+        connection.execute("PRAGMA optimize")
+
+        # the content checksum of the release addresses the new file, it is
+        # stored in the cache directory of the new release together with
+        # its lookup index files
+        self.rebuild_lookup_index(self, connection, database,
+                                  self.get_database_file(self, database,
+                                                         header['checksum'],
+                                                         header['to']),
+                                  header['checksum'])
+
+        connection.close()
+
+        self.install_database_file(self, update_path, database,
+                                   header['checksum'], header['to'])
+        os.remove(delta_path)
+
+        print("Database update to version " + header['to'] + " finished.")
+
+    def download_lookup_index(self):
+
+        # the index files are an optional speed-up, failing to fetch them
+        # only means conversions are served by SQLite alone
+        import tarfile
+        from urllib import request
+
+        index_dir = self.get_lookup_index_dir(self, self.database_location)
+
+        try:
+            archive, headers = request.urlretrieve(self.lookup_index_url)
+
+            with tarfile.open(archive) as tar:
+                # only accept plain index files, no paths or links
+                members = [member for member in tar.getmembers()
+                           if member.isfile() and member.name.endswith(".idx")
+                           and os.path.basename(member.name) == member.name]
+
+                os.makedirs(index_dir, exist_ok=True)
+
+                # extract next to the index directory and swap each file
+                # in, readers of a shared index never see partial files
+                extract_dir = index_dir + ".tmp"
+                tar.extractall(extract_dir, members=members)
+
+                for member in members:
+                    os.replace(os.path.join(extract_dir, member.name),
+                               os.path.join(index_dir, member.name))
+
+                os.rmdir(extract_dir)
+
+            os.remove(archive)
+
+            print("Lookup index files installed.")
+
+        except (OSError, tarfile.TarError):
+            print("Lookup index files not available, "
+                  "conversions will use SQLite only.")
+
+    def run_lookup_index_query(self, output_field_list, query_data,
+                               input_field, index):
+
+        # binary-searches the memory-mapped index file and only fetches
+        # the matched rows from SQLite via their primary key
+
+        if input_field == "Coordinates":
+            query_data = self.prepare_coordinates(self, query_data)
+
+        row_ids = set()
+
+        for key in set(query_data):
+            row_ids.update(index.find(key))
+
+        row_ids = sorted(row_ids)
+
+        sql_output_field_list = ",".join(output_field_list)
+
+        sql_output = []
+
+        for batch_start in range(0, len(row_ids), self.lookup_batch_size):
+            batch = row_ids[batch_start:batch_start + self.lookup_batch_size]
+
+            sql = "SELECT " + sql_output_field_list + \
+                  " FROM " + self.database_table_name + \
+                  " WHERE CircRNA_ID in ({seq})".format(
+                    seq=','.join(['?'] * len(batch))) + \
+                  " ORDER BY CircRNA_ID"
+
+            sql_output += self.run_sql_query(self, sql, batch)
 
         return sql_output
 
     def run_keyword_select_query(self, output_field_list,
-                                 keyword_sql):
+                                 keyword_sql, parameters=()):
 
         # build SQL string from sanitized(!) field names
         sql_output_field_list = ",".join(output_field_list)
@@ -394,14 +1696,156 @@ class Util(object):
               " FROM " + self.database_table_name + \
               " WHERE " + keyword_sql + " LIMIT 1000;"
 
-        sql_output = self.db_cursor.execute(sql).fetchall()
+        sql_output = self.run_sql_query(self, sql, parameters)
 
         return sql_output
 
+    def get_input_sql(self, input_field, query_data):
+
+        # WHERE clause matching a list of input IDs or coordinates of any
+        # length, the list is bound as one JSON array parameter
+        if input_field == "Coordinates":
+            return "Chr || ':' || Start || '|' || Stop IN " \
+                   "(SELECT value FROM json_each(?))", \
+                [json.dumps(self.prepare_coordinates(self, query_data))]
+
+        return input_field + " IN (SELECT value FROM json_each(?))", \
+            [json.dumps(query_data)]
+
+    # comparison operators of paged queries, values are bound as parameters
+    paged_query_operators = ["==", "!=", "<", "<=", ">", ">=", "LIKE",
+                             "NOT LIKE", "IS", "IS NOT"]
+
+    def run_paged_query(self, sql, parameters=(), filters=(), order_by=(),
+                        limit=100, offset=0):
+
+        # returns one window of the rows of a SELECT statement, filtered
+        # and sorted by SQLite; filters are (field, operator, value) and
+        # order_by (field, descending) tuples of sanitized(!) field names
+        # that are columns of the SELECT statement
+
+        sql_constraints = []
+        parameters = list(parameters)
+
+        for field, operator, value in filters:
+            if operator not in self.paged_query_operators:
+                raise ValueError("unsupported operator " + operator)
+
+            sql_constraints.append(field + " " + operator + " ?")
+            parameters.append(value)
+
+        sql = "SELECT * FROM (" + sql + ")"
+
+        if sql_constraints:
+            sql += " WHERE " + " AND ".join(sql_constraints)
+
+        # CircRNA_ID keeps the order of equal rows stable between windows
+        order_sql = [field + (" DESC" if descending else "")
+                     for field, descending in order_by] + ["CircRNA_ID"]
+
+        sql += " ORDER BY " + ", ".join(order_sql) + " LIMIT ? OFFSET ?"
+
+        return self.run_sql_query(self, sql, parameters + [limit, offset])
+
+    def run_export_query(self, output_field_list, constraints=None,
+                         complete=False, batch_size=None):
+
+        # yields all matching rows in batches of batch_size straight from
+        # a sequential scan, unlike keyword queries without row limit
+        # constraints are exact matches, complete drops rows with empty
+        # output fields
+
+        sql_constraints = []
+        parameters = []
+
+        for field, keyword in (constraints or {}).items():
+            sql_constraints.append(field + " == ?")
+            parameters.append(keyword)
+
+        if complete:
+            sql_constraints += [field + " IS NOT NULL"
+                                for field in output_field_list]
+
+        # build SQL string from sanitized(!) field names
+        sql = "SELECT " + ",".join(output_field_list) + \
+              " FROM " + self.database_table_name
+
+        if sql_constraints:
+            sql += " WHERE " + " AND ".join(sql_constraints)
+
+        return self.stream_sql_query(self, sql, parameters, batch_size)
+
+    def stream_sql_query(self, sql, parameters=(), batch_size=None):
+
+        # yields the rows of a query in batches of batch_size
+
+        self.ensure_database(self)
+
+        if not batch_size:
+            batch_size = self.stream_batch_size
+
+        # the query budget and profiling apply to the statement as a whole,
+        # the progress handler is only installed while rows are fetched
+        budget = self.get_query_budget(self)
+
+        rows = 0
+        error = None
+
+        # own cursor, other queries may run while the rows are consumed
+        cursor = self.db_connection.cursor()
+
+        try:
+            self.run_budgeted_query_step(
+                self, budget, lambda: cursor.execute(sql, parameters))
+
+            while True:
+                batch = self.run_budgeted_query_step(
+                    self, budget, lambda: cursor.fetchmany(batch_size))
+
+                if not batch:
+                    break
+
+                rows += len(batch)
+
+                yield batch
+
+        except QueryTooExpensiveError as budget_error:
+            error = str(budget_error)
+            raise
+
+        finally:
+            cursor.close()
+
+            if self.query_profile_logger:
+                self.log_query_profile(self, sql, parameters, rows,
+                                       budget['elapsed'], error=error)
+
+    def get_keyword_sql(self, constraints):
+
+        # builds the WHERE clause of a keyword query from a dictionary of
+        # sanitized(!) field names and keywords; *keyword matches partially
+        # keywords are bound as parameters, so all queries on the same
+        # fields share one SQL string and its cached prepared statement
+
+        sql_constraints = []
+        parameters = []
+
+        for field, keyword in constraints.items():
+            keyword = str(keyword)
+
+            if keyword.startswith("*"):
+                sql_constraints.append(field + " LIKE ?")
+                parameters.append("%" + keyword.replace("*", "", 1) + "%")
+            else:
+                sql_constraints.append(field + " == ?")
+                parameters.append(keyword)
+
+        return " AND ".join(sql_constraints), parameters
+
     def run_circrna_query(self, circrna_id):
 
         # build SQL string
-        sql_output = self.db_cursor.execute("SELECT "
+        sql_output = self.run_sql_query(self, "SELECT "
                                             "* " +
                                             " FROM " + self.database_table_name +
                                             " INNER JOIN " + self.database_table_name + "_log " +
@@ -427,19 +1871,19 @@ class Util(object):
                                                 circrna_id, circrna_id, circrna_id,
                                                 circrna_id, circrna_id, circrna_id,
                                                 circrna_id, circrna_id, circrna_id,
-                                                circrna_id, circrna_id, circrna_id, circrna_id)).fetchall()
+                                                circrna_id, circrna_id, circrna_id, circrna_id))
 
         return sql_output
 
     def get_circrna_history_by_id(self, circrna_id):
 
         # build SQL string
-        sql_output = self.db_cursor.execute("SELECT "
+        sql_output = self.run_sql_query(self, "SELECT "
                                             "* " +
                                             " FROM " + self.database_table_name + "_log " +
                                             " INNER JOIN " + self.database_table_name + "_db_info " +
                                             " ON " + self.database_table_name + "_db_info.DB_ID = " +
                                             self.database_table_name + "_log.DB_ID" +
-                                            " WHERE CircRNA_ID = ?", (circrna_id,)).fetchall()
+                                            " WHERE CircRNA_ID = ?", (circrna_id,))
 
         return sql_output
\ No newline at end of file
@@ -0,0 +1,200 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# streaming output writers for the CLI
+# writers receive the query results batch by batch via write_rows() and
+# never hold the complete result in memory
+# parquet output requires pyarrow, install via: pip install circhemy[parquet]
+
+import csv
+import json
+import sys
+
+from circhemy.common import compression
+from circhemy.common.util import Util
+
+output_formats = ["tsv", "csv", "jsonl", "parquet"]
+
+# integer columns written as int64 to parquet; Entrez and Pubmed are
+# identifiers SQLite does not enforce a type for and are written as strings
+parquet_integer_columns = [field for field in Util.db_integer_columns
+                           if field not in ["Entrez", "Pubmed"]]
+
+
+def get_unique_field_indexes(fields):
+
+    # positions of the first column of every field name, repeated columns,
+    # e.g. an output field that is also a query constraint, are dropped by
+    # the formats keyed by field name
+    indexes = {}
+
+    for index, field in enumerate(fields):
+        indexes.setdefault(field, index)
+
+    return list(indexes.values())
+
+
+def get_integer(value):
+
+    # integers as stored by SQLite or parsed from text, anything else is
+    # written as null instead of aborting the whole output
+    if value is None or isinstance(value, int):
+        return value
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def open_output(path, binary=False):
+
+    # STDOUT or a file, text writers get a text stream
+    if path == "STDOUT":
+        return sys.stdout.buffer if binary else sys.stdout
+
+    return compression.open_output(path, binary)
+
+
+class TextWriter(object):
+
+    # separator-joined output without header, like process_sql_output
+
+    def __init__(self, path, fields, separator="\t", empty_char="NA"):
+        self.output = open_output(path)
+        self.separator = separator
+        self.empty_char = empty_char
+
+    def write_rows(self, rows):
+        self.output.write(Util.process_sql_output(rows,
+                                                  seperator=self.separator,
+                                                  empty_char=self.empty_char))
+        self.output.flush()
+
+    def close(self):
+        if self.output is not sys.stdout:
+            self.output.close()
+
+
+class CsvWriter(TextWriter):
+
+    # RFC 4180 CSV with a header line, separators inside fields are quoted
+
+    def __init__(self, path, fields, separator=",", empty_char="NA"):
+        super().__init__(path, fields, separator, empty_char)
+
+        self.writer = csv.writer(self.output, delimiter=self.separator,
+                                 lineterminator="\n")
+        self.writer.writerow(fields)
+
+    def write_rows(self, rows):
+        self.writer.writerows([[self.empty_char if value is None else value
+                                for value in row] for row in rows])
+        self.output.flush()
+
+
+class JsonLinesWriter(TextWriter):
+
+    # one JSON object per row, empty fields are null
+
+    def __init__(self, path, fields, separator=None, empty_char=None):
+        super().__init__(path, fields)
+        self.indexes = get_unique_field_indexes(fields)
+        self.fields = [fields[index] for index in self.indexes]
+
+    def write_rows(self, rows):
+        self.output.write("".join([json.dumps(dict(zip(
+            self.fields, [row[index] for index in self.indexes]))) + "\n"
+            for row in rows]))
+        self.output.flush()
+
+
+class ParquetWriter(object):
+
+    # rows are buffered and written as one row group per
+    # Util.parquet_row_group_size rows
+
+    def __init__(self, path, fields, separator=None, empty_char=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+
+        self.indexes = get_unique_field_indexes(fields)
+
+        # all columns are nullable
+        self.schema = pa.schema([
+            (fields[index], pa.int64()
+             if fields[index] in parquet_integer_columns else pa.string())
+            for index in self.indexes])
+
+        self.output = open_output(path, binary=True)
+        self.writer = pq.ParquetWriter(self.output, self.schema)
+        self.rows = []
+
+    def write_row_group(self):
+        columns = list(zip(*self.rows)) if self.rows else \
+            [[] for field in self.schema.names]
+
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(column, type=field.type) for column, field in
+             zip(columns, self.schema)], schema=self.schema))
+
+        self.rows = []
+
+    def write_rows(self, rows):
+        for row in rows:
+            values = [row[index] for index in self.indexes]
+
+            self.rows.append([get_integer(value)
+                              if field.type == self.pa.int64()
+                              else None if value is None else str(value)
+                              for value, field in zip(values, self.schema)])
+
+            if len(self.rows) == Util.parquet_row_group_size:
+                self.write_row_group()
+
+    def close(self):
+        if self.rows:
+            self.write_row_group()
+
+        self.writer.close()
+
+        if self.output is not sys.stdout.buffer:
+            self.output.close()
+
+
+def get_writer(output_format, path, fields, separator="\t", empty_char="NA"):
+
+    if output_format == "parquet":
+        try:
+            return ParquetWriter(path, fields)
+        except ImportError:
+            print("Parquet output requires pyarrow, "
+                  "install via: pip install circhemy[parquet]")
+            exit(-1)
+
+    writer = {"tsv": TextWriter,
+              "csv": CsvWriter,
+              "jsonl": JsonLinesWriter}[output_format]
+
+    # csv output defaults to commas unless a separator was given
+    if output_format == "csv" and separator == "\t":
+        separator = ","
+
+    return writer(path, fields, separator, empty_char)
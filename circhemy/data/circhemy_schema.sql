@@ -25,6 +25,20 @@ CREATE TABLE IF NOT EXISTS `circhemy` (
 	`Genome` TEXT NOT NULL,
 	`Pubmed` INTEGER
 );
+CREATE INDEX IF NOT EXISTS `circhemy_coordinates` ON `circhemy` (`Chr`, `Start`, `Stop`);
+CREATE INDEX IF NOT EXISTS `circhemy_CSNv1` ON `circhemy` (`CSNv1`);
+CREATE INDEX IF NOT EXISTS `circhemy_Gene` ON `circhemy` (`Gene`);
+CREATE INDEX IF NOT EXISTS `circhemy_ENSEMBL` ON `circhemy` (`ENSEMBL`);
+CREATE INDEX IF NOT EXISTS `circhemy_Entrez` ON `circhemy` (`Entrez`);
+CREATE INDEX IF NOT EXISTS `circhemy_circBase` ON `circhemy` (`circBase`);
+CREATE INDEX IF NOT EXISTS `circhemy_CircAtlas2` ON `circhemy` (`CircAtlas2`);
+CREATE INDEX IF NOT EXISTS `circhemy_circRNADb` ON `circhemy` (`circRNADb`);
+CREATE INDEX IF NOT EXISTS `circhemy_circBank` ON `circhemy` (`circBank`);
+CREATE INDEX IF NOT EXISTS `circhemy_deepBase2` ON `circhemy` (`deepBase2`);
+CREATE INDEX IF NOT EXISTS `circhemy_Circpedia2` ON `circhemy` (`Circpedia2`);
+CREATE INDEX IF NOT EXISTS `circhemy_riboCIRC` ON `circhemy` (`riboCIRC`);
+CREATE INDEX IF NOT EXISTS `circhemy_exoRBase2` ON `circhemy` (`exoRBase2`);
+CREATE INDEX IF NOT EXISTS `circhemy_Arraystar` ON `circhemy` (`Arraystar`);
 CREATE TABLE IF NOT EXISTS `circhemy_db_info` (
     `DB_ID` INTEGER PRIMARY KEY,
 	`Version` TEXT NOT NULL UNIQUE,
@@ -35,4 +49,13 @@ CREATE TABLE IF NOT EXISTS `circhemy_log` (
     `Action` INTEGER,
     `DB_ID`	INTEGER
 );
+CREATE TABLE IF NOT EXISTS `circhemy_liftover` (
+    `From_Genome` TEXT NOT NULL,
+    `Chr` TEXT NOT NULL,
+    `Start` INTEGER NOT NULL,
+    `Stop` INTEGER NOT NULL,
+    `To_Genome` TEXT NOT NULL,
+    `CircRNA_ID` INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS `circhemy_liftover_coordinates` ON `circhemy_liftover` (`From_Genome`, `To_Genome`, `Chr`, `Start`, `Stop`);
 COMMIT;
@@ -28,7 +28,15 @@ from pygments.formatters import HtmlFormatter
 
 # regex for circRNA parsing
 import re
+import asyncio
+import itertools
+import json
 import os
+import secrets
+import sqlite3
+import sys
+import time
+import zlib
 
 # own util functions
 import circhemy.common.util as common
@@ -37,21 +45,23 @@ from datetime import datetime
 
 # core nicegui and web imports
 from fastapi import Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from nicegui import Client, app, ui
 from . import svg
 
-# imports for parsing the Redmine news feed
-import feedparser
-from dateutil import tz
-
-from dateutil.parser import parse
-
+# imports for parsing the Redmine news feed, feedparser and dateutil are
+# imported by the news page itself
 from io import StringIO
 from html.parser import HTMLParser
 
 # create util instance for the web app
 util = common.Util
 
+# make sure pathological queries cannot starve interactive users,
+# the budget can be changed via CIRCHEMY_QUERY_TIMEOUT
+if not util.query_time_limit:
+    util.set_query_budget(util, 10, util.query_step_limit)
+
 # add static files for fonts and favicon
 app.add_static_files('/favicon', Path(__file__).parent / 'favicon')
 app.add_static_files('/fonts', Path(__file__).parent / 'fonts')
@@ -60,24 +70,82 @@ app.add_static_files('/sitemap', 'web/sitemap/')
 
 # set up global variables
 
-# holds most variables for the convert form submission
-ui_convert_form_values = dict()
+# form elements belong to the page of one client, submitted forms are kept
+# per browser session so that concurrent users never share form state
+# browser id -> {'time': last page load, 'request': submitted form}
+ui_sessions = dict()
+
+# sessions without page load for this many seconds are removed
+ui_session_ttl = int(os.environ.get("CIRCHEMY_SESSION_TTL", 3600))
+
+# expired sessions and results are removed every this many seconds
+ui_session_cleanup_interval = 60
+
+# results of submitted forms, the result grid requests them page by page
+# result id -> {'time': last request, 'fields', 'sql', 'parameters',
+#               'header', 'separator', 'empty_char'}
+ui_results = dict()
+
+# rows per request of the result grid
+ui_result_page_size = 100
+
+# rows of a result at most, the grid, its sorting and filtering and the
+# download work on this many rows, in addition to the query budget
+ui_result_max_rows = 100000
+
+
+def clean_ui_sessions():
+    # removes sessions and results that were not used for ui_session_ttl
+
+    now = time.time()
+
+    for session_id in [session_id for session_id, session in
+                       ui_sessions.items()
+                       if now - session['time'] > ui_session_ttl]:
+        del ui_sessions[session_id]
+
+    for result_id in [result_id for result_id, result in ui_results.items()
+                      if now - result['time'] > ui_session_ttl]:
+        del ui_results[result_id]
+
+
+async def run_ui_session_cleanup():
+    # runs for the lifetime of the server, also without page loads
+
+    while True:
+        await asyncio.sleep(ui_session_cleanup_interval)
+        clean_ui_sessions()
+
+
+# setup SQLite connection once the server starts, not at import time;
+# statistics for the righthand side charts are cached on first page load
+app.on_startup(lambda: util.ensure_database(util))
+app.on_startup(run_ui_session_cleanup)
+
 
-# holds variables for query-based constraints that are added dynamically
-ui_query_forms = list()
+def get_storage_secret() -> str:
+    # signs the browser session cookies, it has to survive restarts and
+    # instances behind a load balancer have to share it
 
-# setup SQLite connection
-util.setup_database(util, util.database_location)
+    secret = os.environ.get("CIRCHEMY_STORAGE_SECRET") or \
+        common.get_config_value("storage_secret")
 
-# initialize statistics chart on the righthand side
-ui_convert_form_values['chart'], ui_convert_form_values['dbsize'], \
-    ui_convert_form_values['chart2'] = util.database_stats(util)
+    if not secret:
+        print("WARNING: no storage secret configured, set "
+              "CIRCHEMY_STORAGE_SECRET or storage_secret in circhemy.cfg. "
+              "Using a random secret, browser sessions end with this "
+              "process and are not shared between instances.",
+              file=sys.stderr)
+        secret = secrets.token_hex(32)
+
+    return secret
 
 
 def main():
     # run main application
     ui.run(title=util.program_name_long + " - Release " + util.database_version,
            show=False,
+           storage_secret=get_storage_secret(),
            # favicon="https://circhemy.jakobilab.org/favicon/favicon.ico",
            binding_refresh_interval=0.1
            )
@@ -112,37 +180,47 @@ def check_circrna_input_regex(strg, search=re.compile(
     return not bool(search(strg))
 
 
-def check_text_field_input(upload_data) -> str:
+def get_ui_session() -> dict:
+    # state of the browser of the current page request, expired sessions
+    # are removed by run_ui_session_cleanup()
+
+    session = ui_sessions.setdefault(app.storage.browser['id'], dict())
+    session['time'] = time.time()
+
+    return session
+
+
+def check_text_field_input(form_values, upload_data) -> str:
     if not upload_data:
-        circ_list = str(ui_convert_form_values['textfield'].value)
+        circ_list = str(form_values['textfield'].value)
     else:
         circ_list = upload_data
 
     list_okay = check_circrna_input_regex(circ_list)
 
-    db_selected = check_if_db_is_selected(ui_convert_form_values)
-    ui_convert_form_values['circrna_found'].set_visibility(False)
+    db_selected = check_if_db_is_selected(form_values)
+    form_values['circrna_found'].set_visibility(False)
 
     if circ_list and list_okay and db_selected:
-        ui_convert_form_values['submit_button'].props(remove="disabled=true")
-        ui_convert_form_values['submit_notification'].set_text(
-            ui_update_found_circrnas(circ_list))
+        form_values['submit_button'].props(remove="disabled=true")
+        form_values['submit_notification'].set_text(
+            ui_update_found_circrnas(form_values, circ_list))
 
         return "Submit " + str(
             circ_list.count('\n')) + " circRNAs for ID conversion"
 
     elif not circ_list:
-        ui_convert_form_values['submit_button'].props("disabled=true")
+        form_values['submit_button'].props("disabled=true")
         return "Convert circRNA IDs"
 
     elif not list_okay:
-        ui_convert_form_values['submit_button'].props("disabled=true")
-        ui_convert_form_values['submit_notification']. \
+        form_values['submit_button'].props("disabled=true")
+        form_values['submit_notification']. \
             set_text("Allowed characters: A-Z,\\n,\\t,|,:,-,_ ")
         return "Unsupported characters detected in your circRNA list"
 
     elif not db_selected:
-        ui_convert_form_values['submit_button'].props("disabled=true")
+        form_values['submit_button'].props("disabled=true")
 
         return "No Input database selected"
 
@@ -159,12 +237,12 @@ def check_if_db_is_selected(form_values) -> List[Any]:
     return checklist
 
 
-def check_query_text_field() -> None:
+def check_query_text_field(form_values, query_forms) -> None:
 
-    if 'submit_query_button' in ui_convert_form_values:
+    if 'submit_query_button' in form_values:
         all_good = True
 
-        for form in ui_query_forms:
+        for form in query_forms:
 
             if not form['query'].value:
                 all_good = False
@@ -172,12 +250,12 @@ def check_query_text_field() -> None:
                 all_good = True
 
         if all_good:
-            ui_convert_form_values['submit_query_button'].props(
+            form_values['submit_query_button'].props(
                 remove="disabled=true")
         else:
-            ui_convert_form_values['submit_query_button'].props("disabled=true")
+            form_values['submit_query_button'].props("disabled=true")
 
-        ui_convert_form_values['submit_query_button'].update()
+        form_values['submit_query_button'].update()
 
 
 def add_if_not_in_list(input_list=None, item_list=None):
@@ -269,23 +347,8 @@ def ui_generate_external_link(external_site: str, values: dict):
     return returnval
 
 
-def ui_result_table_get_coordinates(input_list=None):
-    if input_list is None:
-        input_list = []
-    return_dict = {"Chr": "", "Start": "", "Stop": "", "Genome": ""}
-
-    for item in return_dict:
-        index = 0
-        for field in input_list:
-            if field == item:
-                return_dict[item] = index
-            index = index + 1
-
-    return return_dict
-
-
-def ui_load_example_data() -> None:
-    ui_convert_form_values['textfield'].value = \
+def ui_load_example_data(form_values) -> None:
+    form_values['textfield'].value = \
         "chr1:100121447|100132793\n" \
         "chr1:100121550|100122379\n" \
         "chr1:100122380|100125942\n" \
@@ -310,7 +373,66 @@ def ui_load_example_data() -> None:
     # "hsa-MYH9_0116"
 
 
-def ui_generate_result_table(input_id=None, output_ids=None, query_data=None):
+def ui_result_table_render_row(line, full_list) -> dict:
+    # one result row as AG Grid row dictionary of raw values, links are
+    # rendered by the browser from ui_get_link_templates()
+
+    return {field: "" if value == "NA" else value
+            for value, field in zip(line, full_list)}
+
+
+def ui_get_link_templates() -> dict:
+    # column -> URL template for the cell renderer of the result grid,
+    # {field} placeholders are filled from the fields of the same row
+
+    # build pos format: chrXZY:1234-5789
+    genome_browser = util.external_db_urls["Genome-Browser"] + \
+        "db={Genome}&pos={Chr}:{Start}-{Stop}"
+
+    templates = {field: {'url': url + "{" + field + "}"}
+                 for field, url in util.external_db_urls.items() if url}
+
+    # special case for genome browser links
+    # not handled by normal external DB URL dict
+    for field in ["Chr", "Start", "Stop"]:
+        templates[field] = {'url': genome_browser}
+
+    # only if we use the new genome builds we re-use the genome browser
+    # integration but add the custom BED files
+    templates["CSNv1"] = {'url': genome_browser + "&hgct_customText=" +
+                          util.external_db_urls["CSNv1"] + "{Genome}.bed",
+                          'genomes': ["hg38", "mm10", "rn6"]}
+
+    templates["CircRNA_ID"]['label'] = "Circhemy profile"
+
+    return templates
+
+
+# AG Grid cell renderer turning raw values into links of the template map
+# in the grid context, values are set as text and never parsed as HTML
+ui_grid_link_renderer = """(params) => {
+    const link = params.context.links[params.colDef.field];
+    if (params.value === null || params.value === undefined
+            || params.value === '') return '';
+    if (!link || (link.genomes
+            && !link.genomes.includes(params.data.Genome))) {
+        return String(params.value);
+    }
+    const element = document.createElement('a');
+    element.href = link.url.replace(/{([^}]+)}/g,
+                                    (match, field) => params.data[field]);
+    element.target = '_blank';
+    element.style.textDecoration = 'underline';
+    element.textContent = link.label || params.value;
+    return element;
+}"""
+
+
+def ui_generate_result_table(input_id=None, output_ids=None, query_data=None,
+                             tolerance=0):
+    # results of the REST API, the web application pages through its
+    # results via ui_get_result_source() instead
+
     # initialize empty to allow for empty results
     output = ""
 
@@ -322,12 +444,20 @@ def ui_generate_result_table(input_id=None, output_ids=None, query_data=None):
 
         output_fields = output_ids
 
+        # base pair tolerance only applies to coordinate input
+        if input_id != "Coordinates":
+            tolerance = 0
+
         output = util.run_simple_select_query(util,
                                               output_ids,
                                               circrna_list,
-                                              input_id
+                                              input_id,
+                                              tolerance=tolerance
                                               )
 
+        if tolerance:
+            output_fields = output_ids + util.coordinate_offset_columns
+
     # REST API query gets input_id from type list
     # in this case the list holds the constraints for SQL query
     # construction
@@ -335,302 +465,318 @@ def ui_generate_result_table(input_id=None, output_ids=None, query_data=None):
 
         output_fields = output_ids
 
-        sql_query = ""
-
-        constraint_id = 0
+        conditions = []
 
         for constraint in input_id:
+            condition = {'field': constraint.field,
+                         'operator2': constraint.operator2,
+                         'query': constraint.query}
 
-            if constraint_id > 0:
-                sql_query += " " + constraint.operator1 + " "
-
-            if constraint.operator2 == "LIKE":
-                tmp = constraint.query.replace("*", "", 1)
-                sql_query += constraint.field + " LIKE \"%" \
-                             + tmp + "%\" "
-            elif constraint.operator2 == "is":
-                sql_query += constraint.field + " == \"" \
-                             + constraint.query + "\" "
-            elif constraint.operator2 == ">":
-                sql_query += constraint.field + " > \"" \
-                             + constraint.query + "\" "
-            elif constraint.operator2 == "<":
-                sql_query += constraint.field + " < \"" \
-                             + constraint.query + "\" "
-
-            constraint_id = constraint_id + 1
-        output = util.run_keyword_select_query(util,
-                                               output_fields,
-                                               sql_query)
+            # the first condition has no operator1, like in the query form
+            if conditions:
+                condition['operator1'] = constraint.operator1
 
-    # function called from web convert module
-    elif ui_convert_form_values['mode'] is "convert":
+            conditions.append(condition)
 
-        output_fields = check_if_db_is_selected(ui_convert_form_values)
-
-        # we always need these fields for genome browser links
-        output_fields = add_if_not_in_list(output_fields, [
-                                                            "CircRNA_ID",
-                                                            "Chr",
-                                                           "Start",
-                                                           "Stop",
-                                                           "Genome"
-                                                           ])
-
-        if "uploaded_data" in ui_convert_form_values:
-            circrna_list = ui_convert_form_values['uploaded_data'].split('\n')
-        else:
-            circrna_list = ui_convert_form_values['textfield'].value.split('\n')
-
-        output = util.run_simple_select_query(util,
-                                              output_fields,
-                                              circrna_list,
-                                              ui_convert_form_values[
-                                                  'db_checkbox'].value
-                                              )
-
-        if ui_convert_form_values['db_checkbox'].value not in output_fields \
-                and ui_convert_form_values[
-            'db_checkbox'].value != "Coordinates":
-            output_fields.insert(0, ui_convert_form_values['db_checkbox'].value)
-
-    # function called from web query module
-    elif ui_convert_form_values['mode'] is "query":
-
-        output_fields = check_if_db_is_selected(ui_convert_form_values)
-
-        # we always need these fields for genome browser links
-        output_fields = add_if_not_in_list(output_fields, [
-                                                            "CircRNA_ID",
-                                                            "Chr",
-                                                           "Start",
-                                                           "Stop",
-                                                           "Genome"
-                                                           ])
-
-        sql_query = ""
-
-        for form in ui_query_forms:
-
-            if 'operator1' in form:
-                # this is an addon condition with two operators
-                sql_query += " " + form['operator1'].value + " "
-
-            if form['operator2'].value is "LIKE":
-                tmp = form['query'].value.replace("*", "", 1)
-                sql_query += form['field'].value + " LIKE \"%" \
-                             + tmp + "%\" "
-            elif form['operator2'].value is "is":
-                sql_query += form['field'].value + " == \"" \
-                             + form['query'].value + "\" "
-            elif form['operator2'].value is ">":
-                sql_query += form['field'].value + " > \"" \
-                             + form['query'].value + "\" "
-            elif form['operator2'].value is "<":
-                sql_query += form['field'].value + " < \"" \
-                             + form['query'].value + "\" "
-
-        ui_query_forms.clear()
+        sql_query, parameters = ui_get_query_sql(conditions)
 
         output = util.run_keyword_select_query(util,
                                                output_fields,
-                                               sql_query)
+                                               sql_query,
+                                               parameters)
 
     full_list = list(output_fields)
 
     processed_output = ""
 
-    # only add AG Grid structures if we are calling from web
-    if not input_id:
-
-        table_base_dict = {'defaultColDef': {
-            'filter': True,
-            'sortable': True,
-            'resizable': True,
-            'cellStyle': {'textAlign': 'left'},
-            'headerClass': 'font-bold',
-            ':onGridReady': '(params) => params.columnApi.autoSizeAllColumns()'
-        },
-
-            'columnDefs': [],
-            'rowData': []
-        }
     # REST API call, just return a more simple JSON-compatible table
-    else:
-        table_base_dict = {'columnDefs': [],
-                           'rowData': []
-                           }
+    table_base_dict = {'columnDefs': [],
+                       'rowData': []
+                       }
 
     for item in full_list:
         table_base_dict['columnDefs'].append(
             {'headerName': item, 'field': item})
 
-        # make sure we only call this if called from web,
-        # otherwise this field is not initialized
-        if not input_id and ui_convert_form_values['mode'] is "convert":
-            processed_output = processed_output + item \
-                               + ui_convert_form_values['select2'].value
-
     # did we actually have SQL rows returned?
     if output:
 
-        # holds index of coordinates + genome build in field list
-        idx = ui_result_table_get_coordinates(full_list)
-
         for line in output:
-
-            tmp_dict = dict()
-
-            zipped = zip(line, full_list)
-
-            # continue with integration of genome browser urls
-            # we have fixed genome and potentially coordinates
-            # we just have to tie all together in the special case of those
-            # fields and manually get item information from the list
-            # we probably have to add a counter to get to the correct position
-
-            for item in zipped:
-
-                if item[0] == "NA":
-                    tmp_dict[item[1]] = ""
-
-                # special case for genome browser links
-                # not handled by normal external DB URL dict
-                # since we need to build the link component first
-                elif item[1] in ["Chr", "Start", "Stop"] and not input_id:
-
-                    # build pos format: chrXZY:1234-5789
-                    pos = line[idx['Chr']] + ":" + \
-                          str(line[idx['Start']]) + \
-                          "-" + \
-                          str(line[idx['Stop']])
-
-                    build = line[idx['Genome']]
-
-                    tmp_dict[item[1]] = "<a style=\"text-decoration: underline;" \
-                                        "\" href=\"" + util.external_db_urls[
-                                            "Genome-Browser"] \
-                                        + "db=" + build + "&" \
-                                        + "pos=" + pos + "\"" \
-                                        + " target=\"_blank\">" \
-                                        + str(item[0]) + "</a>"
-
-                elif item[1] == "CSNv1" and not input_id \
-                        and line[idx['Genome']] in ["hg38", "mm10", "rn6"]:
-                    # only if we use the new genome builds
-                    # we re-use the genome browser integration but add the
-                    # custom BED files
-
-                    # build pos format: chrXZY:1234-5789
-                    pos = line[idx['Chr']] + ":" + \
-                          str(line[idx['Start']]) + \
-                          "-" + \
-                          str(line[idx['Stop']])
-
-                    build = line[idx['Genome']]
-
-                    tmp_dict[item[1]] = "<a style=\"text-decoration: underline;" \
-                                        "\" href=\"" + util.external_db_urls[
-                                            "Genome-Browser"] \
-                                        + "db=" + build + "&" \
-                                        + "pos=" + pos \
-                                        + "&hgct_customText=" + \
-                                        util.external_db_urls["CSNv1"] \
-                                        + build + ".bed\"" \
-                                        + " target=\"_blank\">" \
-                                        + str(item[0]) + "</a>"
-
-                elif item[1] == "CircRNA_ID" and not input_id:
-
-                    tmp_dict[item[1]] = "<a style=\"text-decoration: underline;" \
-                                "\" href=\"" + util.external_db_urls["CircRNA_ID"] \
-                                + str(item[0]) + "\" target=\"_blank\">" \
-                                + "Circhemy profile" + "</a>"
-
-                elif item[0] is not None \
-                        and util.external_db_urls[item[1]] \
-                        and not input_id:
-                    tmp_dict[item[1]] = "<a style=\"text-decoration: underline;" \
-                                        "\" href=\"" + util.external_db_urls[
-                                            item[1]] \
-                                        + str(item[0]) + "\" target=\"_blank\">" \
-                                        + str(item[0]) + "</a>"
-                else:
-                    tmp_dict[item[1]] = item[0]
-
-            table_base_dict['rowData'].append(tmp_dict)
-
-        # remove last sep character
-        processed_output = processed_output[:-1]
+            table_base_dict['rowData'].append(
+                ui_result_table_render_row(line, full_list))
 
         # add new line for correct line break
         processed_output = processed_output + "\n"
 
-        # form_values['table2'].style("height: 900px")
-
-    # only set up web table if we are calling from web
-    if not input_id:
-
-        table = ui.aggrid(table_base_dict,
-                          html_columns=list(range(len(full_list))))
-
-        # table.style("width: 90%")
-        # table.style("height: 90%")
-        # table.style(add="text-align:center; "
-        #             "margin-left:auto; "
-        #             "margin-right:auto; ")
-        table.style(add='height: calc(100vh - 220px)')
-        table.props("domLayout='autoHeight'")
-        table.on('firstDataRendered',
-                 lambda: table.run_column_method('autoSizeAllColumns'))
-        table.classes("ag-theme-balham")
-        table.update()
-
-        if ui_convert_form_values['mode'] is "convert":
-
-            processed_output = processed_output \
-                               + util.process_sql_output(output,
-                                                         seperator=
-                                                         ui_convert_form_values[
-                                                             'select2'].value,
-                                                         empty_char=
-                                                         ui_convert_form_values[
-                                                             'select3'].value)
+    # return is the output and a simple table dictionary
+    return processed_output, table_base_dict
+
+
+def ui_get_query_sql(conditions):
+    # WHERE clause of the web query form, the search terms are bound as
+    # parameters
+
+    operators = {"is": "==", "LIKE": "LIKE", ">": ">", "<": "<"}
+
+    sql_query = ""
+    parameters = []
+
+    for form in conditions:
+
+        if form['field'] not in util.db_columns \
+                or form['operator2'] not in operators:
+            raise ValueError("unsupported query condition")
+
+        if 'operator1' in form:
+            # this is an addon condition with two operators
+            if form['operator1'] not in ["AND", "OR", "AND NOT"]:
+                raise ValueError("unsupported query condition")
+
+            sql_query += " " + form['operator1'] + " "
+
+        value = form['query']
+
+        if not isinstance(value, str):
+            raise ValueError("no query provided")
+
+        if form['operator2'] == "LIKE":
+            value = "%" + value.replace("*", "", 1) + "%"
+
+        sql_query += form['field'] + " " + operators[form['operator2']] \
+            + " ? "
+        parameters.append(value)
+
+    return sql_query, parameters
+
+
+def ui_get_result_source(form_request) -> dict:
+    # SELECT statement of the complete result of a submitted form, the
+    # result grid fetches one window of rows at a time from it
+
+    output_fields = list(form_request['output_fields'])
+
+    # we always need these fields for genome browser links
+    output_fields = add_if_not_in_list(output_fields, ["CircRNA_ID",
+                                                       "Chr",
+                                                       "Start",
+                                                       "Stop",
+                                                       "Genome"])
+
+    table_name = util.database_table_name
+
+    if form_request['mode'] == "convert":
+
+        input_field = form_request['input_field']
+
+        if input_field not in output_fields and input_field != "Coordinates":
+            output_fields.insert(0, input_field)
+
+        if form_request['tolerance']:
+            # the nearest circRNAs are resolved once, the result rows are
+            # joined to them together with their offsets
+            hits = util.run_simple_select_query(
+                util, ["CircRNA_ID"], form_request['circrna_list'],
+                input_field, tolerance=form_request['tolerance'])
+
+            sql = "SELECT " + ", ".join(
+                [table_name + "." + field for field in output_fields]) + \
+                ", json_extract(Hit.value, '$[1]') AS Start_offset" \
+                ", json_extract(Hit.value, '$[2]') AS Stop_offset" \
+                " FROM " + table_name + " INNER JOIN json_each(?) AS Hit" \
+                " ON " + table_name + ".CircRNA_ID = " \
+                "json_extract(Hit.value, '$[0]')"
+
+            parameters = [json.dumps(hits)]
+
+            output_fields = output_fields + util.coordinate_offset_columns
+
         else:
-            processed_output = processed_output \
-                               + util.process_sql_output(output)
+            where_sql, parameters = util.get_input_sql(
+                util, input_field, form_request['circrna_list'])
+
+            sql = "SELECT " + ", ".join(output_fields) + " FROM " + \
+                  table_name + " WHERE " + where_sql
 
-        # web return is the output and the nicegui table object
-        return processed_output, table
     else:
-        # return is the output and a simple table dictionary
-        return processed_output, table_base_dict
+        where_sql, parameters = ui_get_query_sql(form_request['conditions'])
 
+        sql = "SELECT " + ", ".join(output_fields) + " FROM " + \
+              table_name + " WHERE " + where_sql
+
+    sql += " LIMIT ?"
+    parameters = list(parameters) + [ui_result_max_rows]
+
+    return {'fields': output_fields, 'sql': sql, 'parameters': parameters}
+
+
+# AG Grid filter types -> SQL operator and value pattern
+ui_grid_filter_operators = {"equals": ("==", "{}"),
+                            "notEqual": ("!=", "{}"),
+                            "contains": ("LIKE", "%{}%"),
+                            "notContains": ("NOT LIKE", "%{}%"),
+                            "startsWith": ("LIKE", "{}%"),
+                            "endsWith": ("LIKE", "%{}"),
+                            "lessThan": ("<", "{}"),
+                            "lessThanOrEqual": ("<=", "{}"),
+                            "greaterThan": (">", "{}"),
+                            "greaterThanOrEqual": (">=", "{}"),
+                            "blank": ("IS", None),
+                            "notBlank": ("IS NOT", None)}
+
+ui_grid_text_filters = ["contains", "notContains", "equals", "notEqual",
+                        "startsWith", "endsWith", "blank", "notBlank"]
+
+ui_grid_number_filters = ["equals", "notEqual", "lessThan",
+                          "lessThanOrEqual", "greaterThan",
+                          "greaterThanOrEqual", "inRange", "blank",
+                          "notBlank"]
+
+
+def ui_get_grid_filters(filter_model, fields):
+    # AG Grid filter model -> (field, operator, value) of run_paged_query()
+
+    filters = []
+
+    for field, model in filter_model.items():
+
+        if field not in fields:
+            continue
+
+        filter_type = model.get('type')
+
+        if filter_type == "inRange":
+            filters.append((field, ">=", model.get('filter')))
+            filters.append((field, "<=", model.get('filterTo')))
+
+        elif filter_type in ui_grid_filter_operators:
+            operator, pattern = ui_grid_filter_operators[filter_type]
+
+            value = model.get('filter')
+
+            # blank filters compare against NULL, only text filters get
+            # the LIKE wildcards
+            if pattern is None:
+                value = None
+            elif model.get('filterType') == "text":
+                value = pattern.format(value)
+
+            filters.append((field, operator, value))
+
+    return filters
+
+
+def ui_generate_result_grid(result_id, fields):
+    # AG Grid with infinite row model, the browser only holds the visible
+    # windows of the result and requests them from /api/results
+
+    column_defs = []
+
+    for field in fields:
+        numeric = field in util.db_integer_columns \
+                  or field in util.coordinate_offset_columns
+
+        column_defs.append({'headerName': field,
+                            'field': field,
+                            'filter': 'agNumberColumnFilter' if numeric
+                            else 'agTextColumnFilter',
+                            'filterParams': {
+                                'maxNumConditions': 1,
+                                'filterOptions': ui_grid_number_filters
+                                if numeric else ui_grid_text_filters}})
+
+    table = ui.aggrid({'defaultColDef': {
+        'sortable': True,
+        'resizable': True,
+        'cellStyle': {'textAlign': 'left'},
+        'headerClass': 'font-bold',
+        ':cellRenderer': ui_grid_link_renderer
+    },
+        'columnDefs': column_defs,
+        'context': {'links': ui_get_link_templates()},
+        'rowModelType': 'infinite',
+        'cacheBlockSize': ui_result_page_size,
+        'maxBlocksInCache': 10,
+        ':datasource': "{getRows: (params) => fetch('/api/results/"
+                       + result_id + "', {"
+                       "method: 'POST', "
+                       "headers: {'Content-Type': 'application/json'}, "
+                       "body: JSON.stringify({"
+                       "startRow: params.startRow, "
+                       "endRow: params.endRow, "
+                       "sortModel: params.sortModel, "
+                       "filterModel: params.filterModel})})"
+                       ".then((response) => response.json())"
+                       ".then((data) => data.rows "
+                       "? params.successCallback(data.rows, data.lastRow) "
+                       ": params.failCallback())"
+                       ".catch(() => params.failCallback())}"
+    })
+
+    table.style(add='height: calc(100vh - 220px)')
+    table.on('firstDataRendered',
+             lambda: table.run_column_method('autoSizeAllColumns'))
+    table.classes("ag-theme-balham")
+    table.update()
+
+    return table
 
-def ui_update_found_circrnas(data) -> str:
+
+async def ui_stream_result_download(result, batches, compress=True):
+    # complete result as gzip compressed CSV/TSV chunks, rows are fetched
+    # batch by batch and never held in memory as a whole
+
+    # wbits 31 writes the gzip container
+    compressor = zlib.compressobj(wbits=31)
+
+    def encode(text):
+        return compressor.compress(text.encode()) if compress \
+            else text.encode()
+
+    if result['header']:
+        yield encode(result['separator'].join(result['fields']) + "\n")
+
+    # the batches run on the event loop thread of the database connection
+    # errors after the first batch propagate to the server, it aborts the
+    # chunked transfer without its final chunk and gzip trailer, so clients
+    # report a failed download instead of saving an incomplete file
+    for batch in batches:
+        yield encode(util.process_sql_output(
+            batch,
+            seperator=result['separator'],
+            empty_char=result['empty_char']))
+
+    if compress:
+        yield compressor.flush()
+
+
+def ui_update_found_circrnas(form_values, data) -> str:
     circrna_list = data.split('\n')
     circrna_list = list(filter(None, circrna_list))
 
-    ratio, found = util.check_input_return_found_circ_number(util, input_field=
-    ui_convert_form_values['db_checkbox'].value, query_data=circrna_list)
+    try:
+        ratio, found = util.check_input_return_found_circ_number(util, input_field=
+        form_values['db_checkbox'].value, query_data=circrna_list)
+    except common.QueryTooExpensiveError as error:
+        form_values['submit_button'].props("disabled=true")
+        return str(error)
 
     if found > 0:
-        ui_convert_form_values['circrna_found'].value = ratio
-        ui_convert_form_values['circrna_found'].set_visibility(True)
+        form_values['circrna_found'].value = ratio
+        form_values['circrna_found'].set_visibility(True)
     else:
-        ui_convert_form_values['circrna_found'].value = ratio
-        ui_convert_form_values['submit_button'].props("disabled=true")
+        form_values['circrna_found'].value = ratio
+        form_values['submit_button'].props("disabled=true")
 
     return str(found) + " of " + str(len(circrna_list)) + " CircRNA IDs found"
 
 
-def ui_file_upload_handler(file) -> None:
+def ui_file_upload_handler(form_values, file) -> None:
     data = file.content.decode('UTF-8')
-    check_text_field_input(data)
-    ui_convert_form_values['uploaded_data'] = data
+    check_text_field_input(form_values, data)
+    form_values['uploaded_data'] = data
 
 
-def ui_layout_add_left_drawer(convert=False) -> None:
+def ui_layout_add_left_drawer(form_values, convert=False) -> None:
     with ui.left_drawer(top_corner=True, bottom_corner=False).style(
             'background-color: #d7e3f4;').props('width=390').classes(
         'q-py-none').classes('q-my-none'):
@@ -646,11 +792,18 @@ def ui_layout_add_left_drawer(convert=False) -> None:
                     "text-decoration: underline;")
 
                 # Manually adding Coordinates here, as it's not a real DB field
-                ui_convert_form_values['db_checkbox'] = ui.select(
+                form_values['db_checkbox'] = ui.select(
                     ["Coordinates"] + util.select_db_columns,
                     value="Coordinates",
                     label="ID format").style("width: 320px")
 
+                form_values['tolerance'] = ui.number(
+                    label="Coordinate tolerance (+/- bp)",
+                    value=0,
+                    min=0,
+                    max=1000,
+                    precision=0).style("width: 320px")
+
                 with ui.column().classes('q-py-none').classes('q-my-none'):
                     ui.label('Step 2: select output fields:').style(
                         "text-decoration: underline;")
@@ -698,13 +851,13 @@ def ui_layout_add_left_drawer(convert=False) -> None:
                                         'size=xs'))
 
                     checkbox_list = db_entries
-                    ui_convert_form_values['db_checkboxes'] = checkbox_list
+                    form_values['db_checkboxes'] = checkbox_list
 
                 with ui.column():
                     ui.label('Step 3: select output format:').style(
                         "text-decoration: underline;")
 
-                    ui_convert_form_values['select2'] = ui.select(
+                    form_values['select2'] = ui.select(
                         {"\t": "Tab-delimited '\\t'",
                          ",": "Comma-delimited ','",
                          ";": "Semicolon-delimited ';'"},
@@ -712,13 +865,13 @@ def ui_layout_add_left_drawer(convert=False) -> None:
                         label="Separator character") \
                         .style("width: 320px")
 
-                    ui_convert_form_values['select3'] = ui.select({"NA": "NA",
-                                                                   "\t": "Tab [\\t]",
-                                                                   "": "Don't print anything"},
-                                                                  value="NA",
-                                                                  label="Placeholder"
-                                                                        " for unavailable "
-                                                                        "fields") \
+                    form_values['select3'] = ui.select({"NA": "NA",
+                                                        "\t": "Tab [\\t]",
+                                                        "": "Don't print anything"},
+                                                       value="NA",
+                                                       label="Placeholder"
+                                                             " for unavailable "
+                                                             "fields") \
                         .style("width: 320px")
 
             else:
@@ -769,7 +922,7 @@ def ui_layout_add_left_drawer(convert=False) -> None:
                                         'size=xs'))
 
                     checkbox_list = db_entries
-                    ui_convert_form_values['db_checkboxes'] = checkbox_list
+                    form_values['db_checkboxes'] = checkbox_list
 
 
 def ui_layout_circrna_header_meta(input_dict, circrna_id):
@@ -872,14 +1025,16 @@ def ui_layout_add_footer_and_right_drawer() -> None:
         ui.label('Database Version ' + util.database_version + ' statistics')
         ui.label('')
 
+        chart_dict, dbsize, chart2_dict = util.get_database_stats(util)
+
         ui.label('Database by species/genome')
 
-        chart = ui.highchart(ui_convert_form_values['chart']).classes(
+        chart = ui.highchart(chart_dict).classes(
             'w-full h-64') \
             .style("height: 330px")
 
         ui.label('Database by CircRNA ID')
-        chart2 = ui.highchart(ui_convert_form_values['chart2']).classes(
+        chart2 = ui.highchart(chart2_dict).classes(
             'w-full h-64') \
             .style("height: 330px")
 
@@ -892,13 +1047,14 @@ def ui_layout_add_footer_and_right_drawer() -> None:
         ui.link(' | © 2024 Jakobi Lab', 'https://jakobilab.org')
 
 
-def ui_query_remove_conditions(container) -> None:
-    if len(ui_query_forms) > 1:
+def ui_query_remove_conditions(container, query_forms) -> None:
+    if len(query_forms) > 1:
         container.remove(-1)
-        del ui_query_forms[-1]
+        del query_forms[-1]
 
 
-def ui_query_add_conditions(container, new=False) -> None:
+def ui_query_add_conditions(container, form_values, query_forms,
+                            new=False) -> None:
     query_values = dict()
 
     with container:
@@ -922,9 +1078,48 @@ def ui_query_add_conditions(container, new=False) -> None:
             query_values['query'] = ui.input(label='Enter search term',
                                              placeholder='start typing',
                                              on_change=lambda e:
-                                             check_query_text_field())
+                                             check_query_text_field(
+                                                 form_values, query_forms))
+
+    query_forms.append(query_values)
+
+
+def ui_get_convert_request(form_values) -> dict:
+    # snapshot of the convert form, the results page is a new page and
+    # only works on these values
+
+    if "uploaded_data" in form_values:
+        circrna_list = form_values['uploaded_data'].split('\n')
+    else:
+        circrna_list = form_values['textfield'].value.split('\n')
+
+    tolerance = 0
+
+    if form_values['db_checkbox'].value == "Coordinates" \
+            and form_values['tolerance'].value:
+        tolerance = int(form_values['tolerance'].value)
+
+    return {'mode': "convert",
+            'input_field': form_values['db_checkbox'].value,
+            'output_fields': check_if_db_is_selected(form_values),
+            'circrna_list': circrna_list,
+            'tolerance': tolerance,
+            'separator': form_values['select2'].value,
+            'empty_char': form_values['select3'].value}
 
-    ui_query_forms.append(query_values)
+
+def ui_get_query_request(form_values, query_forms) -> dict:
+    # snapshot of the query form and all of its conditions
+
+    return {'mode': "query",
+            'output_fields': check_if_db_is_selected(form_values),
+            'conditions': [{key: element.value for key, element
+                            in form.items()} for form in query_forms]}
+
+
+def ui_submit_form(session, form_request) -> None:
+    session['request'] = form_request
+    ui.open(page_application_display_results)
 
 
 # application logic pages
@@ -945,47 +1140,52 @@ databases employ their own naming scheme, making it harder and harder to keep
 track of known circRNAs and their identifiers.
         """)
 
-    ui_convert_form_values['mode'] = "convert"
+    session = get_ui_session()
+
+    # form elements of this page
+    form_values = dict()
 
     # ui.image('https://imgs.xkcd.com/comics/standards.png')
 
-    ui_convert_form_values['textfield'] = ui.input(
+    form_values['textfield'] = ui.input(
         label='Please paste a list of circRNA IDs, one per line:',
         placeholder='start typing',
-        on_change=lambda e: ui_convert_form_values['submit_button'].
-        set_text(check_text_field_input(upload_data=None))). \
-        props('type=textarea rows=18').style(
+        on_change=lambda e: form_values['submit_button'].
+        set_text(check_text_field_input(form_values, upload_data=None))). \
+        props('type=textarea rows=18 debounce=300').style(
         "width: 100%; background-color: #ffffff;").classes('q-pa-md')
 
-    ui_convert_form_values['or'] = ui.label('- OR -')
+    form_values['or'] = ui.label('- OR -')
 
-    ui_convert_form_values['upload'] = ui.upload(
+    form_values['upload'] = ui.upload(
         label="1) Click + to select file "
               "2) upload file via button to the right "
               "3) press 'convert circRNA IDs' button",
-        on_upload=lambda e: ui_file_upload_handler(e.files[0])).style(
+        on_upload=lambda e: ui_file_upload_handler(form_values,
+                                                   e.files[0])).style(
         "width: 100%")
 
     with ui.row():
-        ui_convert_form_values['submit_button'] = \
+        form_values['submit_button'] = \
             ui.button('Convert circRNA IDs', on_click=lambda:
-            ui.open(page_application_display_results)).props("disabled=true")
+            ui_submit_form(session, ui_get_convert_request(form_values))
+                      ).props("disabled=true")
 
-        ui_convert_form_values['example_button'] = \
+        form_values['example_button'] = \
             ui.button('Load example data', on_click=lambda:
-            ui_load_example_data())
+            ui_load_example_data(form_values))
 
-    ui_convert_form_values['circrna_found'] = ui.linear_progress(
+    form_values['circrna_found'] = ui.linear_progress(
         show_value=False,
         value=0).style(
         "width: 60%; ")
 
-    ui_convert_form_values['circrna_found'].set_visibility(False)
-    ui_convert_form_values['submit_notification'] = ui.label('')
+    form_values['circrna_found'].set_visibility(False)
+    form_values['submit_notification'] = ui.label('')
 
     ####################
 
-    ui_layout_add_left_drawer(convert=True)
+    ui_layout_add_left_drawer(form_values, convert=True)
 
     ui_layout_add_footer_and_right_drawer()
 
@@ -996,45 +1196,44 @@ async def page_application_query():
     ui_layout_add_head_html()
     ui_layout_add_header()
 
-    # clear out forms for before form load
-    ui_convert_form_values.clear()
-    ui_query_forms.clear()
+    session = get_ui_session()
 
-    ui_convert_form_values['mode'] = "query"
+    # form elements of this page, conditions are added dynamically
+    form_values = dict()
+    query_forms = list()
 
-    ui_convert_form_values['db_checkboxes'] = []
+    form_values['db_checkboxes'] = []
 
-    ui_convert_form_values['chart'], ui_convert_form_values['dbsize'], \
-    ui_convert_form_values[
-        'chart2'] = util.database_stats(util)
-
-    ui_query_add_conditions(ui.column(), new=False)
+    ui_query_add_conditions(ui.column(), form_values, query_forms, new=False)
 
     condition_row = ui.column()
 
     with ui.row():
-        ui_convert_form_values['submit_query_button'] = \
+        form_values['submit_query_button'] = \
             ui.button('Submit query', on_click=lambda:
-            ui.open(page_application_display_results)).props("disabled=false")
+            ui_submit_form(session, ui_get_query_request(form_values,
+                                                         query_forms))
+                      ).props("disabled=false")
 
-        ui_convert_form_values['add_condition_button'] = \
+        form_values['add_condition_button'] = \
             ui.button('Add condition', on_click=lambda:
-            ui_query_add_conditions(condition_row, new=True))
+            ui_query_add_conditions(condition_row, form_values, query_forms,
+                                    new=True))
 
-        ui_convert_form_values['remove_condition_button'] = \
+        form_values['remove_condition_button'] = \
             ui.button('Remove condition', on_click=lambda:
-            ui_query_remove_conditions(condition_row))
+            ui_query_remove_conditions(condition_row, query_forms))
 
-    ui_convert_form_values['circrna_found'] = ui.linear_progress(
+    form_values['circrna_found'] = ui.linear_progress(
         show_value=False, value=0).style("width: 60%; ")
 
-    ui_convert_form_values['circrna_found'].set_visibility(False)
+    form_values['circrna_found'].set_visibility(False)
 
     ####################
 
-    # ui_convert_form_values['db_checkboxes'] =
+    # form_values['db_checkboxes'] =
 
-    ui_layout_add_left_drawer()
+    ui_layout_add_left_drawer(form_values)
 
     ui_layout_add_footer_and_right_drawer()
 
@@ -1046,30 +1245,44 @@ async def page_application_display_results():
 
     session_id = str(uuid4())
 
-    # this just makes sure we built the landing page first
-    if 'mode' in ui_convert_form_values:
-
-        processed_output, ui_convert_form_values[
-            'table2'] = ui_generate_result_table()
+    form_request = get_ui_session().get('request')
 
-        if not os.path.isdir("tmp/"):
-            os.makedirs("tmp/")
+    # this just makes sure a form was submitted in this browser first
+    if form_request:
 
         try:
-            with open('tmp/' + session_id + ".csv", 'w') as f:
-                f.write(processed_output)
-        except FileNotFoundError:
-            print("Output file could not be created")
-            exit(-1)
+            result = ui_get_result_source(form_request)
+        except common.QueryTooExpensiveError as error:
+            ui.html('<strong>Your query was too expensive and has been '
+                    'aborted.</strong><br/>' + str(error) +
+                    '<br/><a href=\"/\">Returning to main page</a>'
+                    ).style('text-align:center;')
+            return
+        except ValueError as error:
+            ui.html('<strong>Invalid query: ' + str(error) + '</strong>'
+                    '<br/><a href=\"/\">Returning to main page</a>'
+                    ).style('text-align:center;')
+            return
+
+        # query results are downloaded as tab-separated table without header
+        if form_request['mode'] == "convert":
+            result.update({'header': True,
+                           'separator': form_request['separator'],
+                           'empty_char': form_request['empty_char']})
+        else:
+            result.update({'header': False,
+                           'separator': "\t",
+                           'empty_char': "NA"})
 
-        f.close()
+        result['time'] = time.time()
+        ui_results[session_id] = result
 
-        app.add_static_files('/download', 'tmp')
+        ui_generate_result_grid(session_id, result['fields'])
 
         with ui.row().classes('self-center'):
             ui.button('Download table',
-                      on_click=lambda e: ui.open(
-                          '/download/' + session_id + ".csv")) \
+                      on_click=lambda e: ui.download(
+                          '/api/results/' + session_id + "/download")) \
                 .classes('self-center')
 
             ui.button('New query',
@@ -1694,6 +1907,10 @@ async def page_news():
         "<img style='text-align: center' src=\"static/news_small.png\">").style(
         'text-align: center; padding:10px;')
 
+    import feedparser
+    from dateutil import tz
+    from dateutil.parser import parse
+
     # get feed
     d = feedparser.parse(util.news_url)
 
@@ -1795,6 +2012,14 @@ class ConvertModel(BaseModel):
     input: str
     output: List[str]
     query: List[str]
+    tolerance: int = 0
+
+    @validator('tolerance')
+    def coordinate_tolerance_check(cls, v):
+        if v < 0:
+            raise ValueError('Coordinate tolerance has to be a '
+                             'positive number.')
+        return v
 
     @validator('query', each_item=True)
     def circrna_id_pattern_check(cls, v):
@@ -1842,6 +2067,12 @@ class ConstraintModel(BaseModel):
     operator1: str
     operator2: str
 
+    @validator('query', pre=True)
+    def query_check(cls, v):
+        if not isinstance(v, str):
+            raise ValueError('No query provided.')
+        return v
+
     @validator('query')
     def circrna_id_pattern_check(cls, v):
         if not check_circrna_input_regex(v):
@@ -1851,7 +2082,8 @@ class ConstraintModel(BaseModel):
     @validator('field')
     def field_name_check(cls, v):
 
-        fields_allowed = list(util.external_db_urls.keys())
+        # same fields as the query form, see ui_get_query_sql()
+        fields_allowed = list(util.db_columns)
 
         if v not in fields_allowed:
             raise ValueError("Unsupported input field provided."
@@ -1893,11 +2125,105 @@ class QueryModel(BaseModel):
 
 @app.post("/api/convert")
 async def process_api_convert_call(data: ConvertModel):
-    data, table = ui_generate_result_table(data.input, data.output, data.query)
+    try:
+        data, table = ui_generate_result_table(data.input, data.output,
+                                               data.query, data.tolerance)
+    except common.QueryTooExpensiveError as error:
+        return JSONResponse(status_code=400, content=error.as_dict())
     return table
 
 
 @app.post("/api/query")
 async def process_api_query_call(data: QueryModel):
-    out, table = ui_generate_result_table(data.input, data.output)
+    try:
+        out, table = ui_generate_result_table(data.input, data.output)
+    except common.QueryTooExpensiveError as error:
+        return JSONResponse(status_code=400, content=error.as_dict())
+    except ValueError as error:
+        return JSONResponse(status_code=400, content={"error": str(error)})
     return table
+
+
+# Data class for the result grid, mirrors the AG Grid getRows() parameters
+class ResultPageModel(BaseModel):
+    startRow: int = 0
+    endRow: int = ui_result_page_size
+    sortModel: List[dict] = []
+    filterModel: dict = {}
+
+
+@app.post("/api/results/{result_id}")
+async def process_result_page_call(result_id: str, data: ResultPageModel):
+    result = ui_results.get(result_id)
+
+    if not result:
+        return JSONResponse(status_code=404,
+                            content={"error": "Result expired, please "
+                                              "submit the form again."})
+
+    result['time'] = time.time()
+
+    start_row = max(0, data.startRow)
+    limit = max(0, min(data.endRow - start_row, 10 * ui_result_page_size))
+
+    order_by = [(column['colId'], column.get('sort') == "desc")
+                for column in data.sortModel
+                if column.get('colId') in result['fields']]
+
+    try:
+        output = util.run_paged_query(util,
+                                      result['sql'],
+                                      result['parameters'],
+                                      ui_get_grid_filters(data.filterModel,
+                                                          result['fields']),
+                                      order_by,
+                                      limit,
+                                      start_row)
+    except common.QueryTooExpensiveError as error:
+        return JSONResponse(status_code=400, content=error.as_dict())
+
+    rows = [ui_result_table_render_row(line, result['fields'])
+            for line in output]
+
+    # the row count is known once a window is not filled completely
+    last_row = start_row + len(rows) if len(rows) < limit else -1
+
+    return {'rows': rows, 'lastRow': last_row}
+
+
+@app.get("/api/results/{result_id}/download")
+async def process_result_download_call(result_id: str, request: Request):
+    result = ui_results.get(result_id)
+
+    if not result:
+        return JSONResponse(status_code=404,
+                            content={"error": "Result expired, please "
+                                              "submit the form again."})
+
+    result['time'] = time.time()
+
+    batches = util.stream_sql_query(util, result['sql'], result['parameters'])
+
+    # the first batch is fetched before the response is sent, so a failing
+    # query still becomes an error response instead of an empty file
+    try:
+        first_batch = next(batches, [])
+    except common.QueryTooExpensiveError as error:
+        return JSONResponse(status_code=400, content=error.as_dict())
+    except sqlite3.Error as error:
+        return JSONResponse(status_code=400, content={"error": str(error)})
+
+    headers = {'Content-Disposition': 'attachment; filename="circhemy.' +
+               ("tsv" if result['separator'] == "\t" else "csv") + '"'}
+
+    # nearly every client accepts gzip, the others get plain text
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+
+    if compress:
+        headers['Content-Encoding'] = "gzip"
+
+    batches = itertools.chain([first_batch], batches)
+
+    return StreamingResponse(ui_stream_result_download(result, batches,
+                                                       compress),
+                             media_type="text/plain", headers=headers)
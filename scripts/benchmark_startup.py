@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+parser = argparse.ArgumentParser(
+    prog="benchmark_startup.py",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    fromfile_prefix_chars="@",
+    description="Measures import time of the circhemy entry points and the "
+                "wall time of CLI calls that should not need the database\n"
+                "\n"
+                "Version 0.0.1\n"
+                "\n"
+                "https://github.com/jakobilab/circhemy\n"
+                "https://jakobilab.org\n"
+                "tjakobi@arizona.edu",
+
+    usage=""" benchmark_startup [<args>]"""
+)
+
+group = parser.add_argument_group("benchmark parameters")
+
+group.add_argument("-m",
+                   "--modules",
+                   dest="modules",
+                   nargs="+",
+                   default=["circhemy.circhemy_cli", "circhemy.circhemy_web"],
+                   help="entry point modules to import"
+                   )
+
+group.add_argument("-r",
+                   "--repeats",
+                   dest="repeats",
+                   type=int,
+                   default=10,
+                   help="number of runs per measurement; default: 10"
+                   )
+
+args = parser.parse_args()
+
+
+def get_import_time(module):
+
+    # -X importtime reports the cumulative import time in microseconds,
+    # the last line belongs to the top-level module
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import " + module],
+                            capture_output=True, text=True)
+
+    if result.returncode:
+        return None
+
+    last_line = result.stderr.strip().splitlines()[-1]
+
+    return int(last_line.split("|")[1]) / 1000
+
+
+def get_database_opened(module):
+
+    # importing an entry point must not open or download the database
+    result = subprocess.run([sys.executable, "-c",
+                             "import " + module + "\n"
+                             "from circhemy.common.util import Util\n"
+                             "print(bool(Util.db_connection))"],
+                            capture_output=True, text=True)
+
+    return result.stdout.strip()
+
+
+def get_call_time(arguments):
+
+    start = time.perf_counter()
+
+    subprocess.run([sys.executable, "-m", "circhemy.circhemy_cli"] +
+                   arguments, capture_output=True)
+
+    return (time.perf_counter() - start) * 1000
+
+
+print("\t".join(["entry point", "median ms", "min ms", "database opened"]))
+
+for module in args.modules:
+
+    timings = [get_import_time(module) for run in range(args.repeats)]
+
+    if None in timings:
+        print(module + "\timport failed")
+        continue
+
+    print("\t".join([module + " (import)",
+                     "%.1f" % statistics.median(timings),
+                     "%.1f" % min(timings),
+                     get_database_opened(module)]))
+
+for arguments in [["--version"], ["--help"], ["convert", "--help"]]:
+
+    timings = [get_call_time(arguments) for run in range(args.repeats)]
+
+    print("\t".join(["circhemy " + " ".join(arguments),
+                     "%.1f" % statistics.median(timings),
+                     "%.1f" % min(timings),
+                     "-"]))
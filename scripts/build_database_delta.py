@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+# own util functions
+import circhemy.common.util as common
+from circhemy.common import delta
+
+# create util instance
+util = common.Util
+
+parser = argparse.ArgumentParser(
+    prog="build_database_delta.py",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    fromfile_prefix_chars="@",
+    description="Creates the delta patch between two circhemy database "
+                "releases and adds it to the update manifest\n"
+                "\n"
+                "Version 0.0.1\n"
+                "\n"
+                "https://github.com/jakobilab/circhemy\n"
+                "https://jakobilab.org\n"
+                "tjakobi@arizona.edu",
+
+    usage=""" build_database_delta [<args>]"""
+)
+
+group = parser.add_argument_group("input parameters")
+
+group.add_argument("-o",
+                   "--old",
+                   dest="old_database",
+                   help="The SQLite3 database file of the previous release",
+                   required=True
+                   )
+
+group.add_argument("-n",
+                   "--new",
+                   dest="new_database",
+                   help="The SQLite3 database file of the new release",
+                   required=True
+                   )
+
+group = parser.add_argument_group("output parameters")
+
+group.add_argument("-d",
+                   "--directory",
+                   dest="directory",
+                   help="Update directory holding the manifest and all "
+                        "delta files",
+                   required=True
+                   )
+
+args = parser.parse_args()
+
+old_connection = sqlite3.connect(args.old_database)
+new_connection = sqlite3.connect(args.new_database)
+
+from_version = util.get_local_database_version(util, old_connection)
+to_version = util.get_local_database_version(util, new_connection)
+
+release_date = new_connection.execute(
+    "SELECT Date FROM " + util.database_table_name + "_db_info "
+    "WHERE Version = ?", (to_version,)).fetchall()[0][0]
+
+print("Creating delta from version " + from_version + " to " + to_version)
+
+os.makedirs(args.directory, exist_ok=True)
+
+delta_file = "circhemy_" + from_version + "_" + to_version + ".delta.gz"
+
+changes = delta.write_delta(os.path.join(args.directory, delta_file),
+                            old_connection,
+                            new_connection,
+                            util.database_table_name,
+                            util.all_db_columns,
+                            from_version,
+                            to_version,
+                            release_date)
+
+for action in changes:
+    print(util.db_action_codes[action] + ":\t" + str(changes[action]))
+
+hash_md5 = hashlib.md5()
+
+with open(os.path.join(args.directory, delta_file), "rb") as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+        hash_md5.update(chunk)
+
+# add the new delta to the manifest, older deltas stay available
+manifest_path = os.path.join(args.directory, "latest.json")
+
+if os.path.isfile(manifest_path):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+else:
+    manifest = {"deltas": {}}
+
+manifest['version'] = to_version
+manifest['deltas'][from_version] = {"file": delta_file,
+                                    "md5": hash_md5.hexdigest()}
+
+with open(manifest_path, "w") as f:
+    json.dump(manifest, f, indent=2)
+
+print("Manifest " + manifest_path + " updated")
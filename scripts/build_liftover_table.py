@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import sqlite3
+
+# own util functions
+import circhemy.common.util as common
+
+# create util instance
+util = common.Util
+
+parser = argparse.ArgumentParser(
+    prog="build_liftover_table.py",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    fromfile_prefix_chars="@",
+    description="Materializes the cross-genome-build mapping table "
+                "(hg19<->hg38, mm9<->mm10, rn5<->rn6) of a circhemy "
+                "SQLite database\n"
+                "\n"
+                "Version 0.0.1\n"
+                "\n"
+                "https://github.com/jakobilab/circhemy\n"
+                "https://jakobilab.org\n"
+                "tjakobi@arizona.edu",
+
+    usage=""" build_liftover_table [<args>]"""
+)
+
+group = parser.add_argument_group("input parameters")
+
+group.add_argument("-d",
+                   "--database",
+                   dest="database",
+                   default="../circhemy/data/circhemy.sqlite3",
+                   help="The SQLite3 database file",
+                   required=True
+                   )
+
+args = parser.parse_args()
+
+db_connection = sqlite3.connect(args.database, isolation_level=None)
+
+print("Building cross-genome-build mapping table for " + args.database)
+
+mappings = util.build_liftover_table(util, db_connection)
+
+print(str(mappings) + " cross-build mappings created.")
+
+db_connection.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import sqlite3
+import tarfile
+
+# own util functions
+import circhemy.common.util as common
+from circhemy.common.lookup_index import build_lookup_index
+
+# create util instance
+util = common.Util
+
+parser = argparse.ArgumentParser(
+    prog="build_lookup_index.py",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    fromfile_prefix_chars="@",
+    description="Builds the memory-mapped lookup index files of a circhemy "
+                "SQLite database and packs them for deployment\n"
+                "\n"
+                "Version 0.0.1\n"
+                "\n"
+                "https://github.com/jakobilab/circhemy\n"
+                "https://jakobilab.org\n"
+                "tjakobi@arizona.edu",
+
+    usage=""" build_lookup_index [<args>]"""
+)
+
+group = parser.add_argument_group("input parameters")
+
+group.add_argument("-d",
+                   "--database",
+                   dest="database",
+                   default="../circhemy/data/circhemy.sqlite3",
+                   help="The SQLite3 database file",
+                   required=True
+                   )
+
+group.add_argument("-c",
+                   "--columns",
+                   dest="columns",
+                   nargs="+",
+                   default=util.lookup_index_columns,
+                   help="ID columns to index; default: all ID columns"
+                   )
+
+group.add_argument("-m",
+                   "--md5",
+                   dest="md5",
+                   help="md5 checksum of the released circhemy.sqlite3.gz, "
+                        "installations address the database file by it; "
+                        "default: read from <database>.gz.md5"
+                   )
+
+group = parser.add_argument_group("output parameters")
+
+group.add_argument("-o",
+                   "--output",
+                   dest="output",
+                   default="../circhemy/data/index",
+                   help="Output directory for the index files"
+                   )
+
+group.add_argument("-a",
+                   "--archive",
+                   dest="archive",
+                   default="../circhemy/data/circhemy_index.tar.gz",
+                   help="Archive of all index files for deployment"
+                   )
+
+args = parser.parse_args()
+
+db_connection = sqlite3.connect(args.database)
+
+os.makedirs(args.output, exist_ok=True)
+
+# index files are tied to the release they were built from
+database_version = util.get_local_database_version(util, db_connection)
+
+# and only used with the database file of exactly this checksum
+database_checksum = args.md5
+
+if not database_checksum:
+    with open(args.database + ".gz.md5") as f:
+        database_checksum = f.read().strip().split()[0]
+
+with tarfile.open(args.archive, "w:gz") as archive:
+
+    for column in args.columns:
+
+        path = os.path.join(args.output, column + ".idx")
+
+        records = build_lookup_index(db_connection,
+                                     util.database_table_name,
+                                     column,
+                                     path,
+                                     database_version,
+                                     database_checksum)
+
+        print(column + ":\t" + str(records) + " keys indexed")
+
+        archive.add(path, arcname=column + ".idx")
+
+db_connection.close()
+
+print("Index archive written to " + args.archive)
@@ -66,5 +66,13 @@ EOF
 
 bzip2 -d -c ../circhemy/data/circhemy_data.csv.bz2 | sqlite3 --init "$commandfile" ../circhemy/data/circhemy.sqlite3
 
-echo "Data import finished, creating bzipped2 file for deployment"
+echo "Data import finished, building cross-genome-build mapping table"
+
+python3 build_liftover_table.py -d ../circhemy/data/circhemy.sqlite3
+
+echo "Mapping table ready, building lookup index files"
+
+python3 build_lookup_index.py -d ../circhemy/data/circhemy.sqlite3
+
+echo "Lookup index files ready, creating bzipped2 file for deployment"
 bzip2 -f -k --best ../circhemy/data/circhemy.sqlite3
@@ -0,0 +1,176 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# the tests run against a small database built from circhemy_schema.sql
+# in a temporary cache directory, the released database is never needed
+
+import atexit
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+# has to be set before circhemy is imported, the database location is
+# resolved at import time
+cache_dir = tempfile.mkdtemp(prefix="circhemy-tests-")
+
+atexit.register(shutil.rmtree, cache_dir, True)
+
+os.environ['CIRCHEMY_CACHE_DIR'] = cache_dir
+os.environ['CIRCHEMY_NO_DAEMON'] = "1"
+
+for variable in ["CIRCHEMY_PROFILE", "CIRCHEMY_QUERY_TIMEOUT",
+                 "CIRCHEMY_QUERY_MAX_STEPS", "CIRCHEMY_CONFIG"]:
+    os.environ.pop(variable, None)
+
+import circhemy  # noqa: E402
+import circhemy.common.util as common  # noqa: E402
+
+util = common.Util
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+fixture_genes = ["ATF6", "MYH9", "NPPA", "TTN"]
+
+fixture_circrnas_per_gene = 5
+
+fixture_release_date = 1712000000
+
+
+def get_fixture_rows():
+
+    # every circRNA exists in hg19 and hg38, both rows share the
+    # build-independent IDs, CSNv1 names only exist for hg38
+    rows = []
+
+    for gene_number, gene in enumerate(fixture_genes, start=1):
+        for circrna in range(1, fixture_circrnas_per_gene + 1):
+            number = (gene_number - 1) * fixture_circrnas_per_gene + circrna
+            start = gene_number * 1000000 + circrna * 1000
+
+            for genome, offset in [("hg19", 0), ("hg38", 50000)]:
+                rows.append(
+                    {"Species": "homo_sapiens",
+                     "Gene": gene,
+                     "Description": "desc " + gene,
+                     "ENSEMBL": "ENSG%011d" % gene_number,
+                     "Entrez": 1000 + gene_number,
+                     "circBase": "hsa_circ_%07d" % number,
+                     "CircAtlas2": "hsa-%s_%04d" % (gene, circrna),
+                     "circBank": "hsa_circ%s_%03d" % (gene, circrna),
+                     "CSNv1": "circ%s(%d)" % (gene, circrna)
+                     if genome == "hg38" else None,
+                     "Chr": "chr%d" % gene_number,
+                     "Start": start + offset,
+                     "Stop": start + offset + 500,
+                     "Strand": "+",
+                     "Genome": genome})
+
+    return rows
+
+
+def build_fixture_database(path, rows=None, version=util.database_version,
+                           date=fixture_release_date):
+
+    # plain database file as built by the release scripts
+    with open(os.path.join(os.path.dirname(circhemy.__file__), "data",
+                           "circhemy_schema.sql")) as f:
+        schema = f.read()
+
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+
+    for circrna_id, row in enumerate(rows or get_fixture_rows(), start=1):
+        connection.execute(
+            "INSERT INTO circhemy (CircRNA_ID, " + ", ".join(row) +
+            ") VALUES (?, " + ", ".join(["?"] * len(row)) + ")",
+            [circrna_id] + list(row.values()))
+
+    connection.execute("INSERT INTO circhemy_db_info (Version, Date) "
+                       "VALUES (?, ?)", (version, date))
+    connection.commit()
+    connection.close()
+
+
+def reset_util():
+
+    # Util keeps its state in the class, every test starts from a closed
+    # database without budget or profiling
+    if util.db_connection:
+        util.db_connection.close()
+
+    util.db_connection = ""
+    util.keep_database_open = False
+    util.database_stats_cache = None
+    util.membership_sets.clear()
+    util.query_profile_log = ""
+    util.query_profile_logger = None
+    util.set_query_budget(util, 0, 0)
+
+
+@pytest.fixture(scope="session")
+def database():
+
+    # installed like a database of an older circhemy version, circhemy
+    # index builds the indexes, lookup index files and the content-addressed
+    # file the tests run on
+    path = util.database_location
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    build_fixture_database(path)
+    util.build_database_indexes(util, path)
+
+    return path
+
+
+@pytest.fixture
+def db(database):
+
+    reset_util()
+    util.ensure_database(util)
+
+    yield util
+
+    reset_util()
+
+
+def run_cli(*arguments, stdin=None, cwd=None):
+
+    # runs the circhemy command line in a new process on the fixture
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [repository] + ([environment['PYTHONPATH']]
+                        if environment.get('PYTHONPATH') else []))
+
+    return subprocess.run([sys.executable, "-m", "circhemy.circhemy_cli"] +
+                          list(arguments),
+                          input=stdin,
+                          capture_output=True,
+                          text=True,
+                          cwd=cwd,
+                          env=environment)
+
+
+@pytest.fixture
+def cli(database):
+    return run_cli
@@ -0,0 +1,136 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# golden output of the command line on the fixture database
+
+import gzip
+import json
+import os
+
+import pytest
+
+from conftest import fixture_genes, fixture_circrnas_per_gene
+
+convert_output = "hsa-ATF6_0001\thsa_circ_0000001\thg19\n" \
+                 "hsa-ATF6_0001\thsa_circ_0000001\thg38\n" \
+                 "hsa-MYH9_0001\thsa_circ_0000006\thg19\n" \
+                 "hsa-MYH9_0001\thsa_circ_0000006\thg38\n"
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "mmap", "auto"])
+def test_convert(cli, engine):
+    result = cli("convert", "-q", "hsa_circ_0000001", "hsa_circ_0000006",
+                 "-i", "circBase", "-o", "CircAtlas2", "circBase", "Genome",
+                 "--engine", engine)
+
+    assert result.returncode == 0, result.stderr
+    assert sorted(result.stdout.splitlines()) == \
+        convert_output.splitlines()
+
+
+def test_convert_stdin_stream(cli):
+    result = cli("convert", "-q", "STDIN", "--stream", "--batch-size", "1",
+                 "-i", "circBase", "-o", "CircAtlas2", "circBase", "Genome",
+                 stdin="hsa_circ_0000001\nhsa_circ_0000006\n")
+
+    assert result.returncode == 0, result.stderr
+    assert sorted(result.stdout.splitlines()) == \
+        convert_output.splitlines()
+
+
+def test_convert_output_dir(cli, tmp_path):
+    first = tmp_path / "first.txt"
+    second = tmp_path / "second.txt.gz"
+
+    first.write_text("hsa_circ_0000001\n")
+
+    with gzip.open(second, "wt") as f:
+        f.write("hsa_circ_0000006\n")
+
+    output_dir = tmp_path / "converted"
+
+    result = cli("convert", "-q", str(first), str(second), "--jobs", "2",
+                 "-i", "circBase", "-o", "CircAtlas2", "--format", "jsonl",
+                 "--output-dir", str(output_dir))
+
+    assert result.returncode == 0, result.stderr
+    assert sorted(os.listdir(output_dir)) == ["first.jsonl",
+                                              "second.jsonl.gz"]
+
+    with gzip.open(output_dir / "second.jsonl.gz", "rt") as f:
+        assert [json.loads(line) for line in f] == \
+            [{"CircAtlas2": "hsa-MYH9_0001"}] * 2
+
+    # IDs and input files can not be mixed
+    result = cli("convert", "-q", str(first), "hsa_circ_0000006",
+                 "-i", "circBase", "-o", "CircAtlas2",
+                 "--output-dir", str(output_dir))
+
+    assert result.returncode != 0
+    assert "-q takes either IDs or input files" in result.stdout
+
+
+def test_convert_budget_keeps_output_readable(cli, tmp_path):
+    output = tmp_path / "out.tsv.gz"
+
+    result = cli("convert", "-q", "STDIN", "-i", "Gene", "-o", "circBase",
+                 "--engine", "sqlite", "--max-steps", "10", "-O", str(output),
+                 stdin="\n".join(fixture_genes) + "\n")
+
+    assert result.returncode != 0
+    assert "query too expensive" in result.stderr
+
+    # the writer was closed, the gzip stream is complete
+    with gzip.open(output, "rt") as f:
+        f.read()
+
+
+def test_query(cli):
+    result = cli("query", "-o", "circBase", "-G", "*atf", "-g", "hg38")
+
+    assert result.returncode == 0, result.stderr
+    assert sorted(line.split("\t")[0] for line in
+                  result.stdout.splitlines()) == \
+        ["hsa_circ_%07d" % number
+         for number in range(1, fixture_circrnas_per_gene + 1)]
+
+
+def test_export(cli, tmp_path):
+    output = tmp_path / "mapping.tsv.gz"
+
+    result = cli("export", "-f", "circBase", "Genome", "--genome", "hg19",
+                 "-O", str(output))
+
+    assert result.returncode == 0, result.stderr
+
+    with gzip.open(output, "rt") as f:
+        lines = f.read().splitlines()
+
+    assert len(lines) == len(fixture_genes) * fixture_circrnas_per_gene
+    assert all(line.endswith("\thg19") for line in lines)
+
+
+def test_bench_engine(cli):
+    result = cli("bench", "-n", "5", "--engine", "mmap")
+
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+
+    assert report['settings']['engine'] == "mmap"
+    assert report['workloads']['convert:circBase']['items'] == 5
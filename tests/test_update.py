@@ -0,0 +1,134 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# delta updates run on their own cache directory, the shared fixture
+# database of the other tests stays untouched
+
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from circhemy.common import delta
+
+from conftest import (build_fixture_database, fixture_release_date,
+                      repository, reset_util, util)
+
+new_version = "2024.10"
+
+
+@pytest.fixture
+def release(tmp_path):
+
+    # installed release, the next release and the update directory
+    database = str(tmp_path / "cache" / util.database_version /
+                   "circhemy.sqlite3")
+
+    os.makedirs(os.path.dirname(database))
+
+    build_fixture_database(database)
+    util.build_database_indexes(util, database)
+
+    # next release with one changed, one renamed and one deleted circRNA
+    new_database = str(tmp_path / "new.sqlite3")
+
+    build_fixture_database(new_database, version=new_version,
+                           date=fixture_release_date + 1)
+
+    connection = sqlite3.connect(new_database)
+    connection.execute("UPDATE circhemy SET Description = 'changed' "
+                       "WHERE CircRNA_ID = 1")
+    connection.execute("UPDATE circhemy SET CSNv1 = 'circATF6(new)' "
+                       "WHERE CircRNA_ID = 2")
+    connection.execute("DELETE FROM circhemy WHERE CircRNA_ID = 3")
+    connection.commit()
+    connection.close()
+
+    update_dir = str(tmp_path / "updates")
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = repository
+
+    subprocess.run([sys.executable,
+                    os.path.join(repository, "scripts",
+                                 "build_database_delta.py"),
+                    "-o", database, "-n", new_database, "-d", update_dir],
+                   check=True, capture_output=True, env=environment)
+
+    yield database, update_dir
+
+    reset_util()
+
+
+def test_update_moves_database_to_release_directory(release):
+    database, update_dir = release
+
+    old_file = os.path.realpath(database)
+
+    util.update_database(util, database, update_dir)
+
+    new_file = os.path.realpath(database)
+    cache_dir = os.path.dirname(os.path.dirname(database))
+
+    assert os.path.dirname(new_file) == os.path.join(cache_dir, new_version)
+    assert os.path.realpath(os.path.join(cache_dir, new_version,
+                                         "circhemy.sqlite3")) == new_file
+
+    # the previous file and its index files are gone, the new file comes
+    # with index files stamped with its checksum
+    assert not os.path.exists(old_file)
+    assert not os.path.exists(util.get_lookup_index_dir(util, old_file))
+
+    util.setup_database(util, database)
+
+    assert util.get_local_database_version(util, util.db_connection) == \
+        new_version
+
+    index = util.open_lookup_index(util, "CSNv1")
+
+    assert index is not None
+
+    assert util.run_lookup_index_query(util, ["Description"],
+                                       ["circATF6(new)"], "CSNv1",
+                                       index) == [("desc ATF6",)]
+    index.close()
+
+    # updating again finds the database up to date
+    util.update_database(util, database, update_dir)
+
+    assert os.path.realpath(database) == new_file
+
+
+def test_delta_with_unknown_columns_is_rejected():
+    connection = sqlite3.connect(":memory:")
+
+    for columns, version in [(["Gene", "Gene) VALUES (1); --"], "2024.10"),
+                             (["Gene"], "../2024.10")]:
+        delta_file = io.StringIO(json.dumps({"from": "2024.04",
+                                             "to": version,
+                                             "date": 0,
+                                             "columns": columns,
+                                             "checksum": ""}) + "\n")
+
+        with pytest.raises(ValueError):
+            delta.apply_delta(connection, delta_file, "circhemy", "2024.04",
+                              util.all_db_columns)
@@ -0,0 +1,186 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+
+import pytest
+
+import circhemy.common.util as common
+from circhemy.common import bench
+
+from conftest import fixture_genes, fixture_circrnas_per_gene
+
+# a statement that runs long enough to exceed small step budgets
+expensive_sql = "SELECT a.CircRNA_ID FROM circhemy a, circhemy b, circhemy c"
+
+
+def test_query_shape_collapses_values():
+    shape = common.Util.get_query_shape
+
+    assert shape("SELECT Gene FROM circhemy WHERE circBase IN (?, ?, ?)") == \
+        shape("SELECT Gene FROM circhemy WHERE circBase IN (?, ?)")
+
+    assert shape("WITH Input(Idx, Chr) AS (VALUES (?, ?), (?, ?), (?, ?)) "
+                 "SELECT 1") == \
+        "WITH Input(Idx, Chr) AS (VALUES (?, ...), ...) SELECT 1"
+
+    assert shape("SELECT * FROM circhemy WHERE Gene == 'ATF6'") == \
+        "SELECT * FROM circhemy WHERE Gene == ?"
+
+
+def test_database_is_content_addressed(db):
+    database_file = os.path.realpath(db.database_location)
+
+    hash_md5 = hashlib.md5()
+
+    with open(database_file, "rb") as f:
+        hash_md5.update(f.read())
+
+    assert os.path.basename(database_file) == \
+        "circhemy-" + hash_md5.hexdigest() + ".sqlite3"
+    assert db.database_checksum == hash_md5.hexdigest()
+
+    # indexes are up to date, nothing is rebuilt
+    assert db.build_database_indexes(db, db.database_location) == []
+
+
+def test_lookup_index_matches_database(db):
+    index = db.open_lookup_index(db, "circBase")
+
+    assert index is not None
+    assert index.database_checksum == db.database_checksum
+
+    assert sorted(db.run_lookup_index_query(db, ["Gene"],
+                                            ["hsa_circ_0000001"],
+                                            "circBase", index)) == \
+        sorted(db.run_simple_select_query(db, ["Gene"],
+                                          ["hsa_circ_0000001"],
+                                          "circBase"))
+
+    # index files of other database content are ignored
+    assert db.read_lookup_index(
+        db, os.path.join(db.get_lookup_index_dir(db, db.database_file),
+                         "circBase.idx"), "0" * 32) is None
+
+    index.close()
+
+
+def test_budget_aborts_query(db):
+    db.set_query_budget(db, 0, 1000)
+
+    with pytest.raises(common.QueryTooExpensiveError) as error:
+        db.run_sql_query(db, expensive_sql)
+
+    assert error.value.as_dict()['reason'] == "steps"
+
+
+def test_budget_aborts_streamed_query(db):
+    db.set_query_budget(db, 0, 20000)
+
+    rows = 0
+
+    with pytest.raises(common.QueryTooExpensiveError):
+        for batch in db.stream_sql_query(db, expensive_sql, batch_size=100):
+            rows += len(batch)
+
+    # rows of earlier batches were delivered before the budget ran out
+    assert 0 < rows < (2 * len(fixture_genes) *
+                       fixture_circrnas_per_gene) ** 3
+
+
+def test_streamed_query_is_profiled(db, tmp_path):
+    log_file = str(tmp_path / "profile.jsonl")
+
+    db.enable_query_profiling(db, log_file)
+
+    try:
+        rows = sum(len(batch) for batch in db.stream_sql_query(
+            db, "SELECT CircRNA_ID FROM circhemy", batch_size=7))
+    finally:
+        logger = logging.getLogger("circhemy.profile")
+
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+
+    with open(log_file) as f:
+        entry = json.loads(f.readlines()[-1])
+
+    assert entry['shape'] == "SELECT CircRNA_ID FROM circhemy"
+    assert entry['rows'] == rows
+
+
+def test_keyword_query_binds_parameters(db):
+    keyword_sql, parameters = db.get_keyword_sql(db, {"Gene": "*atf"})
+
+    assert "ATF" not in keyword_sql.upper().replace("GENE", "")
+    assert parameters
+
+    output = db.run_keyword_select_query(db, ["Gene"], keyword_sql,
+                                         parameters)
+
+    assert {line[0] for line in output} == {"ATF6"}
+
+
+def test_paged_query(db):
+    sql = "SELECT CircRNA_ID, Gene, Start FROM circhemy"
+
+    first_page = db.run_paged_query(db, sql, order_by=[("Start", True)],
+                                    limit=3)
+    second_page = db.run_paged_query(db, sql, order_by=[("Start", True)],
+                                     limit=3, offset=3)
+
+    starts = [line[2] for line in first_page + second_page]
+
+    assert starts == sorted(starts, reverse=True)
+
+    filtered = db.run_paged_query(db, sql, filters=[("Gene", "==", "TTN")],
+                                  limit=100)
+
+    assert len(filtered) == 2 * fixture_circrnas_per_gene
+
+    with pytest.raises(ValueError):
+        db.run_paged_query(db, sql, filters=[("Gene", "; DROP", "TTN")])
+
+
+def test_coordinate_tolerance(db):
+    coordinates = db.run_sql_query(
+        db, "SELECT Chr, Start, Stop, circBase FROM circhemy "
+            "WHERE Genome = 'hg19' LIMIT 1")[0]
+
+    query = coordinates[0] + ":" + str(coordinates[1] + 5) + "|" + \
+        str(coordinates[2] - 5)
+
+    assert db.run_simple_select_query(db, ["circBase"], [query],
+                                      "Coordinates") == []
+
+    output = db.run_simple_select_query(db, ["circBase"], [query],
+                                        "Coordinates", tolerance=10)
+
+    assert [line[0] for line in output] == [coordinates[3]]
+
+
+def test_bench_report(db):
+    report = bench.run_benchmark(db, ids_per_field=5, batch_size=2)
+
+    assert report['settings']['engine'] == "sqlite"
+    assert report['workloads']['convert:circBase']['items'] == 5
+    assert report['workloads']['convert:Gene']['items'] == len(fixture_genes)
@@ -0,0 +1,111 @@
+# Copyright (C) 2024 Tobias Jakobi
+#
+# @Author: Tobias Jakobi <tjakobi>
+# @Email:  tjakobi@arizona.edu
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import gzip
+import json
+
+import pytest
+
+from circhemy.common import compression, writers
+
+rows = [("ATF6", 1001, "hsa_circ_0000001", "ATF6"),
+        ("MYH9", None, "hsa_circ_0000006", "MYH9")]
+
+fields = ["Gene", "Entrez", "circBase", "Gene"]
+
+
+def write(output_format, path):
+    writer = writers.get_writer(output_format, str(path), fields)
+
+    try:
+        writer.write_rows(rows[:1])
+        writer.write_rows(rows[1:])
+    finally:
+        writer.close()
+
+
+def test_text_output(tmp_path):
+    write("tsv", tmp_path / "out.tsv")
+
+    assert (tmp_path / "out.tsv").read_text() == \
+        "ATF6\t1001\thsa_circ_0000001\tATF6\n" \
+        "MYH9\tNA\thsa_circ_0000006\tMYH9\n"
+
+
+def test_csv_output(tmp_path):
+    write("csv", tmp_path / "out.csv")
+
+    with open(tmp_path / "out.csv") as f:
+        assert list(csv.reader(f)) == [
+            fields,
+            ["ATF6", "1001", "hsa_circ_0000001", "ATF6"],
+            ["MYH9", "NA", "hsa_circ_0000006", "MYH9"]]
+
+
+def test_json_lines_output_keeps_first_repeated_column(tmp_path):
+    write("jsonl", tmp_path / "out.jsonl")
+
+    with open(tmp_path / "out.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+
+    assert lines == [{"Gene": "ATF6", "Entrez": 1001,
+                      "circBase": "hsa_circ_0000001"},
+                     {"Gene": "MYH9", "Entrez": None,
+                      "circBase": "hsa_circ_0000006"}]
+
+
+def test_parquet_output(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+
+    writer = writers.get_writer("parquet", str(tmp_path / "out.parquet"),
+                                fields + ["Start"])
+
+    try:
+        writer.write_rows([row + (100,) for row in rows] +
+                          [("TTN", "not a number", None, "TTN", "NA")])
+    finally:
+        writer.close()
+
+    table = parquet.read_table(str(tmp_path / "out.parquet"))
+
+    assert table.schema.names == ["Gene", "Entrez", "circBase", "Start"]
+    assert table.column("Entrez").to_pylist() == ["1001", None,
+                                                  "not a number"]
+    assert table.column("Start").to_pylist() == [100, 100, None]
+
+
+def test_compressed_output_is_complete(tmp_path):
+    path = str(tmp_path / "out.tsv.gz")
+
+    # more data than the queue of the compression thread holds at once
+    lines = ["line %d\n" % number for number in range(100000)]
+
+    output = compression.open_output(path)
+
+    try:
+        for line in lines:
+            output.write(line)
+    finally:
+        output.close()
+
+    with gzip.open(path, "rt") as f:
+        assert f.read() == "".join(lines)
+
+    with compression.open_input(path) as f:
+        assert sum(1 for line in f) == len(lines)